@@ -0,0 +1,117 @@
+import os
+import json
+import pickle
+import yaml
+import pandas as pd
+from contextlib import contextmanager
+from loguru import logger
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Paths of the fixture tree, relative to its root like the ones of config.yaml
+MODEL_PATHS = {'recommender_v1_path': 'artifacts/recommender_v1.pkl',
+               'recommender_v2_path': 'artifacts/recommender_v2.pkl',
+               'recommender_v2_bundle_path': 'artifacts/recommender_v2_bundle',
+               'validation_model_v2_path': 'artifacts/validation_model_v2.pkl'}
+
+
+@contextmanager
+def working_directory(path: str):
+    # Every pipeline step reads config.yaml and the data paths relative to the working directory
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def generate_raw_data(n_users: int, n_posts: int, n_views: int, seed: int = 0) -> tuple:
+    from src.data.synthetic import SyntheticDataGenerator
+
+    # A month of the scale tests' skewed feed, the last fifth of it held out as validation data
+    generator = SyntheticDataGenerator(n_users=n_users, n_posts=n_posts, n_views=n_views, seed=seed,
+                                       days=30, validation_share=0.2)
+    feed = pd.concat(list(generator.iter_feed()), ignore_index=True)
+
+    # A tenth of the users never show up in the feed, so the cold-start path is exercised as well
+    active_users = generator.user_data.user_id.values[:max(1, n_users * 9 // 10)]
+    feed = feed[feed.user_id.isin(active_users)]
+
+    # Aggregated per user like DataLoader does
+    split = generator.split_timestamp()
+    train_feed = feed[feed.timestamp < split].rename(columns={'timestamp': 'date'})
+    train_feed = train_feed[['user_id', 'post_id', 'action', 'target', 'date']]
+    validation_views = feed[(feed.timestamp >= split) & (feed.action == 'view')]
+    validation = pd.DataFrame({'liked_posts': validation_views[validation_views.target == 1]
+                              .groupby('user_id').post_id.agg(list),
+                               'viewed_posts': validation_views.groupby('user_id').post_id.agg(list)})
+    validation = validation.dropna().reset_index()
+
+    return generator.user_data, generator.post_data, train_feed, validation
+
+
+def fixture_config(root: str, overrides: dict = None) -> dict:
+    # The repository's config with the model paths of the fixture tree
+    with open(os.path.join(REPO_ROOT, 'config.yaml'), 'r') as file:
+        config = yaml.safe_load(file)
+    config.update(MODEL_PATHS)
+    config.update(overrides or {})
+
+    with open(os.path.join(root, 'config.yaml'), 'w') as file:
+        yaml.safe_dump(config, file, sort_keys=False)
+
+    return config
+
+
+def build_fixture(root: str, n_users: int = 2000, n_posts: int = 500, n_views: int = 100_000, seed: int = 0,
+                  force: bool = False) -> str:
+    root = os.path.abspath(root)
+    params = {'n_users': n_users, 'n_posts': n_posts, 'n_views': n_views, 'seed': seed, 'generator': 'synthetic'}
+    stamp_path = os.path.join(root, 'fixture.json')
+
+    # Datasets and models are reused while the parameters are the same
+    if not force and os.path.exists(stamp_path):
+        with open(stamp_path, 'r') as file:
+            if json.load(file) == params:
+                logger.info(f"Reusing the benchmark fixture in {root}")
+                return root
+
+    logger.info(f"Building the benchmark fixture in {root}: {params}...")
+
+    os.makedirs(os.path.join(root, 'artifacts'), exist_ok=True)
+    config = fixture_config(root)
+
+    from src.data.storage import read_table, write_table, CATEGORICAL_COLUMNS
+    from src.features.build_features import FeatureEngineering
+    from src.models import Recommender, Recommender_v1
+    from src.models.catboost_recommender_v2 import Recommender_validation
+
+    with working_directory(root):
+        users, posts, feed, validation = generate_raw_data(n_users=n_users, n_posts=n_posts, n_views=n_views,
+                                                           seed=seed)
+        write_table(users, config['raw_user_data_path'])
+        write_table(posts, config['raw_post_data_path'])
+        write_table(feed, config['raw_feed_data_path'])
+        write_table(validation, config['validation_data_path'])
+
+        FeatureEngineering().process_data()
+
+        for model, train_path, model_path in [(Recommender_v1, 'train_data_v1_path', 'recommender_v1_path'),
+                                              (Recommender, 'train_data_v2_path', 'recommender_v2_path'),
+                                              (Recommender_validation, 'train_data_v2_path',
+                                               'validation_model_v2_path')]:
+            train = read_table(config[train_path], categories=CATEGORICAL_COLUMNS)
+            recommender = model().fit(train.drop(['user_id', 'post_id', 'target'], axis=1), train.target)
+            with open(config[model_path], 'wb') as file:
+                pickle.dump(recommender, file)
+            if model is Recommender:
+                recommender.save_bundle(config['recommender_v2_bundle_path'])
+
+    with open(stamp_path, 'w') as file:
+        json.dump(params, file)
+
+    logger.info(f"Built the benchmark fixture in {root}")
+
+    return root
@@ -0,0 +1,55 @@
+import time
+import pickle
+import numpy as np
+from typing import Callable
+from loguru import logger
+
+
+def time_calls(function: Callable, repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        function()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+
+    timings = np.asarray(timings) * 1000
+    return {'calls': repeat,
+            'mean_ms': round(float(timings.mean()), 3),
+            'p50_ms': round(float(np.percentile(timings, 50)), 3),
+            'p95_ms': round(float(np.percentile(timings, 95)), 3)}
+
+
+def benchmark_models(config: dict, repeat: int = 200, seed: int = 0) -> dict:
+    from src.app.utils import load_model
+    from src.metrics.evaluate_metrics import evaluate_metrics
+
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    for name in ['recommender_v1', 'recommender_v2', 'recommender_v2_bundle']:
+        model = load_model(config[f"{name}_path"])
+        user_ids = iter(rng.choice(model.user_features.user_ids if hasattr(model, 'user_features')
+                                   else model.user_data.user_id.values, size=repeat + 3))
+
+        logger.info(f"Timing {name}.predict...")
+        results[f"{name}.predict"] = time_calls(lambda: model.predict(user_id=int(next(user_ids)), limit=5),
+                                                repeat=repeat)
+
+        if hasattr(model, '_get_users_features'):
+            user_ids = iter(rng.choice(model.user_features.user_ids, size=repeat + 3))
+            logger.info(f"Timing {name}._get_users_features...")
+            results[f"{name}._get_users_features"] = time_calls(
+                lambda: model._get_users_features(user_id=int(next(user_ids))), repeat=repeat)
+
+    with open(config['validation_model_v2_path'], 'rb') as file:
+        validation_model = pickle.load(file)
+
+    logger.info("Timing evaluate_metrics...")
+    results['evaluate_metrics'] = time_calls(lambda: evaluate_metrics(model=validation_model,
+                                                                      model_name='Recommender_v2'),
+                                             repeat=max(1, repeat // 50), warmup=1)
+
+    return results
@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import argparse
+import platform
+from loguru import logger
+from benchmarks.fixtures import build_fixture, fixture_config, working_directory
+from benchmarks.serving import benchmark_serving, replay_log, zipf_users, InProcessClient, UvicornClient
+from benchmarks.micro import benchmark_models
+
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCHMARKS_PATH, 'baseline.json')
+# Lower is better for latencies, higher for throughput; tail latencies are too noisy to gate on by default
+LOWER_IS_BETTER = ('p50_ms', 'mean_ms')
+TAIL_LATENCIES = ('p95_ms', 'p99_ms')
+HIGHER_IS_BETTER = ('throughput_rps',)
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float, tails: bool = False) -> list:
+    regressions = []
+    current, previous = flatten(results), flatten(baseline)
+    lower_is_better = LOWER_IS_BETTER + TAIL_LATENCIES if tails else LOWER_IS_BETTER
+
+    for key, value in current.items():
+        base = previous.get(key)
+        if not isinstance(base, (int, float)) or not isinstance(value, (int, float)) or base <= 0:
+            continue
+        if key.endswith(lower_is_better) and value > base * (1 + tolerance):
+            regressions.append(f"{key}: {value} vs {base} in the baseline (+{100 * (value / base - 1):.0f}%)")
+        elif key.endswith(HIGHER_IS_BETTER) and value < base * (1 - tolerance):
+            regressions.append(f"{key}: {value} vs {base} in the baseline (-{100 * (1 - value / base):.0f}%)")
+
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serving benchmarks of the recommendation service")
+    parser.add_argument('--fixture-path', default='data/benchmarks/fixture')
+    parser.add_argument('--n-users', type=int, default=2000)
+    parser.add_argument('--n-posts', type=int, default=500)
+    parser.add_argument('--n-views', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests-log', help="JSON-lines requests to replay instead of Zipf-distributed users")
+    parser.add_argument('--n-requests', type=int, default=2000)
+    parser.add_argument('--zipf-exponent', type=float, default=1.1)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--modes', nargs='+', default=['in_process', 'micro'],
+                        choices=['in_process', 'uvicorn', 'micro'])
+    parser.add_argument('--production-model', default='recommender_v2_bundle')
+    parser.add_argument('--executor', default='thread', choices=['thread', 'process'])
+    parser.add_argument('--micro-batching', action='store_true')
+    parser.add_argument('--cache', action='store_true', help="Keep the recommendation cache on")
+    parser.add_argument('--output', default='data/benchmarks/results.json')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--tails', action='store_true', help="Check p95/p99 against the baseline too")
+    parser.add_argument('--update-baseline', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+    requests_log = os.path.abspath(args.requests_log) if args.requests_log else None
+
+    root = build_fixture(args.fixture_path, n_users=args.n_users, n_posts=args.n_posts, n_views=args.n_views,
+                         seed=args.seed)
+    # The service as configured in config.yaml, pointed at the fixture and with the benchmark's switches
+    config = fixture_config(root, overrides={'production_model': args.production_model,
+                                             'served_models': [args.production_model],
+                                             'inference_executor': args.executor,
+                                             'micro_batching_enabled': args.micro_batching,
+                                             'cache_enabled': args.cache,
+                                             'experiment_enabled': False,
+                                             'online_updates_enabled': False,
+                                             'request_logging_enabled': False})
+    # Per-request lines of the models would be timed too
+    logger.disable('src')
+
+    results = {'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                               'cpus': os.cpu_count()},
+               'parameters': {key: value for key, value in vars(args).items()
+                              if key not in ('output', 'baseline', 'tolerance', 'tails', 'update_baseline')}}
+
+    with working_directory(root):
+        if requests_log:
+            user_ids = replay_log(requests_log, limit=args.n_requests)
+        else:
+            from src.data.storage import read_table
+            users = read_table(config['raw_user_data_path'], columns=['user_id']).user_id.values
+            user_ids = zipf_users(users, n_requests=args.n_requests, exponent=args.zipf_exponent, seed=args.seed)
+
+        if 'in_process' in args.modes:
+            results['in_process'] = benchmark_serving(InProcessClient(), user_ids=user_ids,
+                                                      concurrency_levels=args.concurrency)
+        if 'uvicorn' in args.modes:
+            results['uvicorn'] = benchmark_serving(UvicornClient(), user_ids=user_ids,
+                                                   concurrency_levels=args.concurrency)
+        if 'micro' in args.modes:
+            results['micro'] = benchmark_models(config=config, seed=args.seed)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as file:
+        json.dump(results, file, indent=2)
+    logger.info(f"Saved the results to {output_path}")
+
+    if args.update_baseline:
+        with open(baseline_path, 'w') as file:
+            json.dump(results, file, indent=2)
+        logger.info(f"Saved the results as the new baseline {baseline_path}")
+        sys.exit(0)
+
+    if not os.path.exists(baseline_path):
+        logger.warning(f"No baseline at {baseline_path}, run with --update-baseline to create it")
+        sys.exit(0)
+
+    with open(baseline_path, 'r') as file:
+        regressions = compare(results=results, baseline=json.load(file), tolerance=args.tolerance, tails=args.tails)
+    for regression in regressions:
+        logger.warning(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+
+    logger.info(f"No regressions beyond {100 * args.tolerance:.0f}% of the baseline")
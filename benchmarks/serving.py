@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+import numpy as np
+from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+
+REQUEST_TIME = '2021-12-01T00:00:00'
+
+
+def replay_log(path: str, limit: int = None) -> List[int]:
+    # One JSON request per line with the user in "id" (as in the query string) or "user_id"
+    user_ids = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            request = json.loads(line)
+            user_id = request.get('id', request.get('user_id'))
+            if user_id is not None:
+                user_ids.append(int(user_id))
+            if limit is not None and len(user_ids) >= limit:
+                break
+
+    return user_ids
+
+
+def zipf_users(user_ids: np.ndarray, n_requests: int, exponent: float = 1.1, seed: int = 0) -> List[int]:
+    # Hot-user skew: the user of rank r is requested with probability ~ 1 / r ** exponent, ranks shuffled by seed
+    rng = np.random.default_rng(seed)
+    ranked = rng.permutation(user_ids)
+    weights = 1.0 / np.arange(1, len(ranked) + 1) ** exponent
+
+    return rng.choice(ranked, size=n_requests, p=weights / weights.sum()).tolist()
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan, np.nan, np.nan)
+
+    return {'requests': int(len(latencies)) + errors,
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3)}
+
+
+def run_load(send: Callable[[int], bool], user_ids: List[int], concurrency: int) -> dict:
+    # Closed loop: each of the concurrent clients sends its next request as soon as the previous one is answered
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    position = iter(range(len(user_ids)))
+
+    def client():
+        nonlocal errors
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+
+            started = time.perf_counter()
+            ok = send(user_ids[index])
+            latency = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(latency)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client) for _ in range(concurrency)]:
+            future.result()
+
+    return summarize(latencies=latencies, errors=errors, elapsed=time.perf_counter() - started)
+
+
+class InProcessClient:
+    # The app behind the ASGI test client: routing, validation and serialization without a socket
+    def __init__(self):
+        from fastapi.testclient import TestClient
+        from src.app import app
+
+        self._client = TestClient(app)
+
+    def __enter__(self) -> 'InProcessClient':
+        self._client.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._client.__exit__(*exc_info)
+
+    def send(self, user_id: int) -> bool:
+        response = self._client.get('/post/recommendations/', params={'id': user_id, 'time': REQUEST_TIME})
+        return response.status_code == 200
+
+
+class UvicornClient:
+    # The app in its own uvicorn process on a local port, one keep-alive session per client thread
+    def __init__(self, port: int = 8765, startup_timeout: float = 120):
+        self.url = f"http://127.0.0.1:{port}"
+        self.port = port
+        self.startup_timeout = startup_timeout
+
+        self._process = None
+        self._local = threading.local()
+
+    def __enter__(self) -> 'UvicornClient':
+        import requests
+
+        self._process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'src.app:app', '--port', str(self.port),
+                                          '--log-level', 'warning'],
+                                         env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {self._process.returncode}")
+            try:
+                if requests.get(f"{self.url}/health", timeout=1).status_code == 200:
+                    logger.info(f"uvicorn is serving on {self.url}")
+                    return self
+            except requests.ConnectionError:
+                time.sleep(0.2)
+
+        self.__exit__()
+        raise TimeoutError(f"uvicorn did not start in {self.startup_timeout} s")
+
+    def __exit__(self, *exc_info):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait(timeout=30)
+            self._process = None
+
+    def send(self, user_id: int) -> bool:
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.get(f"{self.url}/post/recommendations/", params={'id': user_id, 'time': REQUEST_TIME})
+        return response.status_code == 200
+
+
+def benchmark_serving(client, user_ids: List[int], concurrency_levels: List[int], warmup: int = 50) -> dict:
+    with client:
+        for user_id in user_ids[:warmup]:
+            client.send(user_id)
+
+        results = {}
+        for concurrency in concurrency_levels:
+            logger.info(f"Sending {len(user_ids)} requests with {concurrency} concurrent clients...")
+            results[f"c{concurrency}"] = run_load(send=client.send, user_ids=user_ids, concurrency=concurrency)
+            logger.info(f"Concurrency {concurrency}: {results[f'c{concurrency}']}")
+
+    return results
@@ -1 +1,9 @@
-from .app import app
\ No newline at end of file
+def __getattr__(name):
+    # The service (and its models) is only built when asked for, e.g. by uvicorn's "src.app:app",
+    # so jobs and tests can import the helpers of the package without loading any model
+    if name == 'app':
+        from .app import app
+        globals()['app'] = app
+        return app
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,19 @@
 import yaml
-import pickle
-from fastapi import FastAPI
-from typing import List
+from time import perf_counter
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+from typing import List, Optional, Union
 from datetime import datetime
 from loguru import logger
-from src.app.utils import PostGet, CustomUnpickler
-from src.models import Recommender, Recommender_v1
+from src.app.utils import PostGet, Response, Event
+from src.app.batching import MicroBatcher
+from src.app.inference import InferencePool, PoolOverloadedError
+from src.app.registry import ModelRegistry, served_models
+from src.app.events import EventLog
+from src.app.experiments import Experiment
+from src.app import monitoring
+from src.app.cache import RecommendationCache, InMemoryBackend, SqliteBackend
+from src.app.precomputed import PrecomputedRecommendations
 
 
 app = FastAPI()
@@ -13,16 +21,201 @@ logger.info("Initialized the App!")
 
 with open('config.yaml', 'r') as file:
     config = yaml.safe_load(file)
-    recommender_v1_path = config['recommender_v1_path']
-    recommender_v2_path = config['recommender_v2_path']
+    # The production model and any other served ones stay resident side by side
+    model_paths, production_model = served_models(config)
+    admin_token = config.get('admin_token')
+    micro_batching_enabled = config.get('micro_batching_enabled', False)
+    micro_batching_max_batch_size = config.get('micro_batching_max_batch_size', 32)
+    micro_batching_max_wait_ms = config.get('micro_batching_max_wait_ms', 3)
+    inference_executor = config.get('inference_executor', 'thread')
+    inference_max_workers = config.get('inference_max_workers', 4)
+    inference_max_queue_size = config.get('inference_max_queue_size', 64)
+    cache_enabled = config.get('cache_enabled', False)
+    cache_backend = config.get('cache_backend', 'memory')
+    cache_max_size = config.get('cache_max_size', 100_000)
+    cache_ttl_seconds = config.get('cache_ttl_seconds', 300)
+    cache_sqlite_path = config.get('cache_sqlite_path', 'data/cache/recommendations.sqlite')
+    precomputed_enabled = config.get('precomputed_enabled', False)
+    precomputed_path = config.get('precomputed_path', 'data/precomputed/recommendations.sqlite')
+    precomputed_max_age_hours = config.get('precomputed_max_age_hours', 24)
+    online_updates_enabled = config.get('online_updates_enabled', False)
+    event_log_path = config.get('event_log_path', 'data/events/events.jsonl')
+    experiment_enabled = config.get('experiment_enabled', False)
+    experiment_salt = config.get('experiment_salt', 'recsys_experiment')
+    experiment_groups = config.get('experiment_groups') or {'control': 'recommender_v1', 'test': 'recommender_v2'}
+    request_logging_enabled = config.get('request_logging_enabled', False)
 
-production_model_path = recommender_v2_path
+# Feed events are appended to a log that every model instance follows
+event_log = EventLog(path=event_log_path) if online_updates_enabled else None
 
-production_model = CustomUnpickler(open(production_model_path, 'rb')).load()
-logger.info("Loaded the Model!")
+# The models are loaded by the pool: once for all threads or once in each worker process
+inference_pool = InferencePool(model_paths=model_paths,
+                               executor=inference_executor,
+                               max_workers=inference_max_workers,
+                               max_queue_size=inference_max_queue_size,
+                               event_log_path=event_log_path if online_updates_enabled else None,
+                               request_logging=request_logging_enabled)
+logger.info(f"Loaded the Models {list(model_paths)}!")
 
+micro_batcher = None
+if micro_batching_enabled:
+    micro_batcher = MicroBatcher(pool=inference_pool,
+                                 max_batch_size=micro_batching_max_batch_size,
+                                 max_wait_ms=micro_batching_max_wait_ms,
+                                 max_queue_size=inference_max_queue_size)
 
-@app.get("/post/recommendations/", response_model=List[PostGet])
-def recommended_posts(id: int, time: datetime, limit: int = 5) -> List[PostGet]:
-    recommendations = production_model.predict(user_id=id)
-    return recommendations
+# Keyed by the version of the serving model, so a reloaded model never sees its old entries
+recommendation_cache = None
+if cache_enabled:
+    if cache_backend == 'sqlite':
+        backend = SqliteBackend(path=cache_sqlite_path, max_size=cache_max_size, ttl_seconds=cache_ttl_seconds)
+    else:
+        backend = InMemoryBackend(max_size=cache_max_size, ttl_seconds=cache_ttl_seconds)
+    recommendation_cache = RecommendationCache(backend=backend, model_versions=inference_pool.versions)
+
+# Recommendations of the nightly job, answered without the model while they are fresh and of the served version
+precomputed = None
+if precomputed_enabled:
+    precomputed = PrecomputedRecommendations(path=precomputed_path, max_age_seconds=precomputed_max_age_hours * 3600)
+
+model_registry = ModelRegistry(pool=inference_pool, default_model=production_model, cache=recommendation_cache)
+
+# Users are split between the models of the groups by a hash of user_id, all served by this process
+experiment = Experiment(groups=experiment_groups, salt=experiment_salt) if experiment_enabled else None
+
+# Values already kept elsewhere are read when /metrics is scraped, not on the request path
+monitoring.QUEUE_DEPTH.set_function(lambda: {('inference',): inference_pool.pending,
+                                             ('micro_batching',): micro_batcher.queue.qsize()
+                                             if micro_batcher is not None and micro_batcher.queue is not None else 0})
+monitoring.MODEL_INFO.set_function(lambda: {(name, version): int(name == model_registry.default_model)
+                                            for name, version in model_registry.versions.items()})
+if recommendation_cache is not None:
+    monitoring.CACHE_REQUESTS.set_function(lambda: {('hit',): recommendation_cache.hits,
+                                                    ('miss',): recommendation_cache.misses})
+    monitoring.CACHE_SIZE.set_function(lambda: {(): len(recommendation_cache.backend)})
+if precomputed is not None:
+    monitoring.PRECOMPUTED_REQUESTS.set_function(lambda: {('hit',): precomputed.hits,
+                                                          ('miss',): precomputed.misses,
+                                                          ('stale',): precomputed.stale})
+
+
+@app.on_event("startup")
+async def startup():
+    await inference_pool.start()
+    if micro_batcher is not None:
+        await micro_batcher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if micro_batcher is not None:
+        await micro_batcher.stop()
+    inference_pool.shutdown()
+
+
+@app.get("/health")
+async def health():
+    status = {"status": "ok", "pending_requests": inference_pool.pending,
+              "default_model": model_registry.default_model, "models": model_registry.versions}
+    if recommendation_cache is not None:
+        status["cache"] = recommendation_cache.stats()
+    if precomputed is not None:
+        status["precomputed"] = precomputed.stats()
+    if experiment is not None:
+        status["experiment"] = experiment.summary()
+    return status
+
+
+async def _recommend(model_name: str, user_id: int, limit: int) -> tuple:
+    if precomputed is not None:
+        recommendations = precomputed.get(user_id=user_id, limit=limit, model_name=model_name,
+                                          model_version=model_registry.versions.get(model_name))
+        if recommendations is not None:
+            return recommendations, True
+
+    if recommendation_cache is not None:
+        recommendations = await recommendation_cache.get_async(user_id=user_id, limit=limit, model_name=model_name)
+        if recommendations is not None:
+            return recommendations, True
+
+    try:
+        if micro_batcher is not None:
+            recommendations = await micro_batcher.predict(model_name=model_name, user_id=user_id, limit=limit)
+        else:
+            recommendations = await inference_pool.run(model_name, 'predict', user_id=user_id, limit=limit)
+    except PoolOverloadedError as error:
+        logger.warning(str(error))
+        raise HTTPException(status_code=503, detail="Service is overloaded, try again later")
+
+    if recommendation_cache is not None:
+        await recommendation_cache.set_async(user_id=user_id, limit=limit, value=recommendations,
+                                             model_name=model_name)
+    return recommendations, False
+
+
+@app.get("/post/recommendations/", response_model=Union[Response, List[PostGet]])
+async def recommended_posts(id: int, time: datetime, limit: int = 5,
+                            model: str = None) -> Union[Response, List[PostGet]]:
+    if experiment is None:
+        try:
+            model_name = model_registry.resolve(model)
+        except KeyError as error:
+            raise HTTPException(status_code=404, detail=str(error.args[0]))
+        exp_group = ''
+    else:
+        # In an experiment the user's group picks the model
+        exp_group = experiment.get_exp_group(id)
+        model_name = experiment.model_for(exp_group)
+
+    started = perf_counter()
+    cache_hit, status = False, 'ok'
+    try:
+        recommendations, cache_hit = await _recommend(model_name=model_name, user_id=id, limit=limit)
+    except HTTPException as error:
+        status = str(error.status_code)
+        raise
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        latency = perf_counter() - started
+        monitoring.REQUEST_DURATION.observe(latency, model=model_name, exp_group=exp_group, status=status)
+        if experiment is not None:
+            experiment.record(exp_group=exp_group, latency=latency, cache_hit=cache_hit, error=status != 'ok')
+
+    if experiment is None:
+        return recommendations
+    return Response(exp_group=exp_group, recommendations=recommendations)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(monitoring.REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.post("/events")
+async def ingest_events(events: List[Event]):
+    if event_log is None:
+        raise HTTPException(status_code=404, detail="Online updates are disabled")
+
+    # Applied by the model before its next prediction; cached recommendations stay until their TTL
+    accepted = event_log.append([event.dict() for event in events])
+    return {"accepted": accepted}
+
+
+@app.post("/admin/reload")
+async def reload_models(x_admin_token: Optional[str] = Header(None)):
+    # Without a token in config.yaml nobody may reload
+    if admin_token is None:
+        raise HTTPException(status_code=403, detail="Reloads are disabled: set admin_token in config.yaml")
+    if x_admin_token != admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    # Requests keep being served by the current models until the new ones are loaded
+    try:
+        versions = await model_registry.reload()
+    except Exception as error:
+        logger.exception("Reloading the models failed, keeping the current ones")
+        raise HTTPException(status_code=500, detail=f"Reload failed: {error}")
+
+    return {"default_model": model_registry.default_model, "models": versions}
@@ -0,0 +1,134 @@
+import asyncio
+from typing import List
+from loguru import logger
+from src.app.inference import InferencePool, PoolOverloadedError
+from src.app.monitoring import BATCHES, BATCH_SIZE, REJECTED_REQUESTS
+
+
+class MicroBatcher:
+    def __init__(self, pool: InferencePool, max_batch_size: int = 32, max_wait_ms: float = 3,
+                 max_queue_size: int = 64):
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+
+        self.queue = None
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        # As many batches in flight as the pool has workers, so every worker gets one while the next is gathered
+        self._slots = asyncio.Semaphore(self.pool.max_workers)
+        self._worker = asyncio.create_task(self._run())
+
+        logger.info(f"Started micro-batching: up to {self.max_batch_size} users or {self.max_wait * 1000} ms")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for task in list(self._in_flight):
+            task.cancel()
+
+    async def predict(self, model_name: str, user_id: int, limit: int = 5) -> List[dict]:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((model_name, user_id, limit, future))
+        except asyncio.QueueFull:
+            REJECTED_REQUESTS.inc()
+            raise PoolOverloadedError(f"Micro-batching queue is full: {self.queue.qsize()} waiting requests")
+
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+
+            try:
+                # Requests for different models are scored in one batch per model
+                by_model = {}
+                for model_name, user_id, limit, future in batch:
+                    by_model.setdefault(model_name, []).append((user_id, limit, future))
+
+                for model_name, model_batch in by_model.items():
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._process(model_name, model_batch))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._finished)
+            except Exception as error:
+                # The worker outlives any single batch: its requests fail, the next ones are served
+                logger.exception("Dispatching a micro-batch failed")
+                for _, _, _, future in batch:
+                    self._fail(future, error)
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+
+        # Wait for the first request, then gather more until the window closes or the batch is full
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def _finished(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def _process(self, model_name: str, batch: list):
+        try:
+            await self._score(model_name=model_name, batch=batch)
+        except Exception as error:
+            logger.exception("Scoring a micro-batch failed")
+            for _, _, future in batch:
+                self._fail(future, error)
+
+    async def _score(self, model_name: str, batch: list):
+        user_ids = [user_id for user_id, _, _ in batch]
+        limit = max(limit for _, limit, _ in batch)
+        BATCHES.inc(model=model_name)
+        BATCH_SIZE.observe(len(batch), model=model_name)
+
+        try:
+            recs = await self.pool.run(model_name, 'predict_batch', user_ids=user_ids, limit=limit)
+        except PoolOverloadedError as error:
+            for _, _, future in batch:
+                self._fail(future, error)
+            return
+        except Exception:
+            # One bad request must not fail the others: score them one by one
+            logger.exception("Batch prediction failed, falling back to single predictions")
+            for user_id, user_limit, future in batch:
+                try:
+                    self._resolve(future, await self.pool.run(model_name, 'predict', user_id=user_id,
+                                                              limit=user_limit))
+                except Exception as error:
+                    self._fail(future, error)
+            return
+
+        if len(recs) != len(batch):
+            raise ValueError(f"predict_batch returned {len(recs)} results for {len(batch)} users")
+        for (_, user_limit, future), user_recs in zip(batch, recs):
+            self._resolve(future, user_recs[:user_limit])
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: List[dict]):
+        # The client may have gone away while the batch was scored
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, error: Exception):
+        if not future.done():
+            future.set_exception(error)
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from functools import partial
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from loguru import logger
+
+
+def model_version(model_path: str) -> str:
+    # A retrained or different production model gets a different version
+    stat = os.stat(os.path.join(model_path, 'model.cbm') if os.path.isdir(model_path) else model_path)
+    fingerprint = f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+
+class InMemoryBackend:
+    blocking = False
+
+    def __init__(self, max_size: int = 100_000, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: List[dict]):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+
+            # Least recently used entries go first
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteBackend:
+    EVICTION_INTERVAL = 1000
+    blocking = True
+
+    def __init__(self, path: str, max_size: int = 100_000, ttl_seconds: float = 300):
+        self.path = path
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        # One file shared by every uvicorn worker on the host
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS recommendations (
+                                        key TEXT PRIMARY KEY,
+                                        value TEXT NOT NULL,
+                                        expires_at REAL NOT NULL,
+                                        accessed_at REAL NOT NULL)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS recommendations_accessed_at "
+                                 "ON recommendations (accessed_at)")
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute("SELECT value, expires_at FROM recommendations WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, expires_at = row
+            if expires_at < now:
+                self._connection.execute("DELETE FROM recommendations WHERE key = ?", (key,))
+                return None
+
+            self._connection.execute("UPDATE recommendations SET accessed_at = ? WHERE key = ?", (now, key))
+
+        return json.loads(value)
+
+    def set(self, key: str, value: List[dict]):
+        now = time.time()
+
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?)",
+                                     (key, json.dumps(value), now + self.ttl_seconds, now))
+            self._writes += 1
+
+            # Least recently used entries go first; trimming in bulk keeps writes cheap
+            if self._writes % self.EVICTION_INTERVAL == 0:
+                self._evict(now=now)
+
+    def _evict(self, now: float):
+        self._connection.execute("DELETE FROM recommendations WHERE expires_at < ?", (now,))
+        self._connection.execute("""DELETE FROM recommendations WHERE key IN (
+                                            SELECT key FROM recommendations
+                                            ORDER BY accessed_at DESC
+                                            LIMIT -1 OFFSET ?)""", (self.max_size,))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM recommendations")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
+
+
+class RecommendationCache:
+    def __init__(self, backend, model_versions: Dict[str, str]):
+        self.backend = backend
+        # Entries are keyed by the version of the model that served them, so reloading one model
+        # leaves the entries of the others in place and its own old ones are never hit again
+        self.model_versions = dict(model_versions)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, limit: int, model_name: str = '') -> Optional[List[dict]]:
+        return self._count(self.backend.get(self._key(user_id=user_id, limit=limit, model_name=model_name)))
+
+    def set(self, user_id: int, limit: int, value: List[dict], model_name: str = ''):
+        self.backend.set(self._key(user_id=user_id, limit=limit, model_name=model_name), value)
+
+    async def get_async(self, user_id: int, limit: int, model_name: str = '') -> Optional[List[dict]]:
+        # Blocking backends (sqlite waits on a lock and a busy timeout) are called off the event loop
+        key = self._key(user_id=user_id, limit=limit, model_name=model_name)
+        return self._count(await self._call(self.backend.get, key))
+
+    async def set_async(self, user_id: int, limit: int, value: List[dict], model_name: str = ''):
+        await self._call(self.backend.set, self._key(user_id=user_id, limit=limit, model_name=model_name), value)
+
+    def set_model_versions(self, model_versions: Dict[str, str]):
+        changed = sorted(name for name, version in model_versions.items() if self.model_versions.get(name) != version)
+        if changed:
+            logger.info(f"Models {changed} changed, their cached recommendations are not served anymore")
+        self.model_versions = dict(model_versions)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.backend),
+                "model_versions": self.model_versions}
+
+    def _count(self, value: Optional[List[dict]]) -> Optional[List[dict]]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    async def _call(self, method, *args):
+        if not self.backend.blocking:
+            return method(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(None, partial(method, *args))
+
+    def _key(self, user_id: int, limit: int, model_name: str = '') -> str:
+        return f"{self.model_versions.get(model_name, '')}:{model_name}:{user_id}:{limit}"
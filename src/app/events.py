@@ -0,0 +1,55 @@
+import os
+import json
+import threading
+from typing import List
+from loguru import logger
+
+
+class EventLog:
+    # Append-only log of feed events, one JSON object per line
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def append(self, events: List[dict]) -> int:
+        lines = ''.join(json.dumps(event) + '\n' for event in events)
+
+        # One write per batch, so readers never see half of it as complete lines
+        with self._lock, open(self.path, 'a') as file:
+            file.write(lines)
+
+        return len(events)
+
+
+class EventLogReader:
+    # Follows an EventLog from a byte offset; every process serving a model keeps its own
+    def __init__(self, path: str, from_start: bool = False):
+        self.path = path
+        self.offset = 0
+
+        # By default only events after the model was loaded, the older ones are expected in its training data
+        if not from_start and os.path.exists(path):
+            self.offset = os.path.getsize(path)
+
+    def read(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+
+        # A trailing partial line is left for the next read
+        complete = data[:data.rfind(b'\n') + 1]
+        self.offset += len(complete)
+
+        events = []
+        for line in complete.splitlines():
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping a malformed line of {self.path}")
+
+        return events
@@ -0,0 +1,69 @@
+import time
+import hashlib
+from collections import deque
+from typing import Dict
+import numpy as np
+
+
+class ExperimentStats:
+    # Counters of one experiment group; latencies of the most recent requests only, for the percentiles
+    def __init__(self, window: int = 10_000):
+        self.requests = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latencies = deque(maxlen=window)
+        self.started = time.monotonic()
+
+    def record(self, latency: float, cache_hit: bool = False, error: bool = False):
+        self.requests += 1
+        self.cache_hits += cache_hit
+        self.errors += error
+        self.latency_sum += latency
+        self.latencies.append(latency)
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99]) if self.latencies else (0.0, 0.0, 0.0)
+
+        return {"requests": self.requests,
+                "cache_hits": self.cache_hits,
+                "errors": self.errors,
+                "requests_per_second": round(self.requests / max(elapsed, 1e-9), 3),
+                "latency_mean_ms": round(1000 * self.latency_sum / max(self.requests, 1), 3),
+                "latency_p50_ms": round(1000 * p50, 3),
+                "latency_p95_ms": round(1000 * p95, 3),
+                "latency_p99_ms": round(1000 * p99, 3)}
+
+
+class Experiment:
+    # Stateless assignment: the same user always lands in the same group for the same salt
+    def __init__(self, groups: Dict[str, str], salt: str, buckets: int = 100):
+        if not groups:
+            raise ValueError("An experiment needs at least one group")
+
+        # group name -> name of the model serving it, groups split the buckets evenly in the given order
+        self.groups = dict(groups)
+        self.group_names = list(self.groups)
+        self.salt = salt
+        self.buckets = buckets
+
+        self.stats = {group: ExperimentStats() for group in self.group_names}
+
+    def bucket(self, user_id: int) -> int:
+        digest = hashlib.md5(f"{user_id}{self.salt}".encode()).hexdigest()
+        return int(digest, 16) % self.buckets
+
+    def get_exp_group(self, user_id: int) -> str:
+        return self.group_names[self.bucket(user_id) * len(self.group_names) // self.buckets]
+
+    def model_for(self, exp_group: str) -> str:
+        return self.groups[exp_group]
+
+    def record(self, exp_group: str, latency: float, cache_hit: bool = False, error: bool = False):
+        self.stats[exp_group].record(latency=latency, cache_hit=cache_hit, error=error)
+
+    def summary(self) -> dict:
+        return {"salt": self.salt,
+                "groups": {group: {"model": model, **self.stats[group].summary()}
+                           for group, model in self.groups.items()}}
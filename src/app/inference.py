@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from time import perf_counter
+from functools import partial
+from typing import Dict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from loguru import logger
+from src.app.utils import load_model
+from src.app.events import EventLogReader
+from src.app.cache import model_version
+from src.app.monitoring import INFERENCE_DURATION, STAGE_DURATION, REJECTED_REQUESTS
+from src.models.timing import record_stages
+
+
+class _LoadedModel:
+    def __init__(self, model, version: str, event_reader: EventLogReader = None):
+        self.model = model
+        self.version = version
+        # Live feed events followed by the model, when online updates are on
+        self.event_reader = event_reader
+
+
+# Models used by the executor's workers by name: shared by all threads, or loaded once per worker process.
+# Replaced as a whole on reload, so a call sees either the old set of models or the new one
+_worker_models: Dict[str, _LoadedModel] = {}
+_event_lock = threading.Lock()
+
+
+class PoolOverloadedError(Exception):
+    pass
+
+
+class UnknownModelError(KeyError):
+    pass
+
+
+def _load_worker_models(model_paths: Dict[str, str], versions: Dict[str, str], event_log_path: str = None,
+                        request_logging: bool = False):
+    global _worker_models
+
+    # Loading is always logged, the per-request lines of the models only on demand
+    logger.enable('src.models')
+
+    models = {}
+    for name, model_path in model_paths.items():
+        # Models whose files did not change are kept as they are, with their arrays and their online updates
+        loaded = _worker_models.get(name)
+        if loaded is not None and loaded.version == versions[name]:
+            models[name] = loaded
+            continue
+
+        model = load_model(model_path)
+        event_reader = None
+        if event_log_path is not None:
+            if hasattr(model, 'record_event'):
+                event_reader = EventLogReader(event_log_path)
+            else:
+                logger.warning(f"{type(model).__name__} does not support online updates, ignoring feed events")
+        models[name] = _LoadedModel(model=model, version=versions[name], event_reader=event_reader)
+
+        logger.info(f"Loaded the Model {name} for inference worker from {model_path}")
+
+    _worker_models = models
+
+    if not request_logging:
+        logger.disable('src.models')
+
+
+def _apply_events(loaded: _LoadedModel):
+    # Events logged since the last call are folded into the model's features before it predicts
+    with _event_lock:
+        events = loaded.event_reader.read()
+        applied = sum(loaded.model.record_event(user_id=event['user_id'], post_id=event['post_id'],
+                                                action=event.get('action', 'view'), target=event.get('target', 0))
+                      for event in events)
+
+    if events:
+        logger.debug(f"Applied {applied} of {len(events)} feed events")
+
+
+def _call_model(model_name: str, method: str, kwargs: dict) -> tuple:
+    loaded = _worker_models.get(model_name)
+    if loaded is None:
+        raise UnknownModelError(f"Unknown model: {model_name}")
+
+    if loaded.event_reader is not None:
+        _apply_events(loaded)
+
+    # Stage timings travel back with the result, so they are recorded in the app process in both executors
+    with record_stages() as timings:
+        result = getattr(loaded.model, method)(**kwargs)
+    return result, timings
+
+
+def _is_model_loaded() -> bool:
+    return bool(_worker_models)
+
+
+class InferencePool:
+    def __init__(self, model_paths: Dict[str, str], executor: str = 'thread', max_workers: int = 4,
+                 max_queue_size: int = 64, event_log_path: str = None, request_logging: bool = False):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown inference executor: {executor}")
+
+        self.executor_type = executor
+        self.max_workers = max_workers
+        self.event_log_path = event_log_path
+        self.request_logging = request_logging
+        # Requests beyond the running ones and this many waiting are shed right away
+        self.max_pending = max_workers + max_queue_size
+        self.pending = 0
+
+        self.model_paths = dict(model_paths)
+        self.versions = {name: model_version(path) for name, path in self.model_paths.items()}
+        self.executor = self._new_executor(model_paths=self.model_paths, versions=self.versions)
+
+        logger.info(f"Started {executor} inference pool with {max_workers} workers")
+
+    def _new_executor(self, model_paths: Dict[str, str], versions: Dict[str, str]):
+        if self.executor_type == 'process':
+            return ProcessPoolExecutor(max_workers=self.max_workers,
+                                       initializer=_load_worker_models,
+                                       initargs=(model_paths, versions, self.event_log_path, self.request_logging))
+
+        # CatBoost releases the GIL while predicting, so threads share one set of models
+        _load_worker_models(model_paths, versions, self.event_log_path, self.request_logging)
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+
+    async def start(self):
+        # Spin the worker processes up before the first request instead of on it
+        await self._warm_up(self.executor)
+
+    async def _warm_up(self, executor):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, _is_model_loaded)
+                               for _ in range(self.max_workers)])
+
+    async def load_models(self, model_paths: Dict[str, str]) -> Dict[str, str]:
+        # Called by ModelRegistry, which keeps reloads from overlapping
+        loop = asyncio.get_running_loop()
+        model_paths = dict(model_paths)
+        versions = {name: model_version(path) for name, path in model_paths.items()}
+
+        if self.executor_type == 'thread':
+            # Loaded off the event loop and the inference threads, then swapped in with one assignment
+            await loop.run_in_executor(None, partial(_load_worker_models, model_paths, versions, self.event_log_path,
+                                                     self.request_logging))
+        else:
+            # A new generation of worker processes loads the models while the old one keeps serving;
+            # requests already in the old one finish there before it is shut down
+            executor = self._new_executor(model_paths=model_paths, versions=versions)
+            try:
+                await self._warm_up(executor)
+            except Exception:
+                executor.shutdown(wait=False)
+                raise
+            self.executor, old_executor = executor, self.executor
+            loop.run_in_executor(None, partial(old_executor.shutdown, wait=True))
+
+        self.model_paths, self.versions = model_paths, versions
+
+        return versions
+
+    @property
+    def is_full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    async def run(self, model_name: str, method: str, **kwargs):
+        # Only touched from the event loop, so the counter needs no lock
+        if self.is_full:
+            REJECTED_REQUESTS.inc()
+            raise PoolOverloadedError(f"Inference pool is full: {self.pending} pending requests")
+
+        self.pending += 1
+        started = perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, timings = await loop.run_in_executor(self.executor,
+                                                         partial(_call_model, model_name, method, kwargs))
+        finally:
+            self.pending -= 1
+
+        INFERENCE_DURATION.observe(perf_counter() - started, model=model_name, method=method)
+        for stage, duration in timings.items():
+            STAGE_DURATION.observe(duration, model=model_name, stage=stage)
+
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,154 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+
+# Seconds, from sub-millisecond stages up to slow requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _ValueMetric(_Metric):
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function = None
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]):
+        # Read at scrape time from where the value is already kept, instead of on the request path
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self._function is not None:
+            values.update(self._function())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Counter(_ValueMetric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_ValueMetric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._label_values(labels)] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: counts of each bucket (the last one is +Inf), sum of the observations
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        # Bucket i holds values <= buckets[i]; cumulated only when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+
+        samples = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames, key, extra='le="' + le + '"')
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            samples.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'recsys_request_duration_seconds', "Duration of recommendation requests, cache hits included",
+    labelnames=('model', 'exp_group', 'status')))
+INFERENCE_DURATION = REGISTRY.register(Histogram(
+    'recsys_inference_duration_seconds', "Duration of model calls in the inference pool, queueing included",
+    labelnames=('model', 'method')))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'recsys_stage_duration_seconds', "Duration of the stages of a model call",
+    labelnames=('model', 'stage')))
+REJECTED_REQUESTS = REGISTRY.register(Counter(
+    'recsys_rejected_requests_total', "Requests shed because the inference pool or the batching queue was full"))
+BATCHES = REGISTRY.register(Counter(
+    'recsys_micro_batches_total', "Micro-batches scored", labelnames=('model',)))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    'recsys_micro_batch_size', "Users per micro-batch", labelnames=('model',), buckets=BATCH_SIZE_BUCKETS))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'recsys_cache_requests_total', "Recommendation cache lookups", labelnames=('result',)))
+PRECOMPUTED_REQUESTS = REGISTRY.register(Counter(
+    'recsys_precomputed_requests_total', "Precomputed recommendation table lookups", labelnames=('result',)))
+CACHE_SIZE = REGISTRY.register(Gauge(
+    'recsys_cache_size', "Entries in the recommendation cache"))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'recsys_queue_depth', "Requests waiting or running", labelnames=('queue',)))
+MODEL_INFO = REGISTRY.register(Gauge(
+    'recsys_model_info', "Served models and their versions, 1 for the default model",
+    labelnames=('model', 'version')))
@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+from typing import List, Optional
+from loguru import logger
+
+
+def encode_post_ids(post_ids: List[int]) -> bytes:
+    return np.asarray(post_ids, dtype='<i4').tobytes()
+
+
+def decode_post_ids(value: bytes) -> np.ndarray:
+    return np.frombuffer(value, dtype='<i4')
+
+
+def connect_table(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    connection.execute("CREATE TABLE IF NOT EXISTS posts (post_id INTEGER PRIMARY KEY, text TEXT, topic TEXT)")
+    # Top-N post ids of each user as packed int32, so a lookup is a single primary key read
+    connection.execute("""CREATE TABLE IF NOT EXISTS recommendations (
+                              user_id INTEGER PRIMARY KEY,
+                              post_ids BLOB NOT NULL,
+                              computed_at REAL NOT NULL)""")
+    connection.commit()
+
+    return connection
+
+
+class PrecomputedRecommendations:
+    CHECK_INTERVAL = 10
+
+    def __init__(self, path: str, max_age_seconds: float = 24 * 3600):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        self.model_name = None
+        self.model_version = None
+        self.top_n = 0
+        self.finished_at = None
+
+        self._connection = None
+        self._posts = {}
+        self._file_id = None
+        self._checked_at = -self.CHECK_INTERVAL
+        self._lock = threading.Lock()
+
+        self._reopen_if_changed()
+
+    def get(self, user_id: int, limit: int, model_name: str, model_version: str) -> Optional[List[dict]]:
+        self._reopen_if_changed()
+
+        # Only answers for the very model the table was built with, and as many posts as it keeps
+        if self._connection is None or model_name != self.model_name or model_version != self.model_version \
+                or limit > self.top_n:
+            self.misses += 1
+            return None
+
+        with self._lock:
+            row = self._connection.execute("SELECT post_ids, computed_at FROM recommendations WHERE user_id = ?",
+                                           (user_id,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        post_ids, computed_at = row
+        if computed_at < time.time() - self.max_age_seconds:
+            self.stale += 1
+            return None
+
+        self.hits += 1
+        return [self._posts[post_id] for post_id in decode_post_ids(post_ids)[:limit].tolist()]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "model_name": self.model_name,
+                "model_version": self.model_version,
+                "finished_at": self.finished_at}
+
+    def _reopen_if_changed(self):
+        # The job swaps in a finished table as a new file, picked up here without a restart
+        now = time.monotonic()
+        if now - self._checked_at < self.CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns) == self._file_id:
+            return
+
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        meta = dict(connection.execute("SELECT key, value FROM meta"))
+        posts = {post_id: {'id': post_id, 'text': text, 'topic': topic}
+                 for post_id, text, topic in connection.execute("SELECT post_id, text, topic FROM posts")}
+
+        with self._lock:
+            previous, self._connection = self._connection, connection
+            self._posts = posts
+            self.model_name = meta.get('model_name')
+            self.model_version = meta.get('model_version')
+            self.top_n = int(meta.get('top_n', 0))
+            self.finished_at = meta.get('finished_at')
+            self._file_id = (stat.st_ino, stat.st_mtime_ns)
+        if previous is not None:
+            previous.close()
+
+        logger.info(f"Loaded precomputed recommendations of {self.model_name} ({self.model_version}) "
+                    f"finished at {self.finished_at}")
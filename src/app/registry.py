@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import yaml
+from typing import Dict, List, Tuple
+from loguru import logger
+from src.app.inference import InferencePool
+
+
+def served_models(config: dict) -> Tuple[Dict[str, str], str]:
+    # Every name is resolved through its `<name>_path` key, the production model is always served
+    default_model = config.get('production_model', 'recommender_v2')
+    names = list(dict.fromkeys(config.get('served_models') or []))
+    # Models of the experiment groups are served as well
+    if config.get('experiment_enabled', False):
+        names += [name for name in (config.get('experiment_groups') or {}).values() if name not in names]
+    if default_model not in names:
+        names.append(default_model)
+
+    return {name: config[f"{name}_path"] for name in names}, default_model
+
+
+def combined_version(versions: Dict[str, str]) -> str:
+    # One version for the whole set of served models: changes when any of them does
+    fingerprint = ','.join(f"{name}={version}" for name, version in sorted(versions.items()))
+
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+
+class ModelRegistry:
+    def __init__(self, pool: InferencePool, default_model: str, cache=None):
+        self.pool = pool
+        self.default_model = default_model
+        self.cache = cache
+
+        self._reload_lock = asyncio.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.pool.model_paths)
+
+    @property
+    def versions(self) -> Dict[str, str]:
+        return dict(self.pool.versions)
+
+    @property
+    def version(self) -> str:
+        return combined_version(self.pool.versions)
+
+    def resolve(self, model_name: str = None) -> str:
+        model_name = model_name or self.default_model
+        if model_name not in self.pool.model_paths:
+            raise KeyError(f"Unknown model: {model_name}, served models are {self.names}")
+
+        return model_name
+
+    async def reload(self) -> Dict[str, str]:
+        # Paths and the production model are read again from config.yaml, so models can be added or switched too;
+        # models whose files did not change are kept as they are
+        with open('config.yaml', 'r') as file:
+            model_paths, default_model = served_models(yaml.safe_load(file))
+
+        async with self._reload_lock:
+            logger.info(f"Reloading models {list(model_paths)}...")
+
+            versions = await self.pool.load_models(model_paths)
+            self.default_model = default_model
+            if self.cache is not None:
+                self.cache.set_model_versions(self.versions)
+
+            logger.info(f"Successfully reloaded models {versions}, {default_model} by default")
+
+        return versions
@@ -1,3 +1,4 @@
+import os
 import pickle
 import datetime
 from pydantic import BaseModel
@@ -13,6 +14,13 @@ class PostGet(BaseModel):
         orm_mode = True
 
 
+class Event(BaseModel):
+    user_id: int
+    post_id: int
+    action: str = 'view'
+    target: int = 0
+
+
 class Response(BaseModel):
     exp_group: str
     recommendations: List[PostGet]
@@ -27,4 +35,14 @@ class CustomUnpickler(pickle.Unpickler):
         elif name == 'Recommender':
             from src.models import Recommender
             return Recommender
-        return super().find_class(module, name)
\ No newline at end of file
+        return super().find_class(module, name)
+
+
+def load_model(model_path: str):
+    # Serving bundles are directories, everything else is a pickled Recommender
+    if os.path.isdir(model_path):
+        from src.models import Recommender
+        return Recommender.load_bundle(model_path)
+
+    with open(model_path, 'rb') as file:
+        return CustomUnpickler(file).load()
@@ -1,8 +1,16 @@
 import os
+import time
+import datetime
+import yaml
+import numpy as np
 import pandas as pd
+from typing import Callable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from loguru import logger
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text, bindparam, DateTime
+from sqlalchemy.engine import make_url
+from src.data.storage import read_table, iter_table, remove_table, TableWriter
 
 
 # Load environment variables
@@ -11,112 +19,308 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 
-class DataLoader:
-    def __init__(self, database_url, limit_feed_data = 3_000_000):
-        self.DATABASE_URL = database_url
-        self.LIMIT = limit_feed_data
-
-    def load_data(self):
-        logger.info("Loading data...")
+class _Extraction:
+    # One table pulled as concurrent range partitions, each written to its own part file
+    def __init__(self, name: str, path: str, parts: List[str], futures: list):
+        self.name = name
+        self.path = path
+        self.parts = parts
+        self.futures = futures
+        self.started = time.monotonic()
 
-        user_data = self.load_user_data()
-        post_data = self.load_post_data()
-        feed_data = self.load_feed_data()
-        validation = self.load_validation_data()
+    def finish(self) -> int:
+        rows = sum(future.result() for future in self.futures)
 
-        self.save_to_csv(file_path="data/raw_data", file_name="user_data.csv", data=user_data)
-        self.save_to_csv(file_path="data/raw_data", file_name="post_data.csv", data=post_data)
-        self.save_to_csv(file_path="data/raw_data", file_name="feed_data.csv", data=feed_data)
-        self.save_to_csv(file_path="data/validation_data", file_name="validation_data.csv", data=validation)
-
-        logger.info("Successfully loaded and saved the Data!")
+        # Parts are stitched in range order, one chunk at a time
+        remove_table(self.path)
+        parts = [part for part in self.parts if os.path.exists(part)]
+        with TableWriter(self.path) as writer:
+            for part in parts:
+                for chunk in iter_table(part):
+                    writer.write(chunk)
+            if writer.rows == 0:
+                # No rows is still a table, with the columns of the query when a partition ran it
+                writer.write(read_table(parts[0]) if parts else pd.DataFrame())
+        for part in parts:
+            os.remove(part)
 
-    def _batch_load_sql(self, query: str, database_url: str = DATABASE_URL) -> pd.DataFrame:
-        logger.info("Connecting to Database...")
+        elapsed = time.monotonic() - self.started
+        logger.info(f"Loaded {self.name}: {rows} rows in {elapsed:.1f} s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
 
-        CHUNKSIZE = 200000
-        engine = create_engine(database_url)
-        conn = engine.connect().execution_options(stream_results=True)
+        return rows
 
-        logger.info("Connected to Database")
 
-        chunks = []
-        for chunk_dataframe in pd.read_sql(query, conn, chunksize=CHUNKSIZE):
-            chunks.append(chunk_dataframe)
-        conn.close()
-
-        logger.info("Disconnected from Database")
-
-        return pd.concat(chunks, ignore_index=True)
-
-    def load_user_data(self):
-        logger.info("Loading user_data table...")
-
-        query = """SELECT * 
-                FROM user_data"""
-        result = self._batch_load_sql(query)
-
-        logger.info("Loaded user_data table")
+class DataLoader:
+    CHUNKSIZE = 200000
 
-        return result
+    def __init__(self, database_url, limit_feed_data = 3_000_000, limit_validation_data = 2_000_000):
+        self.DATABASE_URL = database_url
+        self.LIMIT = limit_feed_data
+        self.VALIDATION_LIMIT = limit_validation_data
+
+        # The extensions of these paths choose the file format
+        with open('config.yaml', 'r') as file:
+            config = yaml.safe_load(file)
+            self.user_data_path = config['raw_user_data_path']
+            self.post_data_path = config['raw_post_data_path']
+            self.feed_data_path = config['raw_feed_data_path']
+            self.validation_data_path = config['validation_data_path']
+            self.n_workers = config.get('extraction_workers', 4)
+            self.n_partitions = config.get('extraction_partitions', 8)
+            # Train/validation split of the feed by time; derived from the row limits when not set
+            self.split_timestamp = config.get('feed_data_split_timestamp')
+            self.end_timestamp = config.get('feed_data_end_timestamp')
+
+        self._engine = None
+
+    @property
+    def engine(self):
+        # One pooled engine shared by every partition
+        if self._engine is None:
+            url = make_url(self.DATABASE_URL)
+            # A connection per extraction worker, plus one for the range queries of the main thread
+            pool_options = {} if url.get_backend_name() == 'sqlite' else {'pool_size': self.n_workers + 1,
+                                                                          'max_overflow': 0,
+                                                                          'pool_pre_ping': True}
+            self._engine = create_engine(url, **pool_options)
+        return self._engine
 
-    def load_post_data(self):
-        logger.info("Loading post_text_df table...")
+    def load_data(self):
+        logger.info("Loading data...")
 
-        query = """SELECT * 
-                FROM post_text_df"""
-        result = self._batch_load_sql(query)
+        split, end = self._feed_data_bounds()
+        logger.info(f"Feed data before {split} is train data, from {split} to {end} is validation data")
 
-        logger.info("Loaded post_text_df table")
+        with ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix='extract') as executor:
+            extractions = [self.load_user_data(executor),
+                           self.load_post_data(executor),
+                           self.load_feed_data(executor, end=split),
+                           self.load_validation_data(executor, start=split, end=end)]
+            for extraction in extractions:
+                extraction.finish()
 
-        return result
+        self.engine.dispose()
 
-    def load_feed_data(self, limit=3_000_000):
-        logger.info("Loading feed_data table...")
+        logger.info("Successfully loaded and saved the Data!")
 
-        query = f"""SELECT * 
+    def _read_sql(self, query: str, params: dict):
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True)
+            for chunk_dataframe in pd.read_sql(self._statement(query, params), conn, params=params, chunksize=self.CHUNKSIZE):
+                yield chunk_dataframe
+
+    def _load_partition(self, query: str, params: dict, path: str, transform: Callable = None) -> int:
+        rows = 0
+        with TableWriter(path) as writer:
+            for chunk in self._read_sql(query, params):
+                chunk = transform(chunk) if transform is not None else chunk
+                writer.write(chunk)
+                rows += len(chunk)
+        return rows
+
+    def _extract(self, executor: ThreadPoolExecutor, name: str, path: str, query: str, ranges: List[dict],
+                 transform: Callable = None, partition_loader: Callable = None) -> _Extraction:
+        logger.info(f"Loading {name} in {len(ranges)} partitions...")
+
+        root, extension = os.path.splitext(path)
+        parts = [f"{root}.part{i:04d}{extension}" for i in range(len(ranges))]
+        partition_loader = partition_loader or self._load_partition
+        futures = [executor.submit(partition_loader, query, params, part, transform)
+                   for params, part in zip(ranges, parts)]
+
+        return _Extraction(name=name, path=path, parts=parts, futures=futures)
+
+    def _scalar(self, query: str, params: dict = None):
+        with self.engine.connect() as conn:
+            return conn.execute(self._statement(query, params or {}), params or {}).scalar()
+
+    @staticmethod
+    def _statement(query: str, params: dict):
+        # Timestamps are bound as the dialect stores them, e.g. with the microseconds of SQLite's text format
+        return text(query).bindparams(*[bindparam(name, type_=DateTime) for name, value in params.items()
+                                        if isinstance(value, datetime.datetime) and f":{name}" in query])
+
+    def _key_ranges(self, table: str, key: str, where: str = "1 = 1", params: dict = None) -> List[dict]:
+        params = params or {}
+        low = self._scalar(f"SELECT MIN({key}) FROM {table} WHERE {where}", params)
+        high = self._scalar(f"SELECT MAX({key}) FROM {table} WHERE {where}", params)
+        if low is None:
+            # One partition that matches nothing, so the empty table is still written with its columns
+            return [{**params, 'key_start': 0, 'key_end': 0}]
+
+        bounds = np.unique(np.linspace(low, high + 1, self.n_partitions + 1).astype(np.int64))
+        return [{**params, 'key_start': int(start), 'key_end': int(end)} for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _time_ranges(self, start: pd.Timestamp, end: pd.Timestamp) -> List[dict]:
+        bounds = pd.date_range(start=start, end=end, periods=self.n_partitions + 1)
+        return [{'start': start.to_pydatetime(), 'end': end.to_pydatetime()}
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _feed_data_bounds(self) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        # Rows count limits become timestamps once, then every query is a range scan on timestamp
+        split, end = self.split_timestamp, self.end_timestamp
+
+        if split is None:
+            split = self._timestamp_at_row(self.LIMIT)
+        if end is None and split is not None and self.VALIDATION_LIMIT is not None:
+            end = self._timestamp_at_row(self.VALIDATION_LIMIT, start=pd.Timestamp(split))
+        if end is None:
+            # Past the last interaction: the validation range is open-ended
+            end = pd.Timestamp(self._scalar("SELECT MAX(timestamp) FROM feed_data")) + pd.Timedelta(seconds=1)
+        if split is None:
+            split = end
+
+        return pd.Timestamp(split), pd.Timestamp(end)
+
+    def _timestamp_at_row(self, row: int, start: pd.Timestamp = None) -> pd.Timestamp:
+        # Second of the row-th feed row from start, narrowed down with row counts of fixed-width time ranges:
+        # each count is a range scan of the timestamp index, unlike an OFFSET that reads every row before it
+        low = int(pd.Timestamp(start if start is not None else
+                               self._scalar("SELECT MIN(timestamp) FROM feed_data")).timestamp())
+        high = int(pd.Timestamp(self._scalar("SELECT MAX(timestamp) FROM feed_data")).timestamp()) + 1
+
+        while True:
+            bounds = np.unique(np.linspace(low, high, max(self.n_partitions, 2) + 1).astype(np.int64))
+            for range_start, range_end in zip(bounds[:-1], bounds[1:]):
+                count = self._scalar("SELECT COUNT(*) FROM feed_data WHERE timestamp >= :start AND timestamp < :end",
+                                     {'start': self._from_seconds(range_start), 'end': self._from_seconds(range_end)})
+                if row < count:
+                    break
+                row -= count
+            else:
+                # Fewer rows than that
+                return None
+
+            if range_end - range_start <= 1:
+                return pd.Timestamp(self._from_seconds(range_start))
+            low, high = range_start, range_end
+
+    @staticmethod
+    def _from_seconds(seconds: int):
+        return pd.Timestamp(int(seconds), unit='s').to_pydatetime()
+
+    def load_user_data(self, executor: ThreadPoolExecutor) -> _Extraction:
+        query = """SELECT *
+                FROM user_data
+                WHERE user_id >= :key_start AND user_id < :key_end
+                ORDER BY user_id"""
+        return self._extract(executor=executor, name='user_data table', path=self.user_data_path, query=query,
+                             ranges=self._key_ranges(table='user_data', key='user_id'))
+
+    def load_post_data(self, executor: ThreadPoolExecutor) -> _Extraction:
+        query = """SELECT *
+                FROM post_text_df
+                WHERE post_id >= :key_start AND post_id < :key_end
+                ORDER BY post_id"""
+        return self._extract(executor=executor, name='post_text_df table', path=self.post_data_path, query=query,
+                             ranges=self._key_ranges(table='post_text_df', key='post_id'))
+
+    def load_feed_data(self, executor: ThreadPoolExecutor, end: pd.Timestamp) -> _Extraction:
+        start = pd.Timestamp(self._scalar("SELECT MIN(timestamp) FROM feed_data"))
+
+        query = """SELECT *
                     FROM feed_data
-                    LIMIT {limit}"""
-        result = self._batch_load_sql(query)
-
-        result['date'] = pd.to_datetime(result.timestamp)
-        result = result.drop('timestamp', axis=1)
-
-        logger.info("Loaded feed_data table")
-
-        return result
-    
-    def load_validation_data(self, limit: int = 2_000_000, offset: int = 3_000_000):
-        logger.info("Loading validation data...")
-
-        query = f"""SELECT
-                      user_id,
-                      ARRAY_AGG(subquery.post_id) FILTER (WHERE target = 1) as liked_posts,
-                      ARRAY_AGG(subquery.post_id) as viewed_posts
-                    FROM
-                      (
-                        SELECT
-                          *
-                        FROM
-                          feed_data
-                        LIMIT
-                          {limit} OFFSET {offset}
-                      ) as subquery
-                    GROUP BY
-                      user_id
-                    """
-        result = self._batch_load_sql(query)
-
-        logger.info("Loaded validation data...")
-
-        return result
-
-    def save_to_csv(self, file_path: str, file_name: str, data: pd.DataFrame, sep: str = ';'):
-        logger.info(f"Saving {file_path}/{file_name}...")
-
-        data.to_csv(f"{file_path}/{file_name}", sep=sep, index=False)
-
-        logger.info(f"Saved {file_path}/{file_name}")
+                    WHERE timestamp >= :start AND timestamp < :end
+                    ORDER BY timestamp"""
+        return self._extract(executor=executor, name='feed_data table', path=self.feed_data_path, query=query,
+                             ranges=self._time_ranges(start=start, end=end), transform=self._to_date)
+
+    def load_validation_data(self, executor: ThreadPoolExecutor, start: pd.Timestamp,
+                             end: pd.Timestamp) -> _Extraction:
+        # Partitions hold whole users, so each one aggregates its users' posts on its own
+        where = "timestamp >= :start AND timestamp < :end"
+        params = {'start': start.to_pydatetime(), 'end': end.to_pydatetime()}
+
+        query = f"""SELECT user_id, post_id, target
+                    FROM feed_data
+                    WHERE {where} AND user_id >= :key_start AND user_id < :key_end
+                    ORDER BY user_id, timestamp"""
+        return self._extract(executor=executor, name='validation data', path=self.validation_data_path, query=query,
+                             ranges=self._key_ranges(table='feed_data', key='user_id', where=where, params=params),
+                             partition_loader=self._load_validation_partition)
+
+    def load_delta(self, since: pd.Timestamp, feed_delta_path: str) -> int:
+        # Users and posts are small and reloaded whole, the feed only after the high-water mark of the last refresh
+        if os.path.exists(feed_delta_path):
+            os.remove(feed_delta_path)
+
+        # The delta stops where validation starts: a window set in config.yaml stays put, the one of the row
+        # limits moves forward to the latest rows and the rows it leaves become train data
+        split, end = self.split_timestamp, self.end_timestamp
+        moves_validation = split is None and self.VALIDATION_LIMIT is not None
+        if moves_validation:
+            rows_since = self._scalar("SELECT COUNT(*) FROM feed_data WHERE timestamp >= :since",
+                                      {'since': since.to_pydatetime()})
+            split = self._timestamp_at_row(max(rows_since - self.VALIDATION_LIMIT, 0), start=since)
+        if end is None:
+            end = pd.Timestamp(self._scalar("SELECT MAX(timestamp) FROM feed_data")) + pd.Timedelta(seconds=1)
+        split = pd.Timestamp(end if split is None else split)
+        has_delta = split > since
+
+        query = """SELECT *
+                    FROM feed_data
+                    WHERE timestamp > :since AND timestamp >= :start AND timestamp < :end
+                    ORDER BY timestamp"""
+
+        with ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix='extract') as executor:
+            extractions = [self.load_user_data(executor), self.load_post_data(executor)]
+            if has_delta:
+                ranges = [{**params, 'since': since.to_pydatetime()}
+                          for params in self._time_ranges(start=since, end=split)]
+                extractions.append(self._extract(executor=executor, name='feed_data delta', path=feed_delta_path,
+                                                 query=query, ranges=ranges, transform=self._to_date))
+                if moves_validation:
+                    logger.info(f"Validation data moves to the feed from {split} to {end}")
+                    extractions.append(self.load_validation_data(executor, start=split, end=end))
+            rows = [extraction.finish() for extraction in extractions]
+
+        self.engine.dispose()
+
+        if not has_delta:
+            logger.info(f"No new feed data since {since}")
+            return 0
+
+        return rows[2]
+
+    def _load_validation_partition(self, query: str, params: dict, path: str, transform: Callable = None) -> int:
+        # Rows come ordered by user: all users of a chunk but its last one are complete and written right away
+        rows = 0
+        pending = None
+
+        with TableWriter(path) as writer:
+            for chunk in self._read_sql(query, params):
+                rows += len(chunk)
+                if pending is not None:
+                    chunk = pd.concat([pending, chunk], ignore_index=True)
+                if chunk.empty:
+                    continue
+
+                is_last_user = chunk.user_id == chunk.user_id.iloc[-1]
+                pending = chunk[is_last_user]
+                if not is_last_user.all():
+                    writer.write(self._aggregate_validation(chunk[~is_last_user]))
+
+            if pending is not None:
+                writer.write(self._aggregate_validation(pending))
+            else:
+                writer.write(pd.DataFrame(columns=['user_id', 'liked_posts', 'viewed_posts']))
+
+        return rows
+
+    @staticmethod
+    def _aggregate_validation(feed: pd.DataFrame) -> pd.DataFrame:
+        grouped = feed.groupby('user_id', sort=True)
+        validation = pd.DataFrame({'liked_posts': feed[feed.target == 1].groupby('user_id').post_id.agg(list),
+                                   'viewed_posts': grouped.post_id.agg(list)})
+        # An empty list for users without likes, so the column has the same type in every chunk
+        validation['liked_posts'] = [posts if isinstance(posts, list) else [] for posts in validation.liked_posts]
+
+        return validation[['liked_posts', 'viewed_posts']].reset_index()
+
+    @staticmethod
+    def _to_date(chunk: pd.DataFrame) -> pd.DataFrame:
+        chunk['date'] = pd.to_datetime(chunk.timestamp)
+        return chunk.drop('timestamp', axis=1)
 
     def _find_feed_data_sub_filename(self, limit):
         if limit / 1_000_000 >= 1:
@@ -132,4 +336,3 @@ class DataLoader:
 if __name__ == '__main__':
     data = DataLoader(database_url=DATABASE_URL)
     data.load_data()
-    
\ No newline at end of file
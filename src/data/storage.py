@@ -0,0 +1,190 @@
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+from typing import Iterator, List
+from loguru import logger
+
+
+# The file extension of a path in config.yaml chooses its format
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+CSV_SEP = ';'
+# Low-cardinality string columns, stored dictionary-encoded in the columnar formats
+CATEGORICAL_COLUMNS = ['action', 'country', 'city', 'os', 'source', 'topic']
+# Appended tables become a directory of these files, read in name order
+PARTITION_PREFIX = 'part-'
+
+
+def table_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown table format of {path}, expected one of {sorted(FORMATS)}")
+
+    return FORMATS[extension]
+
+
+def table_partitions(path: str) -> List[str]:
+    if not os.path.isdir(path):
+        return [path]
+
+    extension = os.path.splitext(path)[1]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.startswith(PARTITION_PREFIX) and name.endswith(extension)]
+
+
+def remove_table(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _arrow_to_pandas(table, categories: List[str] = None) -> pd.DataFrame:
+    # Only the requested columns come back as categoricals, the rest as plain values
+    categories = set(categories or [])
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) and field.name not in categories:
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+        elif not pa.types.is_dictionary(field.type) and field.name in categories:
+            table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+
+    return table.replace_schema_metadata(None).to_pandas()
+
+
+def read_table(path: str, columns: List[str] = None, categories: List[str] = None) -> pd.DataFrame:
+    file_format = table_format(path)
+    partitions = table_partitions(path)
+
+    if file_format == 'csv':
+        frames = [pd.read_csv(partition, sep=CSV_SEP, index_col=None, usecols=columns,
+                              dtype={column: 'category' for column in categories or []}) for partition in partitions]
+        # Categories of the partitions differ, they are unified once they are concatenated
+        return frames[0] if len(frames) == 1 else _to_categories(pd.concat(frames, ignore_index=True), categories)
+
+    if file_format == 'parquet':
+        tables = [pq.read_table(partition, columns=columns, read_dictionary=categories) for partition in partitions]
+    else:
+        tables = [feather.read_table(partition, columns=columns, memory_map=True) for partition in partitions]
+
+    # Partitions encode their dictionaries on their own
+    table = pa.concat_tables(tables).unify_dictionaries() if len(tables) > 1 else tables[0]
+
+    return _arrow_to_pandas(table, categories=categories)
+
+
+def iter_table(path: str, columns: List[str] = None, chunksize: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    file_format = table_format(path)
+
+    for partition in table_partitions(path):
+        if file_format == 'csv':
+            yield from pd.read_csv(partition, sep=CSV_SEP, index_col=None, usecols=columns, chunksize=chunksize)
+
+        elif file_format == 'parquet':
+            for batch in pq.ParquetFile(partition).iter_batches(batch_size=chunksize, columns=columns):
+                yield _arrow_to_pandas(pa.Table.from_batches([batch]))
+
+        else:
+            # Memory-mapped, so only the chunk being converted is materialized
+            table = feather.read_table(partition, columns=columns, memory_map=True)
+            for start in range(0, table.num_rows, chunksize):
+                yield _arrow_to_pandas(table.slice(start, chunksize))
+
+
+def _to_categories(data: pd.DataFrame, categories: List[str] = None) -> pd.DataFrame:
+    categories = [column for column in categories or [] if column in data.columns]
+    if not categories:
+        return data
+
+    return data.astype({column: 'category' for column in categories})
+
+
+def write_table(data: pd.DataFrame, path: str, categories: List[str] = CATEGORICAL_COLUMNS):
+    file_format = table_format(path)
+    # A full write replaces the partitions of an appended table
+    if os.path.isdir(path):
+        remove_table(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    logger.info(f"Saving {path}...")
+
+    if file_format == 'csv':
+        data.to_csv(path, sep=CSV_SEP, index=False)
+    elif file_format == 'parquet':
+        _to_categories(data, categories).to_parquet(path, index=False)
+    else:
+        _to_categories(data, categories).reset_index(drop=True).to_feather(path)
+
+    logger.info(f"Saved {path}")
+
+
+class TableWriter:
+    # Appends DataFrame chunks to one table file
+    def __init__(self, path: str):
+        self.path = path
+        self.format = table_format(path)
+        self.rows = 0
+
+        self._schema = None
+        self._writer = None
+
+        if os.path.isdir(path):
+            remove_table(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def write(self, data: pd.DataFrame):
+        if self.format == 'csv':
+            # The first chunk starts the file over
+            data.to_csv(self.path, sep=CSV_SEP, index=False, mode='w' if self.rows == 0 else 'a',
+                        header=self.rows == 0)
+        else:
+            table = pa.Table.from_pandas(data, schema=self._schema, preserve_index=False)
+
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = self._open_writer(schema=table.schema)
+            self._writer.write_table(table)
+
+        self.rows += len(data)
+
+    def _open_writer(self, schema):
+        if self.format == 'parquet':
+            return pq.ParquetWriter(self.path, schema)
+
+        return pa.ipc.new_file(self.path, schema)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+        logger.info(f"Saved {self.rows} rows to {self.path}")
+
+    def __enter__(self) -> 'TableWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def append_table(data: pd.DataFrame, path: str):
+    if not os.path.exists(path):
+        return write_table(data=data, path=path)
+
+    if table_format(path) == 'csv' and not os.path.isdir(path):
+        data.to_csv(path, sep=CSV_SEP, index=False, mode='a', header=False)
+        logger.info(f"Appended {len(data)} rows to {path}")
+        return
+
+    # Columnar files are immutable: the table becomes a directory and the new rows its next partition file
+    extension = os.path.splitext(path)[1]
+    if not os.path.isdir(path):
+        moved = f"{path}.{PARTITION_PREFIX}00000"
+        os.replace(path, moved)
+        os.makedirs(path)
+        os.replace(moved, os.path.join(path, f"{PARTITION_PREFIX}00000{extension}"))
+
+    partitions = table_partitions(path)
+    number = int(os.path.basename(partitions[-1])[len(PARTITION_PREFIX):-len(extension)]) + 1 if partitions else 0
+    write_table(data=data, path=os.path.join(path, f"{PARTITION_PREFIX}{number:05d}{extension}"))
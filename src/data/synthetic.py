@@ -0,0 +1,203 @@
+import os
+import yaml
+import numpy as np
+import pandas as pd
+from typing import Iterator, Tuple
+from loguru import logger
+from sqlalchemy import create_engine, text
+from src.data.storage import write_table, TableWriter
+
+
+TOPICS = ['business', 'covid', 'entertainment', 'sport', 'politics', 'tech', 'movie']
+TOPIC_WORDS = {'business': ['market', 'shares', 'profit', 'bank', 'company', 'deal', 'growth', 'investors'],
+               'covid': ['virus', 'vaccine', 'cases', 'lockdown', 'hospital', 'masks', 'pandemic', 'testing'],
+               'entertainment': ['music', 'album', 'show', 'star', 'festival', 'awards', 'band', 'concert'],
+               'sport': ['match', 'team', 'goal', 'season', 'coach', 'league', 'players', 'cup'],
+               'politics': ['election', 'government', 'minister', 'vote', 'party', 'law', 'parliament', 'policy'],
+               'tech': ['phone', 'software', 'chip', 'users', 'internet', 'app', 'data', 'launch'],
+               'movie': ['film', 'actor', 'director', 'scene', 'plot', 'cinema', 'story', 'character']}
+COMMON_WORDS = ['the', 'a', 'new', 'year', 'people', 'said', 'first', 'time', 'last', 'world', 'after', 'big']
+# Country -> (share of users, cities)
+COUNTRIES = {'Russia': (0.7, ['Moscow', 'Saint Petersburg', 'Novosibirsk', 'Yekaterinburg', 'Omsk']),
+             'Ukraine': (0.1, ['Kyiv', 'Kharkiv', 'Odesa']),
+             'Belarus': (0.07, ['Minsk', 'Gomel']),
+             'Azerbaijan': (0.05, ['Baku']),
+             'Kazakhstan': (0.05, ['Almaty', 'Nur-Sultan']),
+             'Finland': (0.03, ['Helsinki'])}
+
+
+def _power_law_weights(n: int, exponent: float, rng: np.random.Generator) -> np.ndarray:
+    # Zipf-like shares over shuffled ranks: a few heavy users or posts and a long tail
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+class SyntheticDataGenerator:
+    def __init__(self, n_users: int = 10_000, n_posts: int = 2_000, n_views: int = 1_000_000, seed: int = 0,
+                 user_skew: float = 0.8, post_skew: float = 1.0, like_rate: float = 0.12,
+                 start: str = '2021-10-01', days: int = 90, validation_share: float = 0.1,
+                 chunksize: int = 1_000_000):
+        self.n_users = n_users
+        self.n_posts = n_posts
+        self.n_views = n_views
+        self.seed = seed
+        self.user_skew = user_skew
+        self.post_skew = post_skew
+        self.like_rate = like_rate
+        self.start = pd.Timestamp(start)
+        self.days = days
+        # The last part of the period is held out like DataLoader does, when writing files
+        self.validation_share = validation_share
+        self.chunksize = chunksize
+
+        rng = np.random.default_rng(seed)
+        self.user_data = self._generate_users(rng)
+        self.post_data = self._generate_posts(rng)
+
+        # Who views what: skewed activity and popularity; who likes it: propensity, post quality, topic affinity
+        self.user_weights = _power_law_weights(n_users, exponent=user_skew, rng=rng)
+        self.post_weights = _power_law_weights(n_posts, exponent=post_skew, rng=rng)
+        self.user_propensity = rng.lognormal(mean=0, sigma=0.5, size=n_users)
+        self.post_quality = rng.lognormal(mean=0, sigma=0.4, size=n_posts)
+        self.favorite_topics = rng.integers(0, len(TOPICS), n_users)
+        self.post_topics = pd.Categorical(self.post_data.topic, categories=TOPICS).codes
+
+    def _generate_users(self, rng: np.random.Generator) -> pd.DataFrame:
+        countries = list(COUNTRIES)
+        shares = np.array([COUNTRIES[country][0] for country in countries])
+        country = rng.choice(countries, size=self.n_users, p=shares / shares.sum())
+        city = np.array([rng.choice(COUNTRIES[name][1]) for name in country])
+
+        return pd.DataFrame({'user_id': np.arange(200, 200 + self.n_users),
+                             'gender': rng.integers(0, 2, self.n_users),
+                             'age': np.clip(14 + rng.gamma(shape=3, scale=6, size=self.n_users), 14, 95).astype(int),
+                             'country': country,
+                             'city': city,
+                             'exp_group': rng.integers(0, 5, self.n_users),
+                             'os': rng.choice(['Android', 'iOS'], size=self.n_users, p=[0.65, 0.35]),
+                             'source': rng.choice(['ads', 'organic'], size=self.n_users, p=[0.45, 0.55])})
+
+    def _generate_posts(self, rng: np.random.Generator) -> pd.DataFrame:
+        topics = rng.choice(TOPICS, size=self.n_posts, p=rng.dirichlet(np.full(len(TOPICS), 5)))
+        lengths = np.clip(rng.lognormal(mean=3.5, sigma=0.6, size=self.n_posts), 5, 400).astype(int)
+
+        # Mostly the words of the post's topic, the rest common ones
+        texts = []
+        for topic, length in zip(topics, lengths):
+            words = np.where(rng.random(length) < 0.6, rng.choice(TOPIC_WORDS[topic], length),
+                             rng.choice(COMMON_WORDS, length))
+            texts.append(' '.join(words).capitalize() + '.')
+
+        return pd.DataFrame({'post_id': np.arange(1, self.n_posts + 1), 'text': texts, 'topic': topics})
+
+    def iter_feed(self) -> Iterator[pd.DataFrame]:
+        # Chunk i covers the i-th slice of the period, so chunks come out in timestamp order
+        n_chunks = max(1, -(-self.n_views // self.chunksize))
+        seconds = self.days * 86_400
+        bounds = np.linspace(0, seconds, n_chunks + 1).astype(np.int64)
+        user_ids = self.user_data.user_id.values
+        post_ids = self.post_data.post_id.values
+
+        for i in range(n_chunks):
+            rng = np.random.default_rng([self.seed, i])
+            size = min(self.chunksize, self.n_views - i * self.chunksize)
+
+            users = rng.choice(self.n_users, size=size, p=self.user_weights)
+            posts = rng.choice(self.n_posts, size=size, p=self.post_weights)
+            offsets = np.sort(rng.integers(bounds[i], max(bounds[i + 1], bounds[i] + 1), size))
+
+            affinity = np.where(self.post_topics[posts] == self.favorite_topics[users], 2.5, 0.7)
+            like_probability = np.clip(self.like_rate * self.user_propensity[users] * self.post_quality[posts] * affinity,
+                                       0, 0.95)
+            target = (rng.random(size) < like_probability).astype(np.int64)
+            timestamps = self.start + pd.to_timedelta(offsets, unit='s')
+
+            views = pd.DataFrame({'timestamp': timestamps, 'user_id': user_ids[users], 'post_id': post_ids[posts],
+                                  'action': 'view', 'target': target})
+            # A like is its own row a few seconds after the view, with target 0 as in feed_data
+            likes = views[target == 1].assign(action='like', target=0)
+            likes['timestamp'] += pd.to_timedelta(rng.integers(1, 30, len(likes)), unit='s')
+
+            yield pd.concat([views, likes]).sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+    def split_timestamp(self) -> pd.Timestamp:
+        return self.start + pd.Timedelta(seconds=int(self.days * 86_400 * (1 - self.validation_share)))
+
+    def write_files(self, user_data_path: str, post_data_path: str, feed_data_path: str,
+                    validation_data_path: str) -> Tuple[int, int]:
+        # The raw files DataLoader would have produced: feed before the split with `date`, validation lists after it
+        logger.info(f"Generating {self.n_views} views of {self.n_posts} posts by {self.n_users} users...")
+
+        write_table(self.user_data, user_data_path)
+        write_table(self.post_data, post_data_path)
+
+        split = self.split_timestamp()
+        validation_chunks = []
+        with TableWriter(feed_data_path) as writer:
+            for chunk in self.iter_feed():
+                is_train = chunk.timestamp < split
+                if is_train.any():
+                    writer.write(chunk[is_train].rename(columns={'timestamp': 'date'})
+                                 [['user_id', 'post_id', 'action', 'target', 'date']])
+                views = chunk[~is_train & (chunk.action == 'view')]
+                validation_chunks.append(views[['user_id', 'post_id', 'target']])
+            train_rows = writer.rows
+
+        feed = pd.concat(validation_chunks, ignore_index=True)
+        validation = pd.DataFrame({'liked_posts': feed[feed.target == 1].groupby('user_id').post_id.agg(list),
+                                   'viewed_posts': feed.groupby('user_id').post_id.agg(list)})
+        validation = validation[['liked_posts', 'viewed_posts']].reset_index()
+        write_table(validation, validation_data_path)
+
+        logger.info(f"Generated {train_rows} train feed rows and validation data of {len(validation)} users")
+
+        return train_rows, len(validation)
+
+    def write_database(self, database_url: str) -> int:
+        # The tables of the course database, for DataLoader to extract from: SQLite locally, or Postgres
+        logger.info(f"Writing {self.n_views} views of {self.n_posts} posts by {self.n_users} users to the database...")
+
+        engine = create_engine(database_url)
+        self.user_data.to_sql('user_data', engine, index=False, if_exists='replace', chunksize=10_000)
+        self.post_data.to_sql('post_text_df', engine, index=False, if_exists='replace', chunksize=10_000)
+
+        rows = 0
+        for i, chunk in enumerate(self.iter_feed()):
+            chunk.to_sql('feed_data', engine, index=False, if_exists='replace' if i == 0 else 'append',
+                         chunksize=100_000)
+            rows += len(chunk)
+            logger.info(f"Written {rows} feed_data rows")
+
+        # DataLoader queries by key and time ranges
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_data_user_id ON user_data (user_id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_post_text_df_post_id ON post_text_df (post_id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_feed_data_timestamp ON feed_data (timestamp)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_feed_data_user_id ON feed_data (user_id)"))
+        engine.dispose()
+
+        logger.info(f"Successfully wrote {rows} feed_data rows to the database")
+
+        return rows
+
+
+if __name__ == '__main__':
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    generator = SyntheticDataGenerator(n_users=config.get('synthetic_n_users', 10_000),
+                                       n_posts=config.get('synthetic_n_posts', 2_000),
+                                       n_views=config.get('synthetic_n_views', 1_000_000),
+                                       seed=config.get('synthetic_seed', 0))
+
+    # With a database, DataLoader extracts from it as from the course database; otherwise the raw files are written
+    database_url = config.get('synthetic_database_url')
+    if database_url:
+        if database_url.startswith('sqlite:///'):
+            os.makedirs(os.path.dirname(database_url[len('sqlite:///'):]) or '.', exist_ok=True)
+        generator.write_database(database_url)
+    else:
+        generator.write_files(user_data_path=config['raw_user_data_path'],
+                              post_data_path=config['raw_post_data_path'],
+                              feed_data_path=config['raw_feed_data_path'],
+                              validation_data_path=config['validation_data_path'])
@@ -1,12 +1,89 @@
-import re
+import os
+import json
 import yaml
 import pandas as pd
 from loguru import logger
-from sklearn.feature_extraction.text import TfidfVectorizer
+from typing import Iterator, List
+from src.data.storage import read_table, iter_table, write_table, append_table, TableWriter
+from src.features.text_features import TextFeatures, TEXT_FEATURES, save_post_embeddings
+
+
+# Columns the counter features are looked up by
+COUNTER_KEYS = ['user_id', 'post_id', 'topic']
+
+
+def read_counters_state(counters_path: str) -> dict:
+    path = os.path.join(counters_path, 'state.json')
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def read_high_water_mark(counters_path: str) -> pd.Timestamp:
+    # Latest feed timestamp already folded into the persisted counters
+    return pd.Timestamp(read_counters_state(counters_path)['high_water_mark'])
+
+
+def load_counters(counters_path: str) -> dict:
+    return {'post': read_table(os.path.join(counters_path, 'post.parquet')).set_index('post_id'),
+            'user': read_table(os.path.join(counters_path, 'user.parquet')).set_index('user_id'),
+            'user_topic': read_table(os.path.join(counters_path, 'user_topic.parquet'))
+                .set_index(['user_id', 'topic']).likes,
+            'high_water_mark': read_high_water_mark(counters_path)}
+
+
+def add_counter_features(merged_data: pd.DataFrame, counters: dict) -> pd.DataFrame:
+    # Same features as _create_new_features, from counters over the whole feed instead of one frame
+    df = merged_data
+    post_counts, user_counts = counters['post'], counters['user']
+
+    df['post_likes_to_views_ratio'] = round(df.post_id.map(post_counts['sum'])
+                                            / df.post_id.map(post_counts['count']), 3)
+    df['post_likes_to_views_ratio'] = df['post_likes_to_views_ratio'].fillna(0)
+
+    df['user_likes_to_views_ratio'] = round(df.user_id.map(user_counts['sum'])
+                                            / df.user_id.map(user_counts['count']), 3)
+    df['user_likes_to_views_ratio'] = df['user_likes_to_views_ratio'].fillna(0)
+
+    user_topics = pd.MultiIndex.from_arrays([df.user_id.values, df.topic.astype(str).values], names=['user_id', 'topic'])
+    user_topic_likes = counters['user_topic'].reindex(user_topics).values
+    df['user_proportion_of_likes_by_topic'] = round(user_topic_likes / df.user_id.map(user_counts['sum']), 3)
+    df['user_proportion_of_likes_by_topic'] = df['user_proportion_of_likes_by_topic'].fillna(0)
+
+    return df
+
+
+def _with_counter_keys(columns: List[str] = None) -> List[str]:
+    return None if columns is None else list(dict.fromkeys([*columns, *COUNTER_KEYS]))
+
+
+def read_feature_table(path: str, counters_path: str, columns: List[str] = None,
+                       categories: List[str] = None) -> pd.DataFrame:
+    # Refreshes only append rows: the counter features of the older ones are recomputed from the current counters
+    if not read_counters_state(counters_path).get('refreshed', False):
+        return read_table(path, columns=columns, categories=categories)
+
+    data = add_counter_features(read_table(path, columns=_with_counter_keys(columns), categories=categories),
+                                counters=load_counters(counters_path))
+    return data if columns is None else data[columns]
+
+
+def iter_feature_table(path: str, counters_path: str, columns: List[str] = None,
+                       chunksize: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    if not read_counters_state(counters_path).get('refreshed', False):
+        yield from iter_table(path, columns=columns, chunksize=chunksize)
+        return
+
+    counters = load_counters(counters_path)
+    for chunk in iter_table(path, columns=_with_counter_keys(columns), chunksize=chunksize):
+        chunk = add_counter_features(chunk, counters=counters)
+        yield chunk if columns is None else chunk[columns]
 
 
 class FeatureEngineering:
-    def __init__(self):
+    def __init__(self, streaming: bool = False, chunksize: int = 1_000_000):
 
         logger.info("Loading raw data...")
 
@@ -15,14 +92,31 @@ class FeatureEngineering:
             user_data_path = config['raw_user_data_path']
             post_data_path = config['raw_post_data_path']
             feed_data_path = config['raw_feed_data_path']
-
-        self.user_data = pd.read_csv(user_data_path, sep=';', index_col=None)
-        self.post_data = pd.read_csv(post_data_path, sep=';', index_col=None)
-        self.feed_data = pd.read_csv(feed_data_path, sep=';', index_col=None)
+            tfidf_cache_path = config.get('tfidf_cache_path', 'data/processed_data/tfidf')
+            self.counters_path = config.get('feature_counters_path', 'data/processed_data/counters')
+            self.post_embeddings_path = config.get('post_embeddings_path', 'data/processed_data/post_embeddings') \
+                if config.get('post_embeddings_enabled', False) else None
+            self.post_embeddings_n_components = config.get('post_embeddings_n_components', 64)
+            self.output_paths = {name: config[f"{name}_path"] for name in ['processed_user_data', 'processed_post_data',
+                                                                           'processed_feed_data', 'train_data_v1',
+                                                                           'train_data_v2']}
+
+        self.streaming = streaming
+        self.chunksize = chunksize
+        self.feed_data_path = feed_data_path
+        self.text_features = TextFeatures(cache_path=tfidf_cache_path)
+
+        self.user_data = read_table(user_data_path)
+        self.post_data = read_table(post_data_path)
+        # In streaming mode the feed is only ever read chunk by chunk
+        self.feed_data = None if streaming else read_table(feed_data_path)
 
         logger.info("Loaded raw data")
 
     def process_data(self):
+        if self.streaming:
+            return self._process_data_streaming()
+
         logger.info("Processing data...")
 
         user_data = self.user_data
@@ -33,7 +127,7 @@ class FeatureEngineering:
                                               feed=self.feed_data)
         
         train_v2 = self._create_train_data_v2(user=self.user_data,
-                                              post=self.post_data,
+                                              post=post_data,
                                               feed=self.feed_data)
         
         posts_cr = train_v2.groupby('post_id').post_likes_to_views_ratio.max().to_dict()
@@ -41,11 +135,17 @@ class FeatureEngineering:
         post_data['post_likes_to_views_ratio'] = post_data['post_likes_to_views_ratio']\
             .fillna(round(post_data.groupby('topic').post_likes_to_views_ratio.transform('mean'), 3))
         
-        self._save_to_csv(file_path="data/processed_data", file_name="user_data.csv", data=user_data)
-        self._save_to_csv(file_path="data/processed_data", file_name="post_data.csv", data=post_data)
-        self._save_to_csv(file_path="data/processed_data", file_name="feed_data.csv", data=train_v2)
-        self._save_to_csv(file_path="data/train_data/catboost_v1", file_name="train.csv", data=train_v1)
-        self._save_to_csv(file_path="data/train_data/catboost_v2", file_name="train.csv", data=train_v2)
+        write_table(data=user_data, path=self.output_paths['processed_user_data'])
+        write_table(data=post_data, path=self.output_paths['processed_post_data'])
+        self._save_post_embeddings(post=post_data)
+        write_table(data=train_v2, path=self.output_paths['processed_feed_data'])
+        write_table(data=train_v1, path=self.output_paths['train_data_v1'])
+        write_table(data=train_v2, path=self.output_paths['train_data_v2'])
+
+        # Counters and high-water mark for incremental refreshes
+        counters = self._count_feed_interactions(post_topics=post_data.set_index('post_id').topic,
+                                                 chunks=[self.feed_data])
+        self._save_counters(counters)
 
         logger.info("Successfully processed and saved the Data!")
     
@@ -57,8 +157,9 @@ class FeatureEngineering:
         return result_df
 
     def _create_train_data_v2(self, user: pd.DataFrame, post: pd.DataFrame, feed: pd.DataFrame) -> pd.DataFrame:
+        # post already has the TF-IDF features
         user_data = user
-        post_data = self._add_tfidf_features_to_post_data(post).drop('text', axis=1)
+        post_data = post.drop('text', axis=1)
         feed_data = feed
 
         merged_df = self._merge_dfs(user=user_data, 
@@ -69,31 +170,18 @@ class FeatureEngineering:
 
         return result_df
         
-    def _process_text(self, text: str) -> str:
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
-        text = re.sub('\n', ' ', text)
+    def _save_post_embeddings(self, post: pd.DataFrame):
+        # Dense post vectors for the similarity candidates of Recommender_v2, opt-in via config.yaml
+        if self.post_embeddings_path is None:
+            return
 
-        return text
+        post_ids, embeddings = self.text_features.get_embeddings(post=post,
+                                                                 n_components=self.post_embeddings_n_components)
+        save_post_embeddings(path=self.post_embeddings_path, post_ids=post_ids, embeddings=embeddings)
 
     def _add_tfidf_features_to_post_data(self, post: pd.DataFrame) -> pd.DataFrame:
-        # Copy df
-        post_df = post.copy()
-
-        logger.info("Creating TF-IDF features...")
-
-        # TF-IDF on post texts
-        texts_for_tfidf = post_df.text.apply(lambda x: self._process_text(x))
-        tfidf = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(texts_for_tfidf)
-
-        post_df['tfidf_mean'] = tfidf_matrix.mean(axis=1)
-        post_df['tfidf_max'] = tfidf_matrix.max(axis=1).toarray()
-        post_df['text_lenght'] = post_df.text.apply(lambda x: len(x))
-
-        logger.info("Created TF-IDF features")
-
-        return post_df
+        # Fitted once and cached by post corpus, new posts are transformed without refitting
+        return self.text_features.add_features(post=post)
 
     def _merge_dfs(self, user: pd.DataFrame, post: pd.DataFrame, feed: pd.DataFrame) -> pd.DataFrame:
         # Copy dfs
@@ -106,7 +194,7 @@ class FeatureEngineering:
         df = feed_df.merge(right=user_df, how='left', on='user_id').merge(post_df, how='left', on='post_id')
         df = df[df.action != 'like']
         df = df.drop('action', axis=1)
-        df = df.sort_values('date', ascending=True)
+        df = df.sort_values('date', ascending=True, kind='stable')
         df = df.drop('date', axis=1)
         df = df.drop('exp_group', axis=1)
 
@@ -137,14 +225,138 @@ class FeatureEngineering:
 
         return df
     
-    def _save_to_csv(self, file_path: str, file_name: str, data: pd.DataFrame, sep: str = ';'):
-        logger.info(f"Saving {file_path}/{file_name}...")
+    def _process_data_streaming(self):
+        logger.info(f"Processing data in chunks of {self.chunksize} rows...")
+
+        post_data = self._add_tfidf_features_to_post_data(self.post_data)
+
+        # Pass 1: like/view counters over the whole feed
+        counters = self._count_feed_interactions(post_topics=post_data.set_index('post_id').topic)
+
+        # Pass 2: merge and write the train data chunk by chunk
+        post = post_data.drop('text', axis=1)
+
+        with TableWriter(self.output_paths['train_data_v1']) as train_v1_writer, \
+                TableWriter(self.output_paths['train_data_v2']) as train_v2_writer, \
+                TableWriter(self.output_paths['processed_feed_data']) as feed_writer:
+            for i, chunk in enumerate(self._read_feed_chunks()):
+                merged_df = self._merge_dfs(user=self.user_data, post=post, feed=chunk)
+                train_v1_writer.write(merged_df.drop(TEXT_FEATURES, axis=1))
+
+                train_v2 = add_counter_features(merged_data=merged_df, counters=counters)
+                train_v2_writer.write(train_v2)
+                feed_writer.write(train_v2)
+
+                logger.info(f"Processed feed chunk {i + 1}")
 
-        data.to_csv(f"{file_path}/{file_name}", sep=sep, index=False)
+        post_data = self._add_post_ratios(post_data=post_data, post_counts=counters['post'])
 
-        logger.info(f"Saved {file_path}/{file_name}")
+        write_table(data=self.user_data, path=self.output_paths['processed_user_data'])
+        write_table(data=post_data, path=self.output_paths['processed_post_data'])
+        self._save_post_embeddings(post=post_data)
+        self._save_counters(counters)
+
+        logger.info("Successfully processed and saved the Data!")
+
+    def refresh(self, delta_path: str):
+        # Folds the new feed rows of delta_path into the processed data without a full rebuild
+        delta = read_table(delta_path) if os.path.exists(delta_path) else pd.DataFrame()
+        if delta.empty:
+            logger.info("No new feed data to refresh")
+            return
+
+        logger.info(f"Refreshing data with {len(delta)} new feed rows...")
+
+        post_data = self._add_tfidf_features_to_post_data(self.post_data)
+        post = post_data.drop('text', axis=1)
+
+        # Only the counters of the users and posts of the delta change
+        counters = load_counters(self.counters_path)
+        delta_counters = self._count_feed_interactions(post_topics=post_data.set_index('post_id').topic,
+                                                       chunks=[delta])
+        for name in ['post', 'user', 'user_topic']:
+            if delta_counters[name] is not None:
+                counters[name] = self._accumulate(counters[name], delta_counters[name])
+        counters['high_water_mark'] = max(counters['high_water_mark'], delta_counters['high_water_mark'])
+
+        # The delta becomes new partitions: older rows are never rewritten, readers of the train data
+        # recompute their counter features (read_feature_table)
+        merged_df = self._merge_dfs(user=self.user_data, post=post, feed=delta)
+        append_table(data=merged_df.drop(TEXT_FEATURES, axis=1), path=self.output_paths['train_data_v1'])
+        delta_train_v2 = add_counter_features(merged_data=merged_df, counters=counters)
+        append_table(data=delta_train_v2, path=self.output_paths['train_data_v2'])
+        append_table(data=delta_train_v2, path=self.output_paths['processed_feed_data'])
+        append_table(data=delta, path=self.feed_data_path)
+
+        # Users and posts are small and rewritten whole, with the users reloaded since the last run
+        post_data = self._add_post_ratios(post_data=post_data, post_counts=counters['post'])
+        write_table(data=self.user_data, path=self.output_paths['processed_user_data'])
+        write_table(data=post_data, path=self.output_paths['processed_post_data'])
+        self._save_post_embeddings(post=post_data)
+
+        self._save_counters(counters, refreshed=True)
+
+        logger.info(f"Successfully refreshed the Data up to {counters['high_water_mark']}!")
+
+    @staticmethod
+    def _add_post_ratios(post_data: pd.DataFrame, post_counts: pd.DataFrame) -> pd.DataFrame:
+        post_data['post_likes_to_views_ratio'] = post_data.post_id.map(round(post_counts['sum'] / post_counts['count'], 3))
+        post_data['post_likes_to_views_ratio'] = post_data['post_likes_to_views_ratio']\
+            .fillna(round(post_data.groupby('topic').post_likes_to_views_ratio.transform('mean'), 3))
+
+        return post_data
+
+    def _save_counters(self, counters: dict, refreshed: bool = False):
+        os.makedirs(self.counters_path, exist_ok=True)
+
+        write_table(data=counters['post'].rename_axis('post_id').reset_index(),
+                    path=os.path.join(self.counters_path, 'post.parquet'))
+        write_table(data=counters['user'].rename_axis('user_id').reset_index(),
+                    path=os.path.join(self.counters_path, 'user.parquet'))
+        write_table(data=counters['user_topic'].rename('likes').reset_index(),
+                    path=os.path.join(self.counters_path, 'user_topic.parquet'))
+
+        with open(os.path.join(self.counters_path, 'state.json'), 'w') as file:
+            # Refreshed train data has rows with counter features older than the counters
+            json.dump({'high_water_mark': str(counters['high_water_mark']), 'refreshed': refreshed}, file)
+
+    def _read_feed_chunks(self, columns: list = None):
+        return iter_table(self.feed_data_path, columns=columns, chunksize=self.chunksize)
+
+    def _count_feed_interactions(self, post_topics: pd.Series, chunks=None) -> dict:
+        logger.info("Counting likes and views over the feed...")
+
+        if chunks is None:
+            chunks = self._read_feed_chunks(columns=['user_id', 'post_id', 'action', 'target', 'date'])
+
+        post_counts, user_counts, user_topic_likes = None, None, None
+        high_water_mark = None
+
+        for chunk in chunks:
+            chunk_max_date = pd.Timestamp(chunk.date.max())
+            high_water_mark = chunk_max_date if high_water_mark is None else max(high_water_mark, chunk_max_date)
+
+            chunk = chunk[chunk.action != 'like']
+            chunk = chunk.assign(topic=chunk.post_id.map(post_topics))
+
+            post_counts = self._accumulate(post_counts, chunk.groupby('post_id').target.agg(['sum', 'count']))
+            user_counts = self._accumulate(user_counts, chunk.groupby('user_id').target.agg(['sum', 'count']))
+            user_topic_likes = self._accumulate(user_topic_likes, chunk.groupby(['user_id', 'topic']).target.sum())
+
+        logger.info(f"Counted likes and views of {len(post_counts)} posts and {len(user_counts)} users")
+
+        return {'post': post_counts, 'user': user_counts, 'user_topic': user_topic_likes,
+                'high_water_mark': high_water_mark}
+
+    @staticmethod
+    def _accumulate(total, counts):
+        return counts if total is None else total.add(counts, fill_value=0)
 
 
 if __name__ == '__main__':
-    feature_engineering = FeatureEngineering()
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    feature_engineering = FeatureEngineering(streaming=config.get('feature_engineering_streaming', False),
+                                             chunksize=config.get('feature_engineering_chunksize', 1_000_000))
     feature_engineering.process_data()
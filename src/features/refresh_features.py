@@ -0,0 +1,20 @@
+import yaml
+from loguru import logger
+from src.data.load_data import DataLoader, DATABASE_URL
+from src.features.build_features import FeatureEngineering, read_high_water_mark
+
+
+if __name__ == '__main__':
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+        counters_path = config.get('feature_counters_path', 'data/processed_data/counters')
+        feed_delta_path = config['raw_feed_delta_path']
+
+    since = read_high_water_mark(counters_path)
+    logger.info(f"Refreshing the Data with the feed after {since}...")
+
+    DataLoader(database_url=DATABASE_URL).load_delta(since=since, feed_delta_path=feed_delta_path)
+
+    feature_engineering = FeatureEngineering(streaming=True,
+                                             chunksize=config.get('feature_engineering_chunksize', 1_000_000))
+    feature_engineering.refresh(delta_path=feed_delta_path)
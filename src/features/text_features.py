@@ -0,0 +1,161 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from loguru import logger
+from typing import Tuple
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+
+TEXT_FEATURES = ['tfidf_mean', 'tfidf_max', 'text_lenght']
+FEATURE_DTYPES = {'post_id': 'int64', 'text_hash': 'uint64',
+                  'tfidf_mean': 'float64', 'tfidf_max': 'float64', 'text_lenght': 'int64'}
+
+
+def process_texts(texts: pd.Series) -> pd.Series:
+    return texts.str.lower()\
+        .str.replace(r'[^\w\s]', '', regex=True)\
+        .str.replace('\n', ' ', regex=False)
+
+
+def save_post_embeddings(path: str, post_ids: np.ndarray, embeddings: np.ndarray):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'post_ids.npy'), post_ids, allow_pickle=False)
+    np.save(os.path.join(path, 'embeddings.npy'), embeddings, allow_pickle=False)
+
+    logger.info(f"Saved {embeddings.shape[1]}-dimensional embeddings of {len(post_ids)} posts to {path}")
+
+
+def load_post_embeddings(path: str, mmap_mode: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    return (np.load(os.path.join(path, 'post_ids.npy'), allow_pickle=False),
+            np.load(os.path.join(path, 'embeddings.npy'), mmap_mode=mmap_mode, allow_pickle=False))
+
+
+def _text_hashes(post: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(post.text, index=False).values
+
+
+def _corpus_hash(post_ids: np.ndarray, text_hashes: np.ndarray) -> str:
+    order = np.argsort(post_ids, kind='stable')
+    digest = hashlib.sha1(np.ascontiguousarray(post_ids[order], dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(text_hashes[order], dtype=np.uint64).tobytes())
+
+    return digest.hexdigest()
+
+
+class TextFeatures:
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+
+        self.vectorizer_path = os.path.join(cache_path, 'vectorizer.pkl')
+        self.features_path = os.path.join(cache_path, 'features.csv')
+        self.meta_path = os.path.join(cache_path, 'meta.json')
+
+    def add_features(self, post: pd.DataFrame, refit: bool = False) -> pd.DataFrame:
+        # Copy df
+        post_df = post.copy()
+
+        features = self.get_features(post=post_df, refit=refit).set_index('post_id')
+        for column in TEXT_FEATURES:
+            post_df[column] = post_df.post_id.map(features[column])
+
+        return post_df
+
+    def get_features(self, post: pd.DataFrame, refit: bool = False) -> pd.DataFrame:
+        post = post[['post_id', 'text']].drop_duplicates('post_id')
+        text_hashes = _text_hashes(post)
+        corpus_hash = _corpus_hash(post_ids=post.post_id.values, text_hashes=text_hashes)
+
+        cached = None if refit else self._load()
+        if cached is not None and cached[0] == corpus_hash:
+            logger.info(f"Loaded TF-IDF features of {len(post)} posts from cache")
+            return cached[2]
+
+        if cached is None:
+            logger.info(f"Fitting TF-IDF on {len(post)} posts...")
+
+            vectorizer = TfidfVectorizer(stop_words='english')
+            vectorizer.fit(process_texts(post.text))
+            known = pd.DataFrame(columns=['post_id', 'text_hash'] + TEXT_FEATURES)
+        else:
+            _, vectorizer, known = cached
+
+        # Posts with unchanged text keep their features, new or edited ones are transformed by the fitted vectorizer
+        known = known.astype(FEATURE_DTYPES)
+        known_keys = pd.MultiIndex.from_frame(known[['post_id', 'text_hash']])
+        is_new = ~pd.MultiIndex.from_arrays([post.post_id.values, text_hashes]).isin(known_keys)
+        new_post = post[is_new]
+
+        logger.info(f"Creating TF-IDF features for {len(new_post)} new posts...")
+
+        new_features = self._transform(vectorizer=vectorizer, post=new_post)
+        new_features.insert(1, 'text_hash', text_hashes[is_new])
+
+        kept = known[known.post_id.isin(post.post_id[~is_new])]
+        features = pd.concat([kept, new_features], ignore_index=True)
+        features = features.astype(FEATURE_DTYPES)
+
+        self._save(corpus_hash=corpus_hash, vectorizer=vectorizer, features=features)
+
+        logger.info("Created TF-IDF features")
+
+        return features
+
+    def get_embeddings(self, post: pd.DataFrame, n_components: int = 64,
+                       seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        # The TF-IDF vectors of the cached vectorizer reduced by truncated SVD to unit float32 vectors
+        post = post[['post_id', 'text']].drop_duplicates('post_id')
+
+        cached = self._load()
+        if cached is None:
+            self.get_features(post=post)
+            cached = self._load()
+
+        tfidf_matrix = cached[1].transform(process_texts(post.text))
+        n_components = min(n_components, tfidf_matrix.shape[1] - 1)
+
+        logger.info(f"Creating {n_components}-dimensional embeddings of {len(post)} posts...")
+
+        svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        embeddings = normalize(svd.fit_transform(tfidf_matrix)).astype(np.float32)
+
+        logger.info(f"Created post embeddings, explained variance {svd.explained_variance_ratio_.sum():.3f}")
+
+        return post.post_id.values, embeddings
+
+    @staticmethod
+    def _transform(vectorizer: TfidfVectorizer, post: pd.DataFrame) -> pd.DataFrame:
+        if post.empty:
+            return pd.DataFrame(columns=['post_id'] + TEXT_FEATURES)
+
+        tfidf_matrix = vectorizer.transform(process_texts(post.text))
+
+        return pd.DataFrame({'post_id': post.post_id.values,
+                             'tfidf_mean': np.asarray(tfidf_matrix.mean(axis=1)).ravel(),
+                             'tfidf_max': tfidf_matrix.max(axis=1).toarray().ravel(),
+                             'text_lenght': post.text.str.len().values})
+
+    def _load(self):
+        if not all(os.path.exists(path) for path in [self.vectorizer_path, self.features_path, self.meta_path]):
+            return None
+
+        with open(self.meta_path, 'r') as file:
+            corpus_hash = json.load(file)['corpus_hash']
+        with open(self.vectorizer_path, 'rb') as file:
+            vectorizer = pickle.load(file)
+        features = pd.read_csv(self.features_path, sep=';', index_col=None, dtype=FEATURE_DTYPES)
+
+        return corpus_hash, vectorizer, features
+
+    def _save(self, corpus_hash: str, vectorizer: TfidfVectorizer, features: pd.DataFrame):
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        with open(self.vectorizer_path, 'wb') as file:
+            pickle.dump(vectorizer, file)
+        features.to_csv(self.features_path, sep=';', index=False)
+        with open(self.meta_path, 'w') as file:
+            json.dump({'corpus_hash': corpus_hash}, file)
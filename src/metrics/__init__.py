@@ -1,2 +1,2 @@
-from .metrics import hitrate_at_k
-from .evaluate_metrics import evaluate_metrics
\ No newline at end of file
+from .metrics import hitrate_at_k, group_ranks, ranking_metrics
+from .evaluate_metrics import evaluate_metrics
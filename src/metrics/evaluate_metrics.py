@@ -1,45 +1,138 @@
 import pickle
 import yaml
-import re
-import pandas as pd
 import numpy as np
+import pandas as pd
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
 from src.models.catboost_recommender_v1 import Recommender_v1_validation
 from src.models.catboost_recommender_v2 import Recommender_validation
-from src.metrics import hitrate_at_k
+from src.metrics import group_ranks, ranking_metrics
+from src.data.storage import read_table
+
+
+# Model scoring the shards of a worker process
+_worker_model = None
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _score_shard(method: str, user_ids: np.ndarray, post_ids: np.ndarray, batch_size: int) -> np.ndarray:
+    score = getattr(_worker_model, method)
+    return np.concatenate([score(user_ids=user_ids[start:start + batch_size], post_ids=post_ids[start:start + batch_size])
+                           for start in range(0, len(post_ids), batch_size)] or [np.array([])])
+
+
+def _parse_post_arrays(column: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # Post lists -> CSR arrays: the posts of row i are items[indptr[i]:indptr[i + 1]]
+    values = column.dropna()
+    if len(values) and not isinstance(values.iloc[0], str):
+        # Native list columns of the columnar formats
+        lists = [np.asarray(value, dtype=np.int64) if value is not None else np.array([], dtype=np.int64)
+                 for value in column]
+        indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(posts) for posts in lists])
+        return indptr, np.concatenate(lists) if lists else np.array([], dtype=np.int64)
+
+    # "[1, 2, 3]" strings of CSV
+    stripped = column.fillna('').astype(str).str.strip('[]{} ')
+    lengths = np.where(stripped == '', 0, stripped.str.count(',') + 1)
+
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths)
+
+    joined = ','.join(stripped[stripped != ''])
+    items = np.array(joined.split(','), dtype=np.int64) if joined else np.array([], dtype=np.int64)
 
+    return indptr, items
 
-def evaluate_metrics(model, model_name: str = 'Recommender_v1'):
+
+def _validation_pairs(validation: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    viewed_indptr, viewed = _parse_post_arrays(validation.viewed_posts)
+    liked_indptr, liked = _parse_post_arrays(validation.liked_posts)
+
+    # Unique (user, viewed post) pairs ordered by user, as the per-user isin() of the model did
+    n_users = len(validation)
+    span = int(max(viewed.max(initial=0), liked.max(initial=0))) + 1
+    viewed_keys = np.unique(np.repeat(np.arange(n_users), np.diff(viewed_indptr)) * span + viewed)
+    liked_keys = np.repeat(np.arange(n_users), np.diff(liked_indptr)) * span + liked
+
+    groups, post_ids = viewed_keys // span, viewed_keys % span
+    is_liked = np.isin(viewed_keys, liked_keys)
+
+    return groups, post_ids, is_liked, liked_indptr, liked
+
+
+def _score(model, method: str, user_ids: np.ndarray, post_ids: np.ndarray, groups: np.ndarray,
+           batch_size: int, n_jobs: int) -> np.ndarray:
+    if n_jobs <= 1:
+        _init_worker(model)
+        return _score_shard(method=method, user_ids=user_ids, post_ids=post_ids, batch_size=batch_size)
+
+    # Shards hold whole users, so each worker builds complete per-user score matrices
+    bounds = np.searchsorted(groups, np.linspace(0, groups.max(initial=0) + 1, n_jobs + 1).astype(int))
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(model,)) as executor:
+        futures = [executor.submit(_score_shard, method, user_ids[start:end], post_ids[start:end], batch_size)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        return np.concatenate([future.result() for future in futures])
+
+
+def evaluate_metrics(model, model_name: str = 'Recommender_v1', n_candidates: int = None, k_values: List[int] = (5,),
+                     batch_size: int = 1_000_000, n_jobs: int = 1):
     with open('config.yaml', 'r') as file:
         config = yaml.safe_load(file)
         validation_path = config['validation_data_path']
+        post_data_path = config['processed_post_data_path']
+
+    validation = read_table(validation_path, columns=['user_id', 'liked_posts', 'viewed_posts'])
+    # Coverage is the share of the whole catalog recommended, not only of the posts viewed in validation
+    catalog_size = len(read_table(post_data_path, columns=['post_id']))
 
-    validation = pd.read_csv(validation_path, sep=';', index_col=None)
+    logger.info(f"Evaluating {model_name} on {len(validation)} users...")
 
-    hitrate = 0
-    for i in range(len(validation)):
-        user_id = validation.user_id.iloc[i]
-        liked_posts = []
-        viewed_posts = []
+    groups, post_ids, is_liked, liked_indptr, liked = _validation_pairs(validation)
+    user_ids = validation.user_id.values[groups]
+    n_users = len(validation)
 
-        for post_str in re.sub(pattern=r'(\[|\])', repl='', string=validation.liked_posts.iloc[i]).split(','):
-            post_id = int(post_str.strip())
-            liked_posts.append(post_id)
+    scores = _score(model=model, method='score_pairs', user_ids=user_ids, post_ids=post_ids, groups=groups,
+                    batch_size=batch_size, n_jobs=n_jobs)
 
-        for post_str in re.sub(pattern=r'(\[|\])', repl='', string=validation.viewed_posts.iloc[i]).split(','):
-            post_id = int(post_str.strip())
-            viewed_posts.append(post_id)
+    if n_candidates is not None:
+        # Two-stage mode: rank only each user's top candidates and track how many liked posts the first stage kept
+        candidate_scores = _score(model=model, method='candidate_scores', user_ids=user_ids, post_ids=post_ids,
+                                  groups=groups, batch_size=batch_size, n_jobs=n_jobs)
+        known = ~np.isnan(candidate_scores)
+        candidate_ranks = group_ranks(groups=groups[known], scores=candidate_scores[known])
 
-        viewed_posts = np.array(viewed_posts)    
+        is_candidate = np.zeros(len(scores), dtype=bool)
+        is_candidate[np.flatnonzero(known)[candidate_ranks < n_candidates]] = True
+        scores[~is_candidate] = np.nan
 
-        recs = [item['id'] for item in model.predict(user_id=user_id, viewed_posts=viewed_posts)]
-        hitrate += hitrate_at_k(liked_posts=liked_posts, recommended_posts=recs)
+        liked_count = np.bincount(groups[is_liked], minlength=n_users)
+        kept_count = np.bincount(groups[is_liked & is_candidate], minlength=n_users)
+        candidates_recall = np.divide(kept_count, liked_count, out=np.zeros(n_users), where=liked_count > 0)
 
-    hitrate_at_5 = round(hitrate / len(validation), 3)
+    # Unscored pairs (unknown posts, pruned candidates) are never recommended
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(groups, minlength=n_users))
+    metrics = ranking_metrics(indptr=indptr, items=post_ids, scores=scores, liked_indptr=liked_indptr,
+                              liked_items=liked, k_values=k_values, catalog_size=catalog_size)
+    metrics = {name: round(float(value), 3) for name, value in metrics.items()}
 
     print(f"Model: {model_name}")
-    print(f"Hitrate@5 = {hitrate_at_5}")
+    for k in k_values:
+        print(f"Hitrate@{k} = {metrics[f'hitrate@{k}']}, Precision@{k} = {metrics[f'precision@{k}']}, "
+              f"Recall@{k} = {metrics[f'recall@{k}']}, NDCG@{k} = {metrics[f'ndcg@{k}']}, "
+              f"MAP@{k} = {metrics[f'map@{k}']}, Coverage@{k} = {metrics[f'coverage@{k}']}")
 
-    return hitrate_at_5
+    if n_candidates is not None:
+        recall = round(candidates_recall.mean(), 3)
+        print(f"Candidates: {n_candidates}, recall of liked posts = {recall}, recall loss = {round(1 - recall, 3)}")
+
+    return metrics
 
 
 if __name__ == '__main__':
@@ -48,3 +141,8 @@ if __name__ == '__main__':
 
     model_v2 = pickle.load(open('src/models/catboost_recommender_v2/artifacts/validation_model_v2.pkl', 'rb'))
     evaluate_metrics(model=model_v2, model_name='Recommender_v2') #hitrate@5 = 0.621
+
+    with open('config.yaml', 'r') as file:
+        n_candidates = yaml.safe_load(file).get('n_candidates')
+    if n_candidates:
+        evaluate_metrics(model=model_v2, model_name='Recommender_v2 (two-stage)', n_candidates=n_candidates)
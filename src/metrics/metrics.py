@@ -11,3 +11,69 @@ def hitrate_at_k(liked_posts: List[int], recommended_posts: List[int], k: int =
     hitrate = int(flags.sum() > 0)
 
     return hitrate
+
+
+def group_ranks(groups: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    # Rank of every item inside its group by descending score, ties broken by position
+    order = np.lexsort((np.arange(len(scores)), -scores, groups))
+    sorted_groups = groups[order]
+    group_starts = np.searchsorted(sorted_groups, sorted_groups, side='left')
+
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - group_starts
+
+    return ranks
+
+
+def ranking_metrics(indptr: np.ndarray, items: np.ndarray, scores: np.ndarray,
+                    liked_indptr: np.ndarray, liked_items: np.ndarray,
+                    k_values: List[int] = (5,), catalog_size: int = None) -> dict:
+    # CSR input: user i ranks items[indptr[i]:indptr[i + 1]] by scores (NaN = not ranked)
+    # and liked liked_items[liked_indptr[i]:liked_indptr[i + 1]]
+    n_users = len(indptr) - 1
+    groups = np.repeat(np.arange(n_users), np.diff(indptr))
+    liked_groups = np.repeat(np.arange(n_users), np.diff(liked_indptr))
+
+    span = int(max(items.max(initial=0), liked_items.max(initial=0))) + 1
+    liked_keys = np.unique(liked_groups * span + liked_items)
+    is_liked = np.isin(groups * span + items, liked_keys)
+    n_liked = np.bincount(liked_keys // span, minlength=n_users)
+    has_liked = n_liked > 0
+
+    ranked = ~np.isnan(scores)
+    ranks = np.full(len(scores), np.iinfo(np.int64).max)
+    ranks[ranked] = group_ranks(groups=groups[ranked], scores=scores[ranked])
+
+    # Running count of liked items down each user's ranking, for precision at every liked position
+    order = np.lexsort((ranks, groups))
+    liked_in_order = is_liked[order].astype(np.int64)
+    running_liked = np.cumsum(liked_in_order)
+    group_offsets = np.concatenate([[0], running_liked])[np.searchsorted(groups[order], groups[order], side='left')]
+    liked_so_far = np.empty(len(order), dtype=np.int64)
+    liked_so_far[order] = running_liked - group_offsets
+
+    if catalog_size is None:
+        catalog_size = len(np.unique(items[ranked]))
+
+    metrics = {}
+    for k in k_values:
+        in_top = ranks < k
+        relevant = in_top & is_liked
+        hits = np.bincount(groups[relevant], minlength=n_users)
+        ideal = np.minimum(n_liked, k)
+
+        discounts = 1 / np.log2(np.arange(k) + 2)
+        dcg = np.bincount(groups[relevant], weights=discounts[ranks[relevant]], minlength=n_users)
+        idcg = np.concatenate([[0], np.cumsum(discounts)])[ideal]
+
+        precision_at_hits = np.bincount(groups[relevant], weights=liked_so_far[relevant] / (ranks[relevant] + 1),
+                                        minlength=n_users)
+
+        metrics[f"hitrate@{k}"] = (hits > 0).mean() if n_users else 0.0
+        metrics[f"precision@{k}"] = (hits / k).mean() if n_users else 0.0
+        metrics[f"recall@{k}"] = (hits[has_liked] / n_liked[has_liked]).mean() if has_liked.any() else 0.0
+        metrics[f"ndcg@{k}"] = (dcg[has_liked] / idcg[has_liked]).mean() if has_liked.any() else 0.0
+        metrics[f"map@{k}"] = (precision_at_hits[has_liked] / ideal[has_liked]).mean() if has_liked.any() else 0.0
+        metrics[f"coverage@{k}"] = len(np.unique(items[in_top])) / catalog_size if catalog_size else 0.0
+
+    return metrics
@@ -4,6 +4,8 @@ from loguru import logger
 import pandas as pd
 import numpy as np
 from catboost import CatBoostClassifier
+from src.data.storage import read_table, CATEGORICAL_COLUMNS
+from src.models.timing import stage
 
 class Recommender_v1:
     def __init__(self):
@@ -16,8 +18,8 @@ class Recommender_v1:
             user_data_path = config['raw_user_data_path']
             post_data_path = config['raw_post_data_path']
 
-        self.user_data = pd.read_csv(user_data_path, sep=';', index_col=None)
-        self.post_data = pd.read_csv(post_data_path, sep=';', index_col=None)
+        self.user_data = read_table(user_data_path)
+        self.post_data = read_table(post_data_path)
 
     def fit(self, X, y):
         logger.info("Fitting the model...")
@@ -32,20 +34,28 @@ class Recommender_v1:
         logger.info("Predicting...")
 
         # Preparing DataFrame for user: merged df with user_data for user_id and post_data
-        user = self.user_data[self.user_data.user_id == user_id].reset_index().drop('index', axis=1)
-        posts = self.post_data.copy()
-        posts['user_id'] = user_id
-        user_df = pd.merge(user, posts, on='user_id', how='right')
+        with stage('user_lookup'):
+            user = self.user_data[self.user_data.user_id == user_id].reset_index().drop('index', axis=1)
+        with stage('candidates'):
+            posts = self.post_data.copy()
+            posts['user_id'] = user_id
+            user_df = pd.merge(user, posts, on='user_id', how='right')
 
         # Predicting probabilities, sorting them in descending and building recs as top N posts by probs
-        posts['pred_prob'] = self.model.predict_proba(user_df.drop(self.cols_to_drop, axis=1))[:, 1]
-        sorted_posts = posts.sort_values('pred_prob', ascending=False).rename(columns={'post_id': 'id'})
-        recs = sorted_posts[['id', 'text', 'topic']].head(limit)
-        recs = recs.to_dict(orient='records')
+        with stage('predict_proba'):
+            posts['pred_prob'] = self.model.predict_proba(user_df.drop(self.cols_to_drop, axis=1))[:, 1]
+        with stage('top_k'):
+            sorted_posts = posts.sort_values('pred_prob', ascending=False).rename(columns={'post_id': 'id'})
+            recs = sorted_posts[['id', 'text', 'topic']].head(limit)
+        with stage('serialization'):
+            recs = recs.to_dict(orient='records')
 
         logger.info("Successfully predicted!")
 
         return recs
+
+    def predict_batch(self, user_ids, limit=5):
+        return [self.predict(user_id=user_id, limit=limit) for user_id in user_ids]
     
     
 if __name__ == '__main__':
@@ -58,7 +68,7 @@ if __name__ == '__main__':
         config = yaml.safe_load(file)
         train_data_path = config['train_data_v1_path']
     
-    train = pd.read_csv(train_data_path, sep=';', index_col=None)
+    train = read_table(train_data_path, categories=CATEGORICAL_COLUMNS)
 
     logger.info("Successfully read the train data!")
 
@@ -4,6 +4,7 @@ from loguru import logger
 import pandas as pd
 import numpy as np
 from catboost import CatBoostClassifier
+from src.data.storage import read_table, CATEGORICAL_COLUMNS
 
 class Recommender_v1_validation:
     def __init__(self):
@@ -16,8 +17,8 @@ class Recommender_v1_validation:
             user_data_path = config['raw_user_data_path']
             post_data_path = config['raw_post_data_path']
 
-        self.user_data = pd.read_csv(user_data_path, sep=';', index_col=None)
-        self.post_data = pd.read_csv(post_data_path, sep=';', index_col=None)
+        self.user_data = read_table(user_data_path)
+        self.post_data = read_table(post_data_path)
 
     def fit(self, X, y):
         logger.info("Fitting the model...")
@@ -47,6 +48,24 @@ class Recommender_v1_validation:
         logger.info("Successfully predicted!")
 
         return recs
+
+    def score_pairs(self, user_ids: np.array, post_ids: np.array) -> np.array:
+        # Predicted probability for every (user, post) pair in one model call, NaN for unknown users or posts
+        user_ids, post_ids = np.asarray(user_ids), np.asarray(post_ids)
+        users = self.user_data.set_index('user_id')
+        posts = self.post_data.set_index('post_id')
+        known = np.isin(user_ids, users.index) & np.isin(post_ids, posts.index)
+
+        user_columns = [column for column in self.model.feature_names_ if column in users.columns]
+        post_columns = [column for column in self.model.feature_names_ if column not in users.columns]
+        pairs_df = pd.concat([users.loc[user_ids[known], user_columns].reset_index(drop=True),
+                              posts.loc[post_ids[known], post_columns].reset_index(drop=True)], axis=1)
+
+        scores = np.full(len(post_ids), np.nan)
+        if known.any():
+            scores[known] = self.model.predict_proba(pairs_df[self.model.feature_names_])[:, 1]
+
+        return scores
     
 if __name__ == '__main__':
     MODEL_PATH = 'src/models/catboost_recommender_v1/artifacts'
@@ -58,7 +77,7 @@ if __name__ == '__main__':
         config = yaml.safe_load(file)
         train_data_path = config['train_data_v1_path']
     
-    train = pd.read_csv(train_data_path, sep=';', index_col=None)
+    train = read_table(train_data_path, categories=CATEGORICAL_COLUMNS)
 
     logger.info("Successfully read the train data!")
 
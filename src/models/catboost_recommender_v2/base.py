@@ -0,0 +1,131 @@
+import yaml
+from loguru import logger
+from catboost import CatBoostClassifier, Pool
+from src.models.catboost_recommender_v2.feature_store import UserFeatureStore, PostFeatureBlock
+from src.models.catboost_recommender_v2.candidates import CandidateGenerator
+from src.models.catboost_recommender_v2.similarity import align_embeddings, positions_of, user_profiles
+from src.features.text_features import load_post_embeddings
+from src.features.build_features import read_feature_table
+from src.data.storage import read_table
+
+
+def read_config() -> dict:
+    with open('config.yaml', 'r') as file:
+        return yaml.safe_load(file)
+
+
+class BaseRecommender:
+    # Training data, fitting and serving structures shared by Recommender and Recommender_validation
+    def __init__(self):
+        self.model = CatBoostClassifier(n_estimators=150, random_state=1)
+        self.cat_features = ['gender', 'country', 'city', 'os', 'source', 'topic']
+        self.cols_to_drop = ['user_id', 'exp_group', 'post_id', 'text']
+
+    def _load_data(self, config: dict):
+        post_embeddings_path = config.get('post_embeddings_path', 'data/processed_data/post_embeddings') \
+            if config.get('post_embeddings_enabled', False) else None
+
+        # Text embeddings of the posts, (post_ids, unit vectors), for candidates similar to the user's likes
+        self.post_embeddings = load_post_embeddings(post_embeddings_path) if post_embeddings_path else None
+        self.user_data = read_table(config['processed_user_data_path'])
+        self.post_data = read_table(config['processed_post_data_path'])
+        # Only the columns the user and post statistics are computed from
+        self.result_df = read_feature_table(config['processed_feed_data_path'],
+                                            counters_path=config.get('feature_counters_path',
+                                                                     'data/processed_data/counters'),
+                                            columns=['user_id', 'post_id', 'age', 'topic', 'target',
+                                                     'user_likes_to_views_ratio', 'user_proportion_of_likes_by_topic'])
+
+        self.mean_user_cr_by_age = round(self.result_df.groupby('age').user_likes_to_views_ratio.mean(), 3)
+        self.median_user_prop = round(self.result_df.groupby(['age', 'topic']).user_proportion_of_likes_by_topic.median(), 3)
+        self.users_proportion_of_likes_by_topics = round(self.result_df.groupby(['user_id', 'topic']).target.sum()
+                                                         / self.result_df.groupby('user_id').target.sum(), 3)
+
+    def _read_serving_config(self, config: dict):
+        # Candidate cutoffs follow the current config rather than the one the model was pickled with
+        self.n_similar_candidates = config.get('n_similar_candidates', 0)
+
+    def _build_serving_structures(self):
+        self.user_features = self._build_user_features()
+        self.post_features = self._build_post_features()
+        self.candidates = self._build_candidates()
+
+    def __getstate__(self):
+        # Serving structures are derived data: rebuilt on load so they always match the current code
+        state = self.__dict__.copy()
+        for name in ['user_features', 'post_features', 'candidates']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        self._read_serving_config(read_config())
+        self._build_serving_structures()
+
+    def fit(self, X, y=None, init_model: CatBoostClassifier = None):
+        logger.info("Fitting the model...")
+
+        # A prepared Pool (e.g. the cached quantized one) already carries the labels and the categorical features
+        if isinstance(X, Pool):
+            self.model.fit(X, init_model=init_model, verbose=False)
+        else:
+            self.model.fit(X, y, cat_features=self.cat_features, init_model=init_model, verbose=False)
+        self.set_model(self.model)
+
+        logger.info("Successfully fitted the model!")
+
+        return self
+
+    def set_model(self, model: CatBoostClassifier):
+        # Also takes a model fitted for another variant on the same train data
+        self.model = model
+        self.post_features = self._build_post_features()
+        self.candidates = self._build_candidates()
+
+        return self
+
+    def _build_user_features(self) -> UserFeatureStore:
+        store = UserFeatureStore(user_data=self.user_data,
+                                 result_df=self.result_df,
+                                 mean_user_cr_by_age=self.mean_user_cr_by_age,
+                                 median_user_prop=self.median_user_prop,
+                                 users_proportion_of_likes_by_topics=self.users_proportion_of_likes_by_topics)
+
+        # Profiles from the likes of the train data, models pickled before embeddings have none
+        if getattr(self, 'post_embeddings', None) is not None:
+            post_ids, embeddings = self.post_embeddings
+            likes = self.result_df[self.result_df.target == 1]
+            store.profiles = user_profiles(n_users=len(store),
+                                           user_rows=store.rows_of(likes.user_id.values),
+                                           post_rows=positions_of(likes.post_id.values, reference_ids=post_ids),
+                                           embeddings=embeddings)
+
+        return store
+
+    def _build_post_features(self) -> PostFeatureBlock:
+        # Column order of the score matrix is only known once the model is fitted
+        if not self.model.is_fitted():
+            return None
+
+        # Models pickled before online updates have no post_id in result_df, so no post counters
+        post_counts = None
+        if 'post_id' in self.result_df.columns:
+            post_counts = self.result_df.groupby('post_id').target.agg(['sum', 'count'])
+
+        embeddings = None
+        if getattr(self, 'post_embeddings', None) is not None:
+            embeddings = align_embeddings(self.post_data.post_id.values, *self.post_embeddings)
+
+        return PostFeatureBlock(post_data=self.post_data,
+                                feature_names=self.model.feature_names_,
+                                topic_index=self.user_features.topic_index,
+                                post_counts=post_counts,
+                                embeddings=embeddings)
+
+    def _build_candidates(self) -> CandidateGenerator:
+        if self.post_features is None:
+            return None
+
+        return CandidateGenerator(post_features=self.post_features,
+                                  n_similar=getattr(self, 'n_similar_candidates', 0) or 0)
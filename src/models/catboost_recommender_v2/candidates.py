@@ -0,0 +1,91 @@
+import numpy as np
+from typing import List
+from src.models.catboost_recommender_v2.feature_store import PostFeatureBlock
+from src.models.catboost_recommender_v2.similarity import PostEmbeddingIndex
+
+
+class CandidateGenerator:
+    def __init__(self, post_features: PostFeatureBlock, topic_weight: float = 1.0, popularity_weight: float = 1.0,
+                 n_similar: int = 0):
+        self.topic_weight = topic_weight
+        self.popularity_weight = popularity_weight
+        self.n_similar = n_similar
+
+        self.topic_codes = post_features.topic_codes
+        self.popularity = np.nan_to_num(post_features.post_columns['post_likes_to_views_ratio'].astype(float))
+        # Posts like the ones the user liked, when the block has text embeddings
+        self.index = None if post_features.embeddings is None else PostEmbeddingIndex(post_features.embeddings)
+
+    def generate(self, user_features: dict, n_candidates: int = None, rows: np.ndarray = None) -> np.ndarray:
+        if rows is None:
+            rows = np.arange(len(self.topic_codes))
+
+        # No cutoff or nothing to prune: every post goes to the ranker
+        if not n_candidates or n_candidates >= len(rows):
+            return rows
+
+        # Up to n_similar of the candidates are the posts most similar to the user's likes, the rest by score
+        similar = self.similar(user_features=user_features, k=min(self.n_similar, n_candidates), rows=rows)
+        n_scored = n_candidates - len(similar)
+        if n_scored == 0:
+            return np.sort(similar)
+
+        scores = self.score(user_features=user_features, rows=rows)
+        if len(similar):
+            scores[np.isin(rows, similar)] = -np.inf
+        top = np.argpartition(-scores, n_scored - 1)[:n_scored]
+
+        # Candidates keep the order of post_data
+        return np.sort(np.concatenate([rows[top], similar]))
+
+    def similar(self, user_features: dict, k: int, rows: np.ndarray = None) -> np.ndarray:
+        profile = user_features.get('user_profile')
+        if self.index is None or k <= 0 or profile is None or not profile.any():
+            return np.array([], dtype=np.int64)
+
+        return self.index.search(profile, k=k, rows=rows)[0]
+
+    def score(self, user_features: dict, rows: np.ndarray) -> np.ndarray:
+        # User's share of likes in the post's topic, 0 for topics the user never liked
+        topic_affinity = np.nan_to_num(np.append(user_features['user_proportion_of_likes_by_topic'], np.nan))
+        topic_affinity = topic_affinity[self.topic_codes[rows]]
+
+        return self.topic_weight * topic_affinity + self.popularity_weight * self.popularity[rows]
+
+    def score_pairs(self, users_features: List[dict], user_positions: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # Same score for many (user, post) pairs at once, see PostFeatureBlock.build_pairs
+        topic_affinity = np.nan_to_num(np.stack([np.append(features['user_proportion_of_likes_by_topic'], np.nan)
+                                                 for features in users_features]))
+        topic_affinity = topic_affinity[user_positions, self.topic_codes[rows]]
+        scores = self.topic_weight * topic_affinity + self.popularity_weight * self.popularity[rows]
+
+        # Each user's n_similar posts most similar to their likes come first, as in generate
+        profiles = [features.get('user_profile') for features in users_features]
+        if self.index is not None and self.n_similar > 0 and all(profile is not None for profile in profiles):
+            profiles = np.stack(profiles)
+            similarity = np.einsum('ij,ij->i', profiles[user_positions], self.index.embeddings[rows])
+
+            order = np.lexsort((-similarity, user_positions))
+            group_starts = np.searchsorted(user_positions[order], user_positions[order])
+            ranks = np.empty(len(rows), dtype=np.int64)
+            ranks[order] = np.arange(len(rows)) - group_starts
+
+            is_similar = (ranks < self.n_similar) & profiles.any(axis=1)[user_positions]
+            scores[is_similar] = np.inf
+
+        return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=int)
+
+    # Partial selection of everything scoring at least the k-th best, so ties at the cut are all kept
+    kth_score = -np.partition(-scores, k - 1)[k - 1]
+    selected = np.flatnonzero(scores >= kth_score)
+
+    # Descending by score, ties broken by position: stable like a full sort would be
+    order = np.lexsort((selected, -scores[selected]))
+
+    return selected[order][:k]
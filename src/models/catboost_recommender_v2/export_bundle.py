@@ -0,0 +1,20 @@
+import yaml
+from loguru import logger
+from src.app.utils import CustomUnpickler
+
+
+if __name__ == '__main__':
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+        recommender_path = config['recommender_v2_path']
+        bundle_path = config['recommender_v2_bundle_path']
+
+    logger.info(f"Loading {recommender_path}...")
+
+    # Also resolves older pickles written from recommender.py's __main__
+    with open(recommender_path, 'rb') as file:
+        recommender = CustomUnpickler(file).load()
+
+    recommender.save_bundle(bundle_path)
+
+    logger.info("Successfully exported the serving bundle of Recommender model V2!")
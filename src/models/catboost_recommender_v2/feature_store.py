@@ -0,0 +1,439 @@
+import os
+import json
+from typing import List
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+
+def _encode_columns(columns: dict) -> tuple:
+    # String columns become integer codes plus a vocabulary, so every column is a plain numeric array
+    encoded, vocabularies = {}, {}
+    for column, values in columns.items():
+        if not pd.api.types.is_numeric_dtype(values):
+            vocabulary, codes = np.unique(values.astype(str), return_inverse=True)
+            encoded[column] = codes.astype(np.int32)
+            vocabularies[column] = vocabulary.astype(object)
+        else:
+            encoded[column] = values
+
+    return encoded, vocabularies
+
+
+def _save_arrays(path: str, arrays: dict):
+    os.makedirs(path, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), values, allow_pickle=False)
+
+
+def _load_arrays(path: str, names: List[str], mmap_mode: str = None) -> dict:
+    # With mmap_mode='r' every process maps the same pages of the files through the OS page cache
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            for name in names}
+
+
+def _build_row_index(user_ids: np.ndarray) -> np.ndarray:
+    # Dense user_id -> row array, -1 for ids without a row
+    row_index = np.full(user_ids.max() + 1 if len(user_ids) else 0, -1, dtype=np.int32)
+    row_index[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+
+    return row_index
+
+
+def _lookup_rows(row_index: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    ids = np.asarray(ids)
+    rows = np.full(len(ids), -1, dtype=np.int64)
+
+    valid = (ids >= 0) & (ids < len(row_index))
+    rows[valid] = row_index[ids[valid]]
+
+    return rows
+
+
+class TextBlob:
+    # All texts concatenated in one utf-8 buffer, text i is data[offsets[i]:offsets[i + 1]]
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> 'TextBlob':
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(text) for text in encoded])
+
+        return cls(data=np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets=offsets)
+
+    def __getitem__(self, row: int) -> str:
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def save(self, path: str, name: str):
+        _save_arrays(path=path, arrays={f"{name}_data": self.data, f"{name}_offsets": self.offsets})
+
+    @classmethod
+    def load(cls, path: str, name: str, mmap_mode: str = None) -> 'TextBlob':
+        arrays = _load_arrays(path=path, names=[f"{name}_data", f"{name}_offsets"], mmap_mode=mmap_mode)
+
+        return cls(data=arrays[f"{name}_data"], offsets=arrays[f"{name}_offsets"])
+
+
+def _save_meta(path: str, meta: dict):
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+
+
+def _load_meta(path: str) -> dict:
+    with open(os.path.join(path, 'meta.json'), 'r') as file:
+        return json.load(file)
+
+
+# Like/view counters of the user feature store
+COUNTER_ARRAYS = ['likes', 'views', 'topic_likes', 'topic_views']
+
+
+class UserFeatureStore:
+    def __init__(self, user_data: pd.DataFrame, result_df: pd.DataFrame, mean_user_cr_by_age: pd.Series,
+                 median_user_prop: pd.Series, users_proportion_of_likes_by_topics: pd.Series):
+        logger.info("Building user feature store...")
+
+        user_ids = user_data.user_id.values
+        ages = user_data.age.values
+
+        # Dense row index: user_id -> position in every array of the store
+        self.user_ids = user_ids
+        self.row_index = _build_row_index(user_ids)
+        self.static_features, self.vocabularies = _encode_columns({column: user_data[column].values
+                                                                    for column in user_data.columns
+                                                                    if column != 'user_id'})
+
+        self.topics = sorted(result_df.topic.unique().tolist())
+        self.topic_index = {topic: i for i, topic in enumerate(self.topics)}
+
+        self.likes_to_views_ratio = np.full(len(user_ids), np.nan)
+        self.proportion_of_likes_by_topic = np.full((len(user_ids), len(self.topics)), np.nan)
+
+        # Users seen in training data get their own ratios
+        users_cr = result_df.groupby('user_id').user_likes_to_views_ratio.first()
+        known = user_data.user_id.isin(users_cr.index).values
+
+        users_props = users_proportion_of_likes_by_topics.unstack().reindex(index=user_ids, columns=self.topics)
+        self.likes_to_views_ratio[known] = users_cr.reindex(user_ids[known]).values
+        self.proportion_of_likes_by_topic[known] = users_props.values[known]
+
+        # Like/view counters behind the ratios: the base that online events are added to
+        user_counts = result_df.groupby('user_id').target.agg(['sum', 'count']).reindex(user_ids, fill_value=0)
+        topic_counts = result_df.groupby(['user_id', 'topic']).target.agg(['sum', 'count'])
+        self.likes = user_counts['sum'].values.astype(np.float64)
+        self.views = user_counts['count'].values.astype(np.float64)
+        self.topic_likes = topic_counts['sum'].unstack().reindex(index=user_ids, columns=self.topics)\
+            .fillna(0).values.astype(np.float64)
+        self.topic_views = topic_counts['count'].unstack().reindex(index=user_ids, columns=self.topics)\
+            .fillna(0).values.astype(np.float64)
+        self.online = {}
+        # Unit vectors of the posts each user liked, set by the recommender when it has post embeddings
+        self.profiles = None
+
+        # Cold users fall back to the values of their age bucket, resolved once per age
+        available_ages = np.sort(mean_user_cr_by_age.index.values)
+        for age in np.unique(ages[~known]):
+            bucket = self._resolve_age_bucket(age=age, available_ages=available_ages)
+            mask = ~known & (ages == age)
+
+            self.likes_to_views_ratio[mask] = mean_user_cr_by_age.get(bucket)
+            self.proportion_of_likes_by_topic[mask] = median_user_prop.get(bucket).reindex(self.topics).values
+
+        logger.info(f"Built user feature store for {len(user_ids)} users")
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._row(user_id) >= 0
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def get(self, user_id: int) -> dict:
+        row = self._row(user_id)
+        if row < 0:
+            raise KeyError(f"Unknown user_id: {user_id}")
+
+        features = {column: values[row] for column, values in self.static_features.items()}
+        for column, vocabulary in self.vocabularies.items():
+            features[column] = vocabulary[features[column]]
+        features['user_likes_to_views_ratio'] = self.likes_to_views_ratio[row]
+        # Indexed by self.topic_index
+        features['user_proportion_of_likes_by_topic'] = self.proportion_of_likes_by_topic[row]
+        if self.profiles is not None:
+            features['user_profile'] = self.profiles[row]
+
+        if row in self.online:
+            features.update(self._online_features(row))
+
+        return features
+
+    def record_event(self, user_id: int, topic_code: int, likes: int, views: int) -> bool:
+        row = self._row(user_id)
+        if row < 0:
+            return False
+        if self.likes is None:
+            raise ValueError("The user feature store has no like/view counters for online updates")
+
+        # Deltas live beside the read-only (possibly memory-mapped) arrays: likes and views per topic,
+        # the last column for posts of topics unseen in training
+        counters = self.online.get(row)
+        if counters is None:
+            counters = self.online[row] = np.zeros((2, len(self.topics) + 1))
+        counters[0, topic_code] += likes
+        counters[1, topic_code] += views
+
+        return True
+
+    def _online_features(self, row: int) -> dict:
+        # Same ratios as the train data, over training counts plus the events received since
+        counters = self.online[row]
+        likes = self.likes[row] + counters[0].sum()
+        views = self.views[row] + counters[1].sum()
+        topic_likes = self.topic_likes[row] + counters[0, :-1]
+        topic_views = self.topic_views[row] + counters[1, :-1]
+
+        features = {}
+        # Until a user's first view the age bucket fallback stays
+        if views > 0:
+            features['user_likes_to_views_ratio'] = np.round(likes / views, 3)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                features['user_proportion_of_likes_by_topic'] = np.where(topic_views > 0,
+                                                                         np.round(topic_likes / likes, 3), np.nan)
+
+        return features
+
+    def save(self, path: str):
+        arrays = {f"static_{column}": values for column, values in self.static_features.items()}
+        arrays['user_ids'] = self.user_ids
+        arrays['row_index'] = self.row_index
+        arrays['likes_to_views_ratio'] = self.likes_to_views_ratio
+        arrays['proportion_of_likes_by_topic'] = self.proportion_of_likes_by_topic
+        has_counters = self.likes is not None
+        if has_counters:
+            arrays.update({name: getattr(self, name) for name in COUNTER_ARRAYS})
+        if self.profiles is not None:
+            arrays['profiles'] = self.profiles
+        _save_arrays(path=path, arrays=arrays)
+
+        _save_meta(path=path, meta={'static_columns': list(self.static_features),
+                                    'vocabularies': {column: vocabulary.tolist()
+                                                     for column, vocabulary in self.vocabularies.items()},
+                                    'topics': self.topics,
+                                    'counters': has_counters,
+                                    'profiles': self.profiles is not None})
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = None) -> 'UserFeatureStore':
+        meta = _load_meta(path=path)
+        # Bundles exported before online updates have no counters
+        counters = COUNTER_ARRAYS if meta.get('counters') else []
+        arrays = _load_arrays(path=path,
+                              names=['user_ids', 'row_index', 'likes_to_views_ratio', 'proportion_of_likes_by_topic']
+                              + [f"static_{column}" for column in meta['static_columns']] + counters
+                              + (['profiles'] if meta.get('profiles') else []),
+                              mmap_mode=mmap_mode)
+
+        store = cls.__new__(cls)
+        store.user_ids = arrays['user_ids']
+        store.row_index = arrays['row_index']
+        store.static_features = {column: arrays[f"static_{column}"] for column in meta['static_columns']}
+        store.vocabularies = {column: np.array(vocabulary, dtype=object)
+                              for column, vocabulary in meta['vocabularies'].items()}
+        store.topics = meta['topics']
+        store.topic_index = {topic: i for i, topic in enumerate(store.topics)}
+        store.likes_to_views_ratio = arrays['likes_to_views_ratio']
+        store.proportion_of_likes_by_topic = arrays['proportion_of_likes_by_topic']
+        for name in COUNTER_ARRAYS:
+            setattr(store, name, arrays.get(name))
+        store.online = {}
+        store.profiles = arrays.get('profiles')
+
+        return store
+
+    def rows_of(self, user_ids: np.ndarray) -> np.ndarray:
+        return _lookup_rows(row_index=self.row_index, ids=user_ids)
+
+    def _row(self, user_id: int) -> int:
+        if not 0 <= user_id < len(self.row_index):
+            return -1
+
+        return int(self.row_index[user_id])
+
+    @staticmethod
+    def _resolve_age_bucket(age: int, available_ages: np.ndarray) -> int:
+        age = max(age, 14)
+
+        # Closest known age from below, as in the original per-request lookup
+        position = np.searchsorted(available_ages, age, side='right') - 1
+        if position < 0:
+            position = 0
+
+        return available_ages[position]
+
+
+class PostFeatureBlock:
+    def __init__(self, post_data: pd.DataFrame, feature_names: List[str], topic_index: dict,
+                 post_counts: pd.DataFrame = None, embeddings: np.ndarray = None):
+        logger.info("Building post feature block...")
+
+        self.feature_names = list(feature_names)
+
+        self.post_ids = post_data.post_id.values
+        self.row_index = _build_row_index(self.post_ids)
+        self.texts = post_data.text.values
+        self.topics = post_data.topic.values
+        # Position of each post's topic in the user's topic proportions, -1 for topics unseen in training
+        self.topic_codes = post_data.topic.map(topic_index).fillna(-1).astype(int).values
+
+        # Post-side columns are computed once, the rest come from the user at request time
+        self.post_columns = {column: post_data[column].values
+                             for column in self.feature_names if column in post_data.columns}
+        self.user_columns = [column for column in self.feature_names if column not in self.post_columns]
+
+        # Like/view counts ('sum' and 'count' of target by post_id) behind post_likes_to_views_ratio
+        self.likes, self.views = None, None
+        if post_counts is not None:
+            post_counts = post_counts.reindex(self.post_ids, fill_value=0)
+            self.likes = post_counts['sum'].values.astype(np.float64)
+            self.views = post_counts['count'].values.astype(np.float64)
+
+        # Unit text vectors in the rows of the block, for similarity to the user's liked posts
+        self.embeddings = embeddings
+
+        logger.info(f"Built post feature block for {len(self.post_ids)} posts")
+
+    def __len__(self) -> int:
+        return len(self.post_ids)
+
+    def build(self, user_features: dict, rows: np.ndarray = None) -> pd.DataFrame:
+        # A fresh frame over the prebuilt columns rather than one preallocated frame filled in place:
+        # the inference threads score concurrently from the same block, and post columns are not copied.
+        # Categorical columns stay strings, the values CatBoost hashes its categories from
+        topic_codes = self.topic_codes if rows is None else self.topic_codes[rows]
+        n_rows = len(topic_codes)
+
+        columns = {}
+        for column in self.feature_names:
+            if column in self.post_columns:
+                values = self.post_columns[column]
+                columns[column] = values if rows is None else values[rows]
+            elif column == 'user_proportion_of_likes_by_topic':
+                # Trailing NaN is picked by the -1 code of unseen topics
+                columns[column] = np.append(user_features[column], np.nan)[topic_codes]
+            else:
+                columns[column] = np.full(n_rows, user_features[column])
+
+        return pd.DataFrame(columns, copy=False)
+
+    def build_batch(self, users_features: List[dict], users_rows: List[np.ndarray] = None) -> pd.DataFrame:
+        if users_rows is None:
+            users_rows = [np.arange(len(self.post_ids))] * len(users_features)
+
+        # Users are stacked one after another, each over its own rows of posts
+        counts = [len(rows) for rows in users_rows]
+        user_positions = np.repeat(np.arange(len(users_features)), counts)
+
+        return self.build_pairs(users_features=users_features,
+                                user_positions=user_positions,
+                                rows=np.concatenate(users_rows))
+
+    def build_pairs(self, users_features: List[dict], user_positions: np.ndarray, rows: np.ndarray) -> pd.DataFrame:
+        # One score matrix row per (users_features[user_positions[i]], post at rows[i]) pair
+        columns = {}
+        for column in self.feature_names:
+            if column in self.post_columns:
+                columns[column] = self.post_columns[column][rows]
+            elif column == 'user_proportion_of_likes_by_topic':
+                props = np.stack([np.append(features[column], np.nan) for features in users_features])
+                columns[column] = props[user_positions, self.topic_codes[rows]]
+            else:
+                columns[column] = np.array([features[column] for features in users_features])[user_positions]
+
+        return pd.DataFrame(columns, copy=False)
+
+    def payloads(self, rows: np.ndarray) -> List[dict]:
+        # PostGet-shaped records straight from the preindexed arrays
+        return [{'id': int(post_id), 'text': text, 'topic': topic}
+                for post_id, text, topic in zip(self.post_ids[rows], (self.texts[row] for row in rows),
+                                                self.topics[rows])]
+
+    def record_event(self, row: int, likes: int, views: int) -> float:
+        if self.likes is None:
+            raise ValueError("The post feature block has no like/view counters for online updates")
+
+        # The block is small: the first event swaps read-only arrays for private copies
+        if not self.likes.flags.writeable:
+            self.likes, self.views = np.array(self.likes), np.array(self.views)
+        ratio = self.post_columns['post_likes_to_views_ratio']
+        if not ratio.flags.writeable:
+            ratio = self.post_columns['post_likes_to_views_ratio'] = np.array(ratio)
+
+        self.likes[row] += likes
+        self.views[row] += views
+        if self.views[row] > 0:
+            ratio[row] = np.round(self.likes[row] / self.views[row], 3)
+
+        return ratio[row]
+
+    def rows_for(self, post_ids: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(np.isin(self.post_ids, post_ids))
+
+    def rows_of(self, post_ids: np.ndarray) -> np.ndarray:
+        # Row of every given post, -1 for posts not in the block
+        return _lookup_rows(row_index=self.row_index, ids=post_ids)
+
+    def save(self, path: str):
+        columns, vocabularies = _encode_columns(self.post_columns)
+
+        arrays = {f"column_{column}": values for column, values in columns.items()}
+        arrays['post_ids'] = self.post_ids
+        arrays['topic_codes'] = self.topic_codes
+        if self.likes is not None:
+            arrays.update({'likes': self.likes, 'views': self.views})
+        if self.embeddings is not None:
+            arrays['embeddings'] = self.embeddings
+        _save_arrays(path=path, arrays=arrays)
+        TextBlob.from_texts(texts=[self.texts[row] for row in range(len(self))]).save(path=path, name='texts')
+
+        _save_meta(path=path, meta={'feature_names': self.feature_names,
+                                    'post_columns': list(self.post_columns),
+                                    'vocabularies': {column: vocabulary.tolist()
+                                                     for column, vocabulary in vocabularies.items()},
+                                    'topics': self.topics.tolist(),
+                                    'counters': self.likes is not None,
+                                    'embeddings': self.embeddings is not None})
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = None) -> 'PostFeatureBlock':
+        meta = _load_meta(path=path)
+        arrays = _load_arrays(path=path,
+                              names=['post_ids', 'topic_codes'] + [f"column_{column}" for column in meta['post_columns']]
+                              + (['likes', 'views'] if meta.get('counters') else [])
+                              + (['embeddings'] if meta.get('embeddings') else []),
+                              mmap_mode=mmap_mode)
+
+        block = cls.__new__(cls)
+        block.feature_names = meta['feature_names']
+        block.post_ids = arrays['post_ids']
+        block.row_index = _build_row_index(block.post_ids)
+        block.texts = TextBlob.load(path=path, name='texts', mmap_mode=mmap_mode)
+        block.topics = np.array(meta['topics'], dtype=object)
+        block.topic_codes = arrays['topic_codes']
+
+        # The block is small: categorical columns are decoded once for the score matrices
+        block.post_columns = {}
+        for column in meta['post_columns']:
+            values = arrays[f"column_{column}"]
+            if column in meta['vocabularies']:
+                values = np.array(meta['vocabularies'][column], dtype=object)[values]
+            block.post_columns[column] = values
+        block.user_columns = [column for column in block.feature_names if column not in block.post_columns]
+        block.likes, block.views = arrays.get('likes'), arrays.get('views')
+        block.embeddings = arrays.get('embeddings')
+
+        return block
@@ -1,106 +1,125 @@
-import yaml
-import pickle
+import os
 from loguru import logger
 import pandas as pd
 import numpy as np
+from typing import List, Tuple
 from catboost import CatBoostClassifier
+from src.models.catboost_recommender_v2.base import BaseRecommender, read_config
+from src.models.catboost_recommender_v2.feature_store import UserFeatureStore, PostFeatureBlock
+from src.models.catboost_recommender_v2.candidates import top_k
+from src.models.timing import stage
 
 
-class Recommender:
+class Recommender(BaseRecommender):
     def __init__(self):
-        self.model = CatBoostClassifier(n_estimators=150, random_state=1)
-        self.cat_features = ['gender', 'country', 'city', 'os', 'source', 'topic']
-        self.cols_to_drop = ['user_id', 'exp_group', 'post_id', 'text']
-        
-        with open('config.yaml', 'r') as file:
-            config = yaml.safe_load(file)
-            user_data_path = config['processed_user_data_path']
-            post_data_path = config['processed_post_data_path']
-            result_data_path = config['processed_feed_data_path']
-        
-        self.user_data = pd.read_csv(user_data_path, sep=';', index_col=None)
-        self.post_data = pd.read_csv(post_data_path, sep=';', index_col=None)
-        self.result_df = pd.read_csv(result_data_path, sep=';', index_col=None)
-
-        self.mean_user_cr_by_age = round(self.result_df.groupby('age').user_likes_to_views_ratio.mean(), 3)
-        self.median_user_prop = round(self.result_df.groupby(['age', 'topic']).user_proportion_of_likes_by_topic.median(), 3)
-        self.users_proportion_of_likes_by_topics = round(self.result_df.groupby(['user_id', 'topic']).target.sum()
-                                                            / self.result_df.groupby('user_id').target.sum(), 3)
-
-    def fit(self, X, y):
-        logger.info("Fitting the model...")
-
-        self.model.fit(X, y, cat_features=self.cat_features, verbose=False)
-
-        logger.info("Successfully fitted the model!")
-
-        return self
+        super().__init__()
+
+        config = read_config()
+        self._read_serving_config(config)
+        self._load_data(config)
+        self._build_serving_structures()
+
+    def _read_serving_config(self, config: dict):
+        super()._read_serving_config(config)
+        self.n_candidates = config.get('n_candidates')
+
+    @classmethod
+    def load_bundle(cls, path: str, mmap_mode: str = 'r') -> 'Recommender':
+        logger.info(f"Loading serving bundle from {path}...")
+
+        # Only the model and the serving feature arrays: no training frames, no CSVs
+        recommender = cls.__new__(cls)
+        recommender.model = CatBoostClassifier()
+        recommender.model.load_model(os.path.join(path, 'model.cbm'))
+        recommender.cat_features = recommender.model.get_param('cat_features') or []
+        # Feature arrays are memory-mapped read-only by default, so worker processes share them
+        recommender.user_features = UserFeatureStore.load(os.path.join(path, 'users'), mmap_mode=mmap_mode)
+        recommender.post_features = PostFeatureBlock.load(os.path.join(path, 'posts'), mmap_mode=mmap_mode)
+
+        recommender._read_serving_config(read_config())
+        recommender.candidates = recommender._build_candidates()
+
+        logger.info("Loaded serving bundle")
+
+        return recommender
+
+    def save_bundle(self, path: str):
+        logger.info(f"Saving serving bundle to {path}...")
+
+        os.makedirs(path, exist_ok=True)
+        self.model.save_model(os.path.join(path, 'model.cbm'))
+        self.user_features.save(os.path.join(path, 'users'))
+        self.post_features.save(os.path.join(path, 'posts'))
+
+        logger.info(f"Saved serving bundle to {path}")
 
     def predict(self, user_id: int, limit: int = 5):
         logger.info("Predicting...")
 
-        # Preparing DataFrame for user: merged df with user_data for user_id and post_data
-        user = self.user_data[self.user_data.user_id == user_id].reset_index().drop('index', axis=1)
-        posts = self.post_data.copy()
-        posts['user_id'] = user_id
-        user_df = pd.merge(user, posts, on='user_id', how='right')
+        # Building score matrix for user: candidate posts with user's features broadcast into them
+        rows, user_df = self._get_users_features(user_id=user_id)
 
-        # Get necessary user's features
-        user_df = self._get_users_features(user_df=user_df, user_id=user_id)
-
-        # Predicting probabilities, sorting them in descending and building recs as top N posts by probs
-        posts['pred_prob'] = self.model.predict_proba(user_df.drop(self.cols_to_drop, axis=1))[:, 1]
-        sorted_posts = posts.sort_values('pred_prob', ascending=False).rename(columns={'post_id': 'id'})
-        recs = sorted_posts[['id', 'text', 'topic']].head(limit)
-        recs = recs.to_dict(orient='records')
+        # Ranking candidates by predicted probabilities and building recs as top N posts by probs
+        with stage('predict_proba'):
+            pred_prob = self.model.predict_proba(user_df)[:, 1]
+        recs = self._top_posts(pred_prob=pred_prob, rows=rows, limit=limit)
 
         logger.info("Successfully predicted!")
 
         return recs
-    
-    def _get_users_features(self, user_df: pd.DataFrame, user_id: int) -> pd.DataFrame:
-        user_df = user_df.copy()
 
-        if self.result_df[self.result_df.user_id == user_id].user_likes_to_views_ratio.values.size > 0:
-            user_likes_to_views_ratio = self.result_df[self.result_df.user_id == id].user_likes_to_views_ratio.iloc[0]
-            user_proportion_of_likes_by_topic = user_df.topic.map(self.users_proportion_of_likes_by_topics[id])
-        else:
-            age = self.user_data[self.user_data.user_id == user_id].age.values[0]
-            if age < 14:
-                age = 14
+    def predict_batch(self, user_ids: List[int], limit: int = 5) -> List[List[dict]]:
+        logger.info(f"Predicting for {len(user_ids)} users...")
 
-            while self.median_user_prop.get(age) is None:
-                age -= 1
+        # One score matrix for all users' candidates, scored with a single model call
+        with stage('user_lookup'):
+            users_features = [self.user_features.get(user_id) for user_id in user_ids]
+        with stage('candidates'):
+            users_rows = [self.candidates.generate(user_features=features, n_candidates=self.n_candidates)
+                          for features in users_features]
+            user_df = self.post_features.build_batch(users_features=users_features, users_rows=users_rows)
 
-            user_likes_to_views_ratio = self.mean_user_cr_by_age.get(age)
-            user_proportion_of_likes_by_topic = user_df.topic.map(self.median_user_prop.get(age))
+        with stage('predict_proba'):
+            pred_prob = self.model.predict_proba(user_df)[:, 1]
+        pred_probs = np.split(pred_prob, np.cumsum([len(rows) for rows in users_rows])[:-1])
+        recs = [self._top_posts(pred_prob=pred_prob, rows=rows, limit=limit)
+                for pred_prob, rows in zip(pred_probs, users_rows)]
 
-        user_df['user_likes_to_views_ratio'] = user_likes_to_views_ratio
-        user_df['user_proportion_of_likes_by_topic'] = user_proportion_of_likes_by_topic
+        logger.info("Successfully predicted!")
 
-        return user_df
+        return recs
 
+    def record_event(self, user_id: int, post_id: int, action: str = 'view', target: int = 0) -> bool:
+        # The view of a liked post already has target 1: like events are skipped, as when the features are built
+        if action == 'like':
+            return False
+        likes, views = int(target), 1
 
-if __name__ == '__main__':
-    MODEL_PATH = 'src/models/catboost_recommender_v2/artifacts'
-    MODEL_NAME = 'recommender_v2.pkl'
+        post_row = self.post_features.rows_of(np.array([post_id]))[0]
+        if post_row < 0:
+            return False
 
-    logger.info("Reading the train data")
+        topic_code = self.post_features.topic_codes[post_row]
+        if not self.user_features.record_event(user_id=user_id, topic_code=topic_code, likes=likes, views=views):
+            return False
 
-    with open('config.yaml', 'r') as file:
-        config = yaml.safe_load(file)
-        train_data_path = config['train_data_v2_path']
-    
-    train = pd.read_csv(train_data_path, sep=';', index_col=None)
+        self.candidates.popularity[post_row] = self.post_features.record_event(row=post_row, likes=likes, views=views)
 
-    logger.info("Successfully read the train data!")
+        return True
 
-    X_train = train.drop(['user_id', 'post_id', 'target'], axis=1)
-    y_train = train.target
+    def _top_posts(self, pred_prob: np.ndarray, rows: np.ndarray, limit: int) -> List[dict]:
+        # Partial selection of the N most probable posts instead of sorting all of them
+        with stage('top_k'):
+            top_rows = rows[top_k(scores=pred_prob, k=limit)]
 
-    recommender = Recommender()
-    recommender.fit(X_train, y_train)
+        with stage('serialization'):
+            return self.post_features.payloads(rows=top_rows)
 
-    pickle.dump(recommender, open(f"{MODEL_PATH}/{MODEL_NAME}", 'wb'))
+    def _get_users_features(self, user_id: int) -> Tuple[np.ndarray, pd.DataFrame]:
+        with stage('user_lookup'):
+            features = self.user_features.get(user_id)
 
-    logger.info("Successfully trained and saved the Recommender model V2!")
+        # Cheap first stage prunes the corpus before the ranker sees it
+        with stage('candidates'):
+            rows = self.candidates.generate(user_features=features, n_candidates=self.n_candidates)
+            return rows, self.post_features.build(user_features=features, rows=rows)
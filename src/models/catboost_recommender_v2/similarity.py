@@ -0,0 +1,82 @@
+import numpy as np
+from scipy import sparse
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    # Unit vectors, so a dot product is the cosine similarity; zero rows stay zero
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def positions_of(ids: np.ndarray, reference_ids: np.ndarray) -> np.ndarray:
+    # Position of every id in reference_ids, -1 for ids not there
+    ids = np.asarray(ids)
+    if len(reference_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+
+    order = np.argsort(reference_ids, kind='stable')
+    positions = np.searchsorted(reference_ids, ids, sorter=order).clip(0, len(order) - 1)
+    positions = order[positions]
+
+    return np.where(reference_ids[positions] == ids, positions, -1)
+
+
+def align_embeddings(post_ids: np.ndarray, embedding_post_ids: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+    # Rows in the order of post_ids, zeros for posts without an embedding
+    aligned = np.zeros((len(post_ids), embeddings.shape[1]), dtype=np.float32)
+
+    positions = positions_of(post_ids, reference_ids=embedding_post_ids)
+    aligned[positions >= 0] = embeddings[positions[positions >= 0]]
+
+    return aligned
+
+
+def user_profiles(n_users: int, user_rows: np.ndarray, post_rows: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+    # Mean direction of the posts each user liked, zeros for users without likes;
+    # a sparse users x posts matrix of like counts keeps memory at the number of likes
+    known = (user_rows >= 0) & (post_rows >= 0)
+    likes = sparse.csr_matrix((np.ones(known.sum(), dtype=np.float32), (user_rows[known], post_rows[known])),
+                              shape=(n_users, len(embeddings)))
+
+    return normalize_rows(np.asarray(likes @ embeddings, dtype=np.float32))
+
+
+class PostEmbeddingIndex:
+    def __init__(self, embeddings: np.ndarray, block_size: int = 16_384):
+        # Unit post vectors in the rows of the post feature block
+        self.embeddings = embeddings
+        self.block_size = block_size
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def similarity(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        embeddings = self.embeddings if rows is None else self.embeddings[rows]
+
+        return embeddings @ query
+
+    def search(self, queries: np.ndarray, k: int, rows: np.ndarray = None) -> np.ndarray:
+        # Exact top k by cosine similarity, scanned block by block so memory stays at k + block_size per query
+        queries = np.atleast_2d(queries).astype(np.float32)
+        rows = np.arange(len(self.embeddings)) if rows is None else np.asarray(rows)
+        k = min(k, len(rows))
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.int64)
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            scores = np.concatenate([best_scores, queries @ self.embeddings[block].T], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block, (len(queries), len(block)))], axis=1)
+
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                candidates = np.take_along_axis(candidates, top, axis=1)
+            best_rows, best_scores = candidates, scores
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+
+        return np.take_along_axis(best_rows, order, axis=1)
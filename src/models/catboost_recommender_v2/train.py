@@ -0,0 +1,175 @@
+import os
+import json
+import yaml
+import pickle
+import pandas as pd
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from catboost import CatBoostClassifier, Pool
+from src.models.catboost_recommender_v2.recommender import Recommender
+from src.models.catboost_recommender_v2.validation_model_v2 import Recommender_validation
+from src.data.storage import table_partitions, CATEGORICAL_COLUMNS
+from src.features.build_features import read_feature_table, iter_feature_table, read_counters_state
+
+
+NOT_FEATURES = ['user_id', 'post_id', 'target']
+
+
+def _train_data_stamp(train_data_path: str, counters_path: str, cat_features: List[str]) -> dict:
+    # Every partition of the train data, and the counters its features are recomputed from after a refresh
+    partitions = [[os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns]
+                  for path in table_partitions(train_data_path)]
+    return {'train_data_path': os.path.abspath(train_data_path), 'partitions': partitions,
+            'counters': read_counters_state(counters_path), 'cat_features': cat_features}
+
+
+def load_train_pool(train_data_path: str, counters_path: str, pool_path: str, cat_features: List[str]) -> Pool:
+    # The quantized pool is built once per version of the train data and reused by every model and run
+    stamp = _train_data_stamp(train_data_path, counters_path=counters_path, cat_features=cat_features)
+    stamp_path = f"{pool_path}.json"
+
+    if os.path.exists(pool_path) and os.path.exists(stamp_path):
+        with open(stamp_path, 'r') as file:
+            if json.load(file) == stamp:
+                logger.info(f"Loading the quantized train pool from {pool_path}...")
+                return Pool(f"quantized://{pool_path}")
+
+    logger.info(f"Building the quantized train pool from {train_data_path}...")
+
+    train = read_feature_table(train_data_path, counters_path=counters_path, categories=CATEGORICAL_COLUMNS)
+    pool = Pool(train.drop(NOT_FEATURES, axis=1), train.target, cat_features=cat_features)
+    del train
+    # Features become bins once, so the raw frame is freed and fitting skips the quantization
+    pool.quantize()
+
+    os.makedirs(os.path.dirname(pool_path) or '.', exist_ok=True)
+    pool.save(pool_path)
+    with open(stamp_path, 'w') as file:
+        json.dump(stamp, file)
+
+    logger.info(f"Saved the quantized train pool of {pool.num_row()} rows to {pool_path}")
+
+    return pool
+
+
+def load_new_rows_pool(train_data_path: str, counters_path: str, skip_rows: int, cat_features: List[str],
+                       init_model: CatBoostClassifier, chunksize: int = 1_000_000) -> Tuple[Pool, int]:
+    # Feature refreshes append the new interactions at the end of the train data
+    chunks, position = [], 0
+    for chunk in iter_feature_table(train_data_path, counters_path=counters_path, chunksize=chunksize):
+        if position + len(chunk) > skip_rows:
+            chunks.append(chunk.iloc[max(0, skip_rows - position):])
+        position += len(chunk)
+
+    if not chunks:
+        return None, position
+
+    new_rows = pd.concat(chunks, ignore_index=True)
+    # Labels of the same type as the classes of the model continued, quantized pools have float ones
+    label = new_rows.target.astype(type(init_model.classes_[0]))
+
+    return Pool(new_rows.drop(NOT_FEATURES, axis=1), label, cat_features=cat_features), position
+
+
+def fit_variants(variants: Dict[str, object], pool: Pool, thread_count: int,
+                 init_models: Dict[str, CatBoostClassifier] = None) -> Dict[str, object]:
+    # Variants with the same CatBoost parameters would fit the same model: it is fitted once and shared
+    groups = {}
+    for name, recommender in variants.items():
+        key = json.dumps(recommender.model.get_params(), sort_keys=True, default=str)
+        groups.setdefault(key, []).append(name)
+
+    # Distinct models are fitted at the same time with the cores split between them
+    thread_count = thread_count if thread_count > 0 else os.cpu_count()
+    threads_per_model = max(1, thread_count // len(groups))
+
+    def fit(names: List[str]):
+        fitted = variants[names[0]]
+        fitted.model.set_params(thread_count=threads_per_model)
+        fitted.fit(pool, init_model=(init_models or {}).get(names[0]))
+
+        for name in names[1:]:
+            variants[name].set_model(fitted.model)
+
+    with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix='fit') as executor:
+        for future in [executor.submit(fit, names) for names in groups.values()]:
+            future.result()
+
+    logger.info(f"Fitted {len(groups)} models for {len(variants)} variants with {threads_per_model} threads each")
+
+    return variants
+
+
+def load_training_state(state_path: str) -> dict:
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path, 'r') as file:
+        return json.load(file)
+
+
+def train_models(config: dict):
+    train_data_path = config['train_data_v2_path']
+    counters_path = config.get('feature_counters_path', 'data/processed_data/counters')
+    model_paths = {'production': config['recommender_v2_path'],
+                   'validation': config.get('validation_model_v2_path',
+                                            'src/models/catboost_recommender_v2/artifacts/validation_model_v2.pkl')}
+    state_path = config.get('training_state_path', 'src/models/catboost_recommender_v2/artifacts/training.json')
+    thread_count = config.get('training_thread_count', -1)
+
+    # The processed data is read once for both variants
+    recommender = Recommender()
+    variants = {'production': recommender, 'validation': Recommender_validation(source=recommender)}
+    cat_features = recommender.cat_features
+
+    state = load_training_state(state_path)
+    warm_start = config.get('training_warm_start', False) and state is not None
+
+    if warm_start:
+        # Only the rows appended since the last training, as extra trees on top of the previous models
+        init_models = {}
+        for name, path in model_paths.items():
+            with open(path, 'rb') as file:
+                init_models[name] = pickle.load(file).model
+
+        pool, train_rows = load_new_rows_pool(train_data_path, counters_path=counters_path, skip_rows=state['rows'],
+                                              cat_features=cat_features, init_model=init_models['production'])
+        if train_rows < state['rows']:
+            logger.info("The train data was rebuilt since the last training, training from scratch")
+            warm_start = False
+        elif pool is None:
+            logger.info("No new train data since the last training")
+            return
+        else:
+            logger.info(f"Warm-starting from the previous models on {train_rows - state['rows']} new rows...")
+            for variant in variants.values():
+                variant.model.set_params(n_estimators=config.get('training_warm_start_estimators', 50))
+
+    if not warm_start:
+        init_models = None
+        pool = load_train_pool(train_data_path, counters_path=counters_path,
+                               pool_path=config.get('training_pool_path', 'data/train_data/catboost_v2/train.quantized'),
+                               cat_features=cat_features)
+        train_rows = pool.num_row()
+
+    fit_variants(variants, pool=pool, thread_count=thread_count, init_models=init_models)
+
+    for name, path in model_paths.items():
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as file:
+            pickle.dump(variants[name], file)
+        logger.info(f"Saved the {name} model to {path}")
+    recommender.save_bundle(config['recommender_v2_bundle_path'])
+
+    with open(state_path, 'w') as file:
+        json.dump({'rows': train_rows, 'warm_start': warm_start}, file)
+
+
+if __name__ == '__main__':
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    train_models(config)
+
+    logger.info("Successfully trained and saved the Recommender models V2!")
@@ -1,106 +1,91 @@
-import yaml
-import pickle
 from loguru import logger
 import pandas as pd
 import numpy as np
-from catboost import CatBoostClassifier
-
-
-class Recommender_validation:
-    def __init__(self):
-        self.model = CatBoostClassifier(n_estimators=150, random_state=1)
-        self.cat_features = ['gender', 'country', 'city', 'os', 'source', 'topic']
-        self.cols_to_drop = ['user_id', 'exp_group', 'post_id', 'text']
-        
-        with open('config.yaml', 'r') as file:
-            config = yaml.safe_load(file)
-            user_data_path = config['processed_user_data_path']
-            post_data_path = config['processed_post_data_path']
-            result_data_path = config['processed_feed_data_path']
-        
-        self.user_data = pd.read_csv(user_data_path, sep=';', index_col=None)
-        self.post_data = pd.read_csv(post_data_path, sep=';', index_col=None)
-        self.result_df = pd.read_csv(result_data_path, sep=';', index_col=None)
-
-        self.mean_user_cr_by_age = round(self.result_df.groupby('age').user_likes_to_views_ratio.mean(), 3)
-        self.median_user_prop = round(self.result_df.groupby(['age', 'topic']).user_proportion_of_likes_by_topic.median(), 3)
-        self.users_proportion_of_likes_by_topics = round(self.result_df.groupby(['user_id', 'topic']).target.sum()
-                                                            / self.result_df.groupby('user_id').target.sum(), 3)
-
-    def fit(self, X, y):
-        logger.info("Fitting the model...")
-
-        self.model.fit(X, y, cat_features=self.cat_features, verbose=False)
-
-        logger.info("Successfully fitted the model!")
+from src.models.catboost_recommender_v2.base import BaseRecommender, read_config
+from src.models.catboost_recommender_v2.candidates import top_k
+
+
+class Recommender_validation(BaseRecommender):
+    def __init__(self, source=None):
+        super().__init__()
+
+        # The frames and user statistics of a v2 recommender built on the same processed data, not read again
+        if source is not None:
+            self.n_similar_candidates = source.n_similar_candidates
+            self.post_embeddings = source.post_embeddings
+            self.user_data = source.user_data
+            self.post_data = source.post_data
+            self.result_df = source.result_df[['user_id', 'post_id', 'age', 'topic', 'target',
+                                               'user_likes_to_views_ratio', 'user_proportion_of_likes_by_topic']]
+            self.mean_user_cr_by_age = source.mean_user_cr_by_age
+            self.median_user_prop = source.median_user_prop
+            self.users_proportion_of_likes_by_topics = source.users_proportion_of_likes_by_topics
+        else:
+            config = read_config()
+            self._read_serving_config(config)
+            self._load_data(config)
 
-        return self
+        self._build_serving_structures()
 
-    def predict(self, user_id: int, viewed_posts: np.array, limit: int = 5):
+    def predict(self, user_id: int, viewed_posts: np.array, limit: int = 5, n_candidates: int = None):
         logger.info("Predicting...")
 
-        # Preparing DataFrame for user: merged df with user_data for user_id and post_data
-        user = self.user_data[self.user_data.user_id == user_id].reset_index().drop('index', axis=1)
-        posts = self.post_data.copy()
-        posts = posts[posts.post_id.isin(viewed_posts)] # Taking the posts that have been viewed by user
-        posts['user_id'] = user_id
-        user_df = pd.merge(user, posts, on='user_id', how='right')
-
-        # Get necessary user's features
-        user_df = self._get_users_features(user_df=user_df, user_id=user_id)
+        # Building score matrix for user: prebuilt post features with user's features broadcast into it
+        rows = self.post_features.rows_for(viewed_posts) # Taking the posts that have been viewed by user
+        rows = self.candidates.generate(user_features=self.user_features.get(user_id),
+                                        n_candidates=n_candidates, rows=rows)
+        user_df = self._get_users_features(user_id=user_id, rows=rows)
 
-        # Predicting probabilities, sorting them in descending and building recs as top N posts by probs
-        posts['pred_prob'] = self.model.predict_proba(user_df.drop(self.cols_to_drop, axis=1))[:, 1]
-        sorted_posts = posts.sort_values('pred_prob', ascending=False).rename(columns={'post_id': 'id'})
-        recs = sorted_posts[['id', 'text', 'topic']].head(limit)
-        recs = recs.to_dict(orient='records')
+        # Predicting probabilities and building recs as top N posts by probs
+        pred_prob = self.model.predict_proba(user_df)[:, 1]
+        recs = self.post_features.payloads(rows=rows[top_k(scores=pred_prob, k=limit)])
 
         logger.info("Successfully predicted!")
 
         return recs
     
-    def _get_users_features(self, user_df: pd.DataFrame, user_id: int) -> pd.DataFrame:
-        if self.result_df[self.result_df.user_id == user_id].user_likes_to_views_ratio.values.size > 0:
-            user_likes_to_views_ratio = self.result_df[self.result_df.user_id == id].user_likes_to_views_ratio.iloc[0]
-            user_proportion_of_likes_by_topic = user_df.topic.map(self.users_proportion_of_likes_by_topics[id])
-        else:
-            age = self.user_data[self.user_data.user_id == user_id].age.values[0]
-            if age < 14:
-                age = 14
+    def candidate_posts(self, user_id: int, viewed_posts: np.array, n_candidates: int = None) -> np.array:
+        rows = self.candidates.generate(user_features=self.user_features.get(user_id),
+                                        n_candidates=n_candidates,
+                                        rows=self.post_features.rows_for(viewed_posts))
 
-            while self.median_user_prop.get(age) is None:
-                age -= 1
+        return self.post_features.post_ids[rows]
 
-            user_likes_to_views_ratio = self.mean_user_cr_by_age.get(age)
-            user_proportion_of_likes_by_topic = user_df.topic.map(self.median_user_prop.get(age))
+    def score_pairs(self, user_ids: np.array, post_ids: np.array) -> np.array:
+        # Predicted probability for every (user, post) pair in one model call, NaN for unknown users or posts
+        known, users_features, user_positions, rows = self._pairs_features(user_ids=user_ids, post_ids=post_ids)
 
-        user_df['user_likes_to_views_ratio'] = user_likes_to_views_ratio
-        user_df['user_proportion_of_likes_by_topic'] = user_proportion_of_likes_by_topic
+        scores = np.full(len(post_ids), np.nan)
+        if known.any():
+            user_df = self.post_features.build_pairs(users_features=users_features,
+                                                     user_positions=user_positions,
+                                                     rows=rows)
+            scores[known] = self.model.predict_proba(user_df)[:, 1]
 
-        return user_df
+        return scores
 
+    def candidate_scores(self, user_ids: np.array, post_ids: np.array) -> np.array:
+        # First stage scores of the two-stage mode for every (user, post) pair
+        known, users_features, user_positions, rows = self._pairs_features(user_ids=user_ids, post_ids=post_ids)
 
+        scores = np.full(len(post_ids), np.nan)
+        if known.any():
+            scores[known] = self.candidates.score_pairs(users_features=users_features,
+                                                        user_positions=user_positions,
+                                                        rows=rows)
 
-if __name__ == '__main__':
-    MODEL_PATH = 'src/models/catboost_recommender_v2/artifacts'
-    MODEL_NAME = 'validation_model_v2.pkl'
-
-    logger.info("Reading the train data")
-
-    with open('config.yaml', 'r') as file:
-        config = yaml.safe_load(file)
-        train_data_path = config['train_data_v2_path']
-    
-    train = pd.read_csv(train_data_path, sep=';', index_col=None)
+        return scores
 
-    logger.info("Successfully read the train data!")
+    def _pairs_features(self, user_ids: np.array, post_ids: np.array) -> tuple:
+        rows = self.post_features.rows_of(post_ids)
+        known = (rows >= 0) & (self.user_features.rows_of(user_ids) >= 0)
 
-    X_train = train.drop(['user_id', 'post_id', 'target'], axis=1)
-    y_train = train.target
+        unique_users, user_positions = np.unique(np.asarray(user_ids)[known], return_inverse=True)
+        users_features = [self.user_features.get(user_id) for user_id in unique_users]
 
-    recommender = Recommender_validation()
-    recommender.fit(X_train, y_train)
+        return known, users_features, user_positions, rows[known]
 
-    pickle.dump(recommender, open(f"{MODEL_PATH}/{MODEL_NAME}", 'wb'))
+    def _get_users_features(self, user_id: int, rows: np.ndarray = None) -> pd.DataFrame:
+        features = self.user_features.get(user_id)
 
-    logger.info("Successfully trained and saved the Recommender validation model V2!")
+        return self.post_features.build(user_features=features, rows=rows)
@@ -0,0 +1,109 @@
+import os
+import time
+import yaml
+import numpy as np
+from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from src.app.cache import model_version
+from src.app.precomputed import connect_table, encode_post_ids
+from src.data.storage import read_table
+
+
+_worker_model = None
+
+
+def _load_worker_model(model_path: str):
+    global _worker_model
+
+    from src.app.utils import load_model
+    _worker_model = load_model(model_path)
+    # Per-user lines of the models would flood the job's log
+    logger.disable('src.models')
+
+
+def _score_users(user_ids: np.ndarray, limit: int) -> List[List[int]]:
+    recommendations = _worker_model.predict_batch(user_ids=[int(user_id) for user_id in user_ids], limit=limit)
+
+    return [[post['id'] for post in posts] for posts in recommendations]
+
+
+def precompute_recommendations(model_name: str, model_path: str, user_data_path: str, post_data_path: str,
+                               path: str, top_n: int = 10, n_workers: int = 4, batch_size: int = 256,
+                               log_interval: float = 10) -> int:
+    # Written next to the served table and swapped in once complete; a crashed run resumes where it stopped
+    partial_path = f"{path}.partial"
+    expected = {'model_name': model_name, 'model_version': model_version(model_path), 'top_n': str(top_n)}
+
+    connection = connect_table(partial_path)
+    meta = dict(connection.execute("SELECT key, value FROM meta"))
+    if meta and any(meta.get(key) != value for key, value in expected.items()):
+        logger.info(f"Starting over: the unfinished table in {partial_path} is of another model")
+        connection.close()
+        os.remove(partial_path)
+        connection = connect_table(partial_path)
+        meta = {}
+
+    if not meta:
+        connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                               list({**expected, 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S')}.items()))
+        posts = read_table(post_data_path, columns=['post_id', 'text', 'topic'])
+        connection.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?, ?)",
+                               posts.itertuples(index=False, name=None))
+        connection.commit()
+
+    user_ids = np.unique(read_table(user_data_path, columns=['user_id']).user_id.values)
+    done = np.array([user_id for user_id, in connection.execute("SELECT user_id FROM recommendations")])
+    todo = np.setdiff1d(user_ids, done)
+    if len(done):
+        logger.info(f"Resuming: {len(user_ids) - len(todo)} of {len(user_ids)} users are already precomputed")
+
+    logger.info(f"Precomputing top {top_n} posts of {model_name} for {len(todo)} users with {n_workers} workers...")
+
+    started = last_log = time.monotonic()
+    completed = 0
+    batches = [todo[start:start + batch_size] for start in range(0, len(todo), batch_size)]
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_load_worker_model,
+                             initargs=(model_path,)) as executor:
+        for batch, recommendations in zip(batches, executor.map(_score_users, batches, [top_n] * len(batches))):
+            computed_at = time.time()
+            # Committed batch by batch, so a crash loses at most the batches in flight
+            connection.executemany("INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?)",
+                                   [(int(user_id), encode_post_ids(post_ids), computed_at)
+                                    for user_id, post_ids in zip(batch, recommendations)])
+            connection.commit()
+
+            completed += len(batch)
+            now = time.monotonic()
+            if now - last_log >= log_interval or completed == len(todo):
+                rate = completed / max(now - started, 1e-9)
+                logger.info(f"Precomputed {len(user_ids) - len(todo) + completed}/{len(user_ids)} users, "
+                            f"{rate:.0f} users/s, {(len(todo) - completed) / max(rate, 1e-9):.0f} s left")
+                last_log = now
+
+    connection.execute("INSERT OR REPLACE INTO meta VALUES ('finished_at', ?)", (time.strftime('%Y-%m-%dT%H:%M:%S'),))
+    connection.commit()
+    connection.close()
+    os.replace(partial_path, path)
+
+    logger.info(f"Successfully precomputed recommendations of {len(user_ids)} users to {path}")
+
+    return len(user_ids)
+
+
+if __name__ == '__main__':
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    # The table is built for the production model, the one requests without ?model= are served by
+    production_model = config.get('production_model', 'recommender_v2')
+
+    precompute_recommendations(model_name=production_model,
+                               model_path=config[f"{production_model}_path"],
+                               user_data_path=config['processed_user_data_path'],
+                               post_data_path=config['processed_post_data_path'],
+                               path=config.get('precomputed_path', 'data/precomputed/recommendations.sqlite'),
+                               top_n=config.get('precomputed_top_n', 10),
+                               n_workers=config.get('precomputed_workers', 4),
+                               batch_size=config.get('precomputed_batch_size', 256))
@@ -0,0 +1,30 @@
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+
+# Durations of the stages run by the current thread, only while a caller collects them
+_local = threading.local()
+
+
+@contextmanager
+def record_stages():
+    timings = _local.timings = {}
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+
+
+@contextmanager
+def stage(name: str):
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + perf_counter() - started
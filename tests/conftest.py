@@ -0,0 +1,94 @@
+import sys
+import yaml
+import pytest
+import importlib
+import pandas as pd
+from src.data.storage import write_table
+from src.data.synthetic import SyntheticDataGenerator
+from tests.fakes import FakeModel, save_fake_model
+
+
+def write_config(root: str, extension: str = '.csv', **overrides) -> dict:
+    # The data layout of config.yaml under root, in the format chosen by extension
+    config = {'raw_user_data_path': f"{root}/raw_data/user_data{extension}",
+              'raw_post_data_path': f"{root}/raw_data/post_data{extension}",
+              'raw_feed_data_path': f"{root}/raw_data/feed_data{extension}",
+              'raw_feed_delta_path': f"{root}/raw_data/feed_delta{extension}",
+              'processed_user_data_path': f"{root}/processed_data/user_data{extension}",
+              'processed_post_data_path': f"{root}/processed_data/post_data{extension}",
+              'processed_feed_data_path': f"{root}/processed_data/feed_data{extension}",
+              'train_data_v1_path': f"{root}/train_data/catboost_v1/train{extension}",
+              'train_data_v2_path': f"{root}/train_data/catboost_v2/train{extension}",
+              'validation_data_path': f"{root}/validation_data/validation_data{extension}",
+              'tfidf_cache_path': f"{root}/processed_data/tfidf",
+              'feature_counters_path': f"{root}/processed_data/counters",
+              **overrides}
+
+    with open('config.yaml', 'w') as file:
+        yaml.safe_dump(config, file)
+
+    return config
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # Everything reads config.yaml from the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def assert_frames_equal(left: pd.DataFrame, right: pd.DataFrame, **kwargs):
+    pd.testing.assert_frame_equal(left.reset_index(drop=True), right.reset_index(drop=True),
+                                  check_dtype=False, check_categorical=False, **kwargs)
+
+
+@pytest.fixture
+def service(workspace):
+    # Builds the app from a config.yaml written for the test, serving FakeModels
+    from fastapi.testclient import TestClient
+
+    clients = []
+
+    def start(models=('fake',), **overrides):
+        for offset, name in enumerate(models):
+            save_fake_model(str(workspace / f"{name}.pkl"), offset=offset)
+        config = {'production_model': models[0], 'served_models': list(models), 'cache_enabled': False,
+                  'inference_max_workers': 2, **{f"{name}_path": str(workspace / f"{name}.pkl") for name in models},
+                  **overrides}
+        with open('config.yaml', 'w') as file:
+            yaml.safe_dump(config, file)
+
+        sys.modules.pop('src.app.app', None)
+        module = importlib.import_module('src.app.app')
+        client = TestClient(module.app)
+        client.__enter__()
+        clients.append(client)
+
+        return client, module
+
+    yield start
+
+    for client in clients:
+        client.__exit__(None, None, None)
+    FakeModel.delay = 0.0
+
+
+@pytest.fixture(scope='session')
+def synthetic():
+    # A few thousand views: enough for every topic, cold and heavy users, still built in a second
+    return SyntheticDataGenerator(n_users=80, n_posts=40, n_views=4_000, seed=7, days=20, chunksize=1_000)
+
+
+def write_raw_data(config: dict, synthetic: SyntheticDataGenerator, feed: pd.DataFrame = None):
+    if feed is None:
+        feed = synthetic_feed(synthetic)
+
+    write_table(synthetic.user_data, config['raw_user_data_path'])
+    write_table(synthetic.post_data, config['raw_post_data_path'])
+    write_table(feed, config['raw_feed_data_path'])
+
+
+def synthetic_feed(synthetic: SyntheticDataGenerator) -> pd.DataFrame:
+    # In the layout of the raw feed file of DataLoader
+    feed = pd.concat(list(synthetic.iter_feed()), ignore_index=True)
+    return feed.rename(columns={'timestamp': 'date'})[['user_id', 'post_id', 'action', 'target', 'date']]
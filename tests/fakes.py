@@ -0,0 +1,28 @@
+import time
+import pickle
+
+
+class FakeModel:
+    # Recommends the posts after the user's id (shifted by offset), so every answer is known up front
+    delay = 0.0
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+        self.calls = 0
+
+    def predict(self, user_id: int, limit: int = 5) -> list:
+        self.calls += 1
+        time.sleep(FakeModel.delay)
+        return [fake_post(1 + (self.offset + user_id + i) % 20) for i in range(limit)]
+
+    def predict_batch(self, user_ids: list, limit: int = 5) -> list:
+        return [self.predict(user_id=user_id, limit=limit) for user_id in user_ids]
+
+
+def fake_post(post_id: int) -> dict:
+    return {'id': post_id, 'text': f"post {post_id}", 'topic': ['sport', 'tech'][(post_id - 1) % 2]}
+
+
+def save_fake_model(path: str, offset: int = 0):
+    with open(path, 'wb') as file:
+        pickle.dump(FakeModel(offset=offset), file)
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from src.app.batching import MicroBatcher
+from src.app.inference import PoolOverloadedError
+
+
+class FakePool:
+    # Stands in for InferencePool: scores after a delay and tracks how many calls overlap
+    def __init__(self, max_workers: int = 3, delay: float = 0.05, broken_users=(), bad_results: int = 0):
+        self.max_workers = max_workers
+        self.delay = delay
+        self.broken_users = set(broken_users)
+        self.bad_results = bad_results
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    async def run(self, model_name: str, method: str, **kwargs):
+        self.calls.append((model_name, method, kwargs))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+
+        if method == 'predict':
+            if kwargs['user_id'] in self.broken_users:
+                raise KeyError(kwargs['user_id'])
+            return self._recs(kwargs['user_id'], kwargs['limit'])
+
+        if self.bad_results:
+            self.bad_results -= 1
+            return None
+        if self.broken_users & set(kwargs['user_ids']):
+            raise KeyError('broken batch')
+        return [self._recs(user_id, kwargs['limit']) for user_id in kwargs['user_ids']]
+
+    @staticmethod
+    def _recs(user_id: int, limit: int) -> list:
+        return [{'id': user_id * 100 + i} for i in range(limit)]
+
+
+def _serve(pool: FakePool, requests: list, max_batch_size: int = 4, max_queue_size: int = 64) -> list:
+    async def main():
+        batcher = MicroBatcher(pool=pool, max_batch_size=max_batch_size, max_wait_ms=1, max_queue_size=max_queue_size)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.predict(model_name=model, user_id=user_id, limit=limit)
+                                          for model, user_id, limit in requests], return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    return asyncio.run(main())
+
+
+def test_batches_are_scored_concurrently_up_to_the_pool_size():
+    pool = FakePool(max_workers=3)
+    results = _serve(pool, [('m', user_id, 2) for user_id in range(40)])
+
+    assert results == [FakePool._recs(user_id, 2) for user_id in range(40)]
+    assert all(method == 'predict_batch' and len(kwargs['user_ids']) <= 4 for _, method, kwargs in pool.calls)
+    assert pool.max_running == 3
+
+
+def test_each_request_gets_its_own_limit_and_model():
+    pool = FakePool()
+    results = _serve(pool, [('a', 1, 1), ('b', 2, 3), ('a', 3, 2)])
+
+    assert results == [FakePool._recs(1, 1), FakePool._recs(2, 3), FakePool._recs(3, 2)]
+    assert {model for model, _, _ in pool.calls} == {'a', 'b'}
+
+
+def test_a_failed_batch_falls_back_to_single_predictions():
+    results = _serve(FakePool(broken_users=[2]), [('m', user_id, 2) for user_id in range(4)])
+
+    assert isinstance(results[2], KeyError)
+    assert [results[i] for i in (0, 1, 3)] == [FakePool._recs(user_id, 2) for user_id in (0, 1, 3)]
+
+
+def test_the_batcher_keeps_serving_after_an_unexpected_error():
+    # The first batch gets no usable results: its requests fail instead of hanging, the next ones are served
+    pool = FakePool(bad_results=1)
+    results = _serve(pool, [('m', user_id, 2) for user_id in range(8)])
+
+    assert isinstance(results[0], Exception)
+    assert results[-1] == FakePool._recs(7, 2)
+    assert all(isinstance(result, Exception) or result == FakePool._recs(user_id, 2)
+               for user_id, result in enumerate(results))
+
+
+def test_requests_beyond_the_queue_are_shed():
+    results = _serve(FakePool(max_workers=1, delay=0.2), [('m', user_id, 2) for user_id in range(20)],
+                     max_batch_size=2, max_queue_size=4)
+
+    assert any(isinstance(result, PoolOverloadedError) for result in results)
+    assert any(isinstance(result, list) for result in results)
@@ -0,0 +1,91 @@
+import os
+import pytest
+import pandas as pd
+from src.data.storage import read_table, write_table, table_partitions
+from src.features.build_features import FeatureEngineering, read_feature_table, read_high_water_mark
+from tests.conftest import write_config, write_raw_data, synthetic_feed, assert_frames_equal
+
+
+OUTPUTS = ['processed_user_data', 'processed_post_data', 'processed_feed_data', 'train_data_v1', 'train_data_v2']
+
+
+def _read_outputs(config: dict) -> dict:
+    return {name: read_table(config[f"{name}_path"]) for name in OUTPUTS}
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+def test_streaming_build_matches_the_full_build(workspace, synthetic, extension):
+    config = write_config(str(workspace), extension=extension)
+    write_raw_data(config, synthetic)
+
+    FeatureEngineering().process_data()
+    full = _read_outputs(config)
+
+    # Chunks much smaller than the feed, so counters and train data span many of them
+    FeatureEngineering(streaming=True, chunksize=700).process_data()
+    streaming = _read_outputs(config)
+
+    for name in OUTPUTS:
+        assert_frames_equal(streaming[name], full[name], obj=name)
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+def test_refresh_matches_a_full_rebuild(workspace, synthetic, extension):
+    config = write_config(str(workspace), extension=extension)
+    feed = synthetic_feed(synthetic)
+    split = feed.date.iloc[3_000]
+
+    write_raw_data(config, synthetic, feed=feed)
+    FeatureEngineering().process_data()
+    full = _read_current_outputs(config)
+    full['raw_feed_data'] = read_table(config['raw_feed_data_path'])
+
+    write_raw_data(config, synthetic, feed=feed[feed.date < split])
+    FeatureEngineering().process_data()
+    first_partition = _stat(config['train_data_v2_path'])
+    write_table(feed[feed.date >= split], config['raw_feed_delta_path'])
+    FeatureEngineering(streaming=True, chunksize=700).refresh(delta_path=config['raw_feed_delta_path'])
+    refreshed = _read_current_outputs(config)
+    refreshed['raw_feed_data'] = read_table(config['raw_feed_data_path'])
+
+    for name in full:
+        assert_frames_equal(refreshed[name], full[name], obj=name)
+    assert read_high_water_mark(config['feature_counters_path']) == feed.date.max()
+
+    if extension != '.csv':
+        # The delta is a partition of its own, the rows of the full build are not rewritten
+        partitions = table_partitions(config['train_data_v2_path'])
+        assert len(partitions) == 2
+        assert _stat(partitions[0]) == first_partition
+
+
+def test_refreshes_append_one_partition_each(workspace, synthetic):
+    config = write_config(str(workspace), extension='.parquet')
+    feed = synthetic_feed(synthetic)
+    splits = [feed.date.iloc[2_000], feed.date.iloc[3_000]]
+
+    write_raw_data(config, synthetic, feed=feed[feed.date < splits[0]])
+    FeatureEngineering().process_data()
+    for start, end in zip(splits, splits[1:] + [feed.date.max() + pd.Timedelta(seconds=1)]):
+        write_table(feed[(feed.date >= start) & (feed.date < end)], config['raw_feed_delta_path'])
+        FeatureEngineering(streaming=True).refresh(delta_path=config['raw_feed_delta_path'])
+
+    for name in ['raw_feed_data', 'train_data_v1', 'train_data_v2', 'processed_feed_data']:
+        assert len(table_partitions(config[f"{name}_path"])) == 3
+    assert len(read_table(config['raw_feed_data_path'])) == len(feed)
+
+    # A full rebuild goes back to one file
+    FeatureEngineering().process_data()
+    assert table_partitions(config['train_data_v2_path']) == [config['train_data_v2_path']]
+
+
+def _read_current_outputs(config: dict) -> dict:
+    outputs = _read_outputs(config)
+    for name in ['processed_feed_data', 'train_data_v2']:
+        outputs[name] = read_feature_table(config[f"{name}_path"], counters_path=config['feature_counters_path'])
+    return outputs
+
+
+def _stat(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,106 @@
+import time
+import asyncio
+import threading
+import pytest
+from src.app import inference
+from src.app.cache import InMemoryBackend, SqliteBackend, RecommendationCache
+from tests.fakes import save_fake_model, fake_post
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend_factory(request, tmp_path):
+    def create(max_size: int = 100, ttl_seconds: float = 60):
+        if request.param == 'sqlite':
+            return SqliteBackend(path=str(tmp_path / 'cache.sqlite'), max_size=max_size, ttl_seconds=ttl_seconds)
+        return InMemoryBackend(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    return create
+
+
+def test_backends_expire_entries(backend_factory):
+    backend = backend_factory(ttl_seconds=0.05)
+    backend.set('key', [{'id': 1}])
+    assert backend.get('key') == [{'id': 1}]
+
+    time.sleep(0.1)
+    assert backend.get('key') is None
+
+
+def test_backends_evict_the_least_recently_used_entries(backend_factory):
+    backend = backend_factory(max_size=2)
+    if isinstance(backend, SqliteBackend):
+        backend.EVICTION_INTERVAL = 1
+
+    backend.set('a', [1])
+    time.sleep(0.01)
+    backend.set('b', [2])
+    time.sleep(0.01)
+    backend.get('a')
+    time.sleep(0.01)
+    backend.set('c', [3])
+
+    assert backend.get('b') is None
+    assert backend.get('a') == [1] and backend.get('c') == [3]
+
+
+class ThreadRecordingBackend(InMemoryBackend):
+    blocking = True
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.current_thread())
+        return super().get(key)
+
+    def set(self, key, value):
+        self.threads.add(threading.current_thread())
+        super().set(key, value)
+
+
+def test_blocking_backends_are_called_off_the_event_loop():
+    backend = ThreadRecordingBackend()
+    cache = RecommendationCache(backend=backend, model_versions={'m': 'v1'})
+
+    async def main():
+        await cache.set_async(user_id=1, limit=5, value=[{'id': 1}], model_name='m')
+        return await cache.get_async(user_id=1, limit=5, model_name='m')
+
+    assert asyncio.run(main()) == [{'id': 1}]
+    assert threading.main_thread() not in backend.threads
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_entries_are_keyed_by_the_version_of_their_model():
+    cache = RecommendationCache(backend=InMemoryBackend(), model_versions={'a': 'a1', 'b': 'b1'})
+    cache.set(user_id=1, limit=5, value=['a'], model_name='a')
+    cache.set(user_id=1, limit=5, value=['b'], model_name='b')
+
+    cache.set_model_versions({'a': 'a1', 'b': 'b2'})
+
+    assert cache.get(user_id=1, limit=5, model_name='a') == ['a']
+    assert cache.get(user_id=1, limit=5, model_name='b') is None
+
+
+def test_reloading_one_model_keeps_the_cache_of_the_others(service, workspace):
+    client, _ = service(models=('a', 'b'), cache_enabled=True, admin_token='secret')
+
+    def recommend(model: str) -> list:
+        response = client.get('/post/recommendations/', params={'id': 3, 'time': '2021-12-30T00:00:00',
+                                                                 'limit': 2, 'model': model})
+        assert response.status_code == 200
+        return response.json()
+
+    assert recommend('a') == recommend('a') == [fake_post(4), fake_post(5)]
+    assert recommend('b') == [fake_post(5), fake_post(6)]
+    assert inference._worker_models['a'].model.calls == 1
+
+    # b is retrained: its file changes, a's does not
+    time.sleep(0.01)
+    save_fake_model(str(workspace / 'b.pkl'), offset=10)
+    assert client.post('/admin/reload', headers={'X-Admin-Token': 'secret'}).status_code == 200
+
+    assert recommend('a') == [fake_post(4), fake_post(5)]
+    assert inference._worker_models['a'].model.calls == 1
+    assert recommend('b') == [fake_post(14), fake_post(15)]
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.storage import read_table
+from src.features.build_features import FeatureEngineering
+from src.models.catboost_recommender_v2.feature_store import UserFeatureStore, PostFeatureBlock
+from tests.conftest import write_config, write_raw_data, assert_frames_equal
+
+
+COLS_TO_DROP = ['user_id', 'exp_group', 'post_id', 'text']
+
+
+@pytest.fixture
+def processed(workspace, synthetic):
+    config = write_config(str(workspace))
+    write_raw_data(config, synthetic)
+    FeatureEngineering().process_data()
+
+    user_data = read_table(config['processed_user_data_path'])
+    post_data = read_table(config['processed_post_data_path'])
+    result_df = read_table(config['processed_feed_data_path'])
+    feature_names = [column for column in read_table(config['train_data_v2_path']).columns
+                     if column not in ['user_id', 'post_id', 'target']]
+
+    # Users without any views, of ages with and without users in the feed
+    ages = np.sort(result_df.age.unique())
+    missing_age = next(age for age in range(ages[0], ages[-1]) if age not in ages)
+    cold_users = user_data.iloc[:4].assign(user_id=user_data.user_id.max() + 1 + np.arange(4),
+                                           age=[ages[0], missing_age, ages[len(ages) // 2], ages[-1] + 7])
+    user_data = pd.concat([user_data, cold_users], ignore_index=True)
+
+    return user_data, post_data, result_df, feature_names
+
+
+def _statistics(result_df: pd.DataFrame) -> dict:
+    # As computed by Recommender_v2 from its result_df
+    return {'mean_user_cr_by_age': round(result_df.groupby('age').user_likes_to_views_ratio.mean(), 3),
+            'median_user_prop': round(result_df.groupby(['age', 'topic']).user_proportion_of_likes_by_topic.median(), 3),
+            'users_proportion_of_likes_by_topics': round(result_df.groupby(['user_id', 'topic']).target.sum()
+                                                         / result_df.groupby('user_id').target.sum(), 3)}
+
+
+def _per_request_frame(user_data, post_data, result_df, statistics, user_id) -> pd.DataFrame:
+    # The score matrix of the original per-request lookup: merge, then scan result_df for the user
+    user = user_data[user_data.user_id == user_id].reset_index().drop('index', axis=1)
+    posts = post_data.copy()
+    posts['user_id'] = user_id
+    user_df = pd.merge(user, posts, on='user_id', how='right')
+
+    if result_df[result_df.user_id == user_id].user_likes_to_views_ratio.values.size > 0:
+        user_likes_to_views_ratio = result_df[result_df.user_id == user_id].user_likes_to_views_ratio.iloc[0]
+        user_proportion_of_likes_by_topic = user_df.topic.map(statistics['users_proportion_of_likes_by_topics'][user_id])
+    else:
+        age = user_data[user_data.user_id == user_id].age.values[0]
+        if age < 14:
+            age = 14
+        while statistics['median_user_prop'].get(age) is None:
+            age -= 1
+
+        user_likes_to_views_ratio = statistics['mean_user_cr_by_age'].get(age)
+        user_proportion_of_likes_by_topic = user_df.topic.map(statistics['median_user_prop'].get(age))
+
+    user_df['user_likes_to_views_ratio'] = user_likes_to_views_ratio
+    user_df['user_proportion_of_likes_by_topic'] = user_proportion_of_likes_by_topic
+
+    return user_df.drop(COLS_TO_DROP, axis=1)
+
+
+def _build(user_data, post_data, result_df, feature_names):
+    store = UserFeatureStore(user_data=user_data, result_df=result_df, **_statistics(result_df))
+    block = PostFeatureBlock(post_data=post_data, feature_names=feature_names, topic_index=store.topic_index)
+
+    return store, block
+
+
+def test_feature_store_matches_the_per_request_lookup(processed):
+    user_data, post_data, result_df, feature_names = processed
+    statistics = _statistics(result_df)
+    store, block = _build(*processed)
+
+    cold_users = user_data.user_id[~user_data.user_id.isin(result_df.user_id)].values
+    assert len(cold_users) >= 4
+
+    for user_id in np.concatenate([result_df.user_id.unique()[:20], cold_users]):
+        expected = _per_request_frame(user_data, post_data, result_df, statistics, user_id=user_id)[feature_names]
+        assert_frames_equal(block.build(user_features=store.get(user_id)), expected)
+
+
+def test_batches_match_single_users(processed):
+    user_data = processed[0]
+    store, block = _build(*processed)
+
+    user_ids = user_data.user_id.values[::10]
+    users_rows = [np.arange(i % 3, len(block), 2) for i in range(len(user_ids))]
+    batch = block.build_batch(users_features=[store.get(user_id) for user_id in user_ids], users_rows=users_rows)
+
+    expected = pd.concat([block.build(user_features=store.get(user_id), rows=rows)
+                          for user_id, rows in zip(user_ids, users_rows)])
+    assert_frames_equal(batch, expected)
+
+
+def test_the_bundle_round_trip_keeps_the_features(processed, tmp_path):
+    user_data = processed[0]
+    store, block = _build(*processed)
+
+    store.save(str(tmp_path / 'users'))
+    block.save(str(tmp_path / 'posts'))
+    loaded_store = UserFeatureStore.load(str(tmp_path / 'users'), mmap_mode='r')
+    loaded_block = PostFeatureBlock.load(str(tmp_path / 'posts'), mmap_mode='r')
+
+    for user_id in user_data.user_id.values[::10]:
+        assert_frames_equal(loaded_block.build(user_features=loaded_store.get(user_id)),
+                            block.build(user_features=store.get(user_id)))
+    assert loaded_block.payloads(rows=np.arange(5)) == block.payloads(rows=np.arange(5))
+
+
+def test_unknown_users_are_a_key_error(processed):
+    store, _ = _build(*processed)
+
+    with pytest.raises(KeyError):
+        store.get(10 ** 9)
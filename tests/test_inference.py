@@ -0,0 +1,40 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from src.app.inference import InferencePool, PoolOverloadedError
+from tests.fakes import FakeModel, save_fake_model, fake_post
+
+
+def test_the_pool_sheds_requests_beyond_its_workers_and_queue(workspace):
+    save_fake_model(str(workspace / 'fake.pkl'))
+    FakeModel.delay = 0.1
+    pool = InferencePool(model_paths={'fake': str(workspace / 'fake.pkl')}, max_workers=2, max_queue_size=1)
+
+    async def main():
+        await pool.start()
+        return await asyncio.gather(*[pool.run('fake', 'predict', user_id=user_id, limit=2) for user_id in range(6)],
+                                    return_exceptions=True)
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        FakeModel.delay = 0.0
+        pool.shutdown()
+
+    # Two running and one waiting are served, the rest is rejected right away
+    assert results[:3] == [[fake_post(1 + user_id), fake_post(2 + user_id)] for user_id in range(3)]
+    assert all(isinstance(result, PoolOverloadedError) for result in results[3:])
+    assert pool.pending == 0
+
+
+def test_an_overloaded_service_answers_503(service):
+    client, _ = service(inference_max_workers=1, inference_max_queue_size=0)
+    FakeModel.delay = 0.2
+
+    def request(user_id: int) -> int:
+        return client.get('/post/recommendations/', params={'id': user_id, 'time': '2021-12-30T00:00:00'}).status_code
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        statuses = list(executor.map(request, range(6)))
+
+    assert 200 in statuses and 503 in statuses
+    assert set(statuses) == {200, 503}
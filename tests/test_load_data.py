@@ -0,0 +1,128 @@
+import os
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+from src.data.load_data import DataLoader
+from src.data.storage import read_table
+from tests.conftest import write_config
+
+
+@pytest.fixture
+def database(workspace, synthetic):
+    database_url = f"sqlite:///{workspace}/feed.db"
+    synthetic.write_database(database_url)
+
+    with create_engine(database_url).connect() as conn:
+        feed = pd.read_sql(text("SELECT * FROM feed_data ORDER BY timestamp"), conn)
+    feed['timestamp'] = pd.to_datetime(feed.timestamp)
+
+    return database_url, feed
+
+
+def _posts(value) -> list:
+    # Native lists of the columnar formats, "[1, 2]" strings of CSV
+    return [int(post) for post in value.strip('[]').split(',') if post] if isinstance(value, str) else list(value)
+
+
+def _loader(database_url: str, limit: int, validation_limit: int, monkeypatch) -> DataLoader:
+    # Chunks much smaller than a partition, so users span chunks
+    monkeypatch.setattr(DataLoader, 'CHUNKSIZE', 97)
+    return DataLoader(database_url=database_url, limit_feed_data=limit, limit_validation_data=validation_limit)
+
+
+@pytest.mark.parametrize('limit', [0, 1, 1_500, 3_999])
+def test_feed_bounds_are_the_timestamps_of_the_row_limits(workspace, database, limit, monkeypatch):
+    database_url, feed = database
+    write_config(str(workspace))
+    split, end = _loader(database_url, limit=limit, validation_limit=1_000, monkeypatch=monkeypatch)._feed_data_bounds()
+
+    # The timestamp of row limit, and of the 1000th row from it
+    timestamps = feed.timestamp.values
+    assert split == timestamps[limit]
+    validation_end = (timestamps < split).sum() + 1_000
+    if validation_end < len(timestamps):
+        assert end == timestamps[validation_end]
+    else:
+        assert end == feed.timestamp.max() + pd.Timedelta(seconds=1)
+
+
+def test_feed_bounds_past_the_last_row(workspace, database, monkeypatch):
+    database_url, feed = database
+    write_config(str(workspace))
+    split, end = _loader(database_url, limit=10 ** 6, validation_limit=10, monkeypatch=monkeypatch)._feed_data_bounds()
+
+    assert split == end == feed.timestamp.max() + pd.Timedelta(seconds=1)
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet'])
+def test_load_data_splits_the_feed_into_train_and_validation(workspace, database, synthetic, extension, monkeypatch):
+    database_url, feed = database
+    config = write_config(str(workspace), extension=extension)
+    _loader(database_url, limit=2_500, validation_limit=1_000, monkeypatch=monkeypatch).load_data()
+
+    split = feed.timestamp.values[2_500]
+    end = feed.timestamp.values[(feed.timestamp.values < split).sum() + 1_000]
+
+    assert len(read_table(config['raw_user_data_path'])) == len(synthetic.user_data)
+    assert len(read_table(config['raw_post_data_path'])) == len(synthetic.post_data)
+    train = read_table(config['raw_feed_data_path'])
+    assert len(train) == (feed.timestamp < split).sum()
+    assert pd.to_datetime(train.date).is_monotonic_increasing
+
+    # Per user, in time order, as one aggregation over the whole validation range
+    validation = read_table(config['validation_data_path'])
+    expected = feed[(feed.timestamp >= split) & (feed.timestamp < end)]
+    viewed = expected.groupby('user_id').post_id.agg(list)
+    liked = expected[expected.target == 1].groupby('user_id').post_id.agg(list)
+
+    assert validation.user_id.tolist() == viewed.index.tolist()
+    for row in validation.itertuples():
+        assert _posts(row.viewed_posts) == viewed[row.user_id]
+        assert _posts(row.liked_posts) == liked.get(row.user_id, [])
+
+
+def test_empty_tables_are_still_written(workspace, database, monkeypatch):
+    database_url, _ = database
+    config = write_config(str(workspace))
+    with create_engine(database_url).begin() as conn:
+        conn.execute(text("DELETE FROM post_text_df"))
+
+    # And no validation data: the split is past the last row
+    _loader(database_url, limit=10 ** 6, validation_limit=10, monkeypatch=monkeypatch).load_data()
+
+    assert read_table(config['raw_post_data_path']).empty
+    assert 'post_id' in read_table(config['raw_post_data_path']).columns
+    assert read_table(config['validation_data_path']).empty
+
+
+def test_load_delta_stops_at_the_moved_validation_window(workspace, database, monkeypatch):
+    database_url, feed = database
+    config = write_config(str(workspace))
+    since = feed.timestamp.iloc[1_999]
+
+    rows = _loader(database_url, limit=2_000, validation_limit=1_000,
+                   monkeypatch=monkeypatch).load_delta(since=since, feed_delta_path=config['raw_feed_delta_path'])
+
+    # The latest 1000 rows are the validation data, the rows between the last refresh and them the delta
+    timestamps = feed.timestamp.values
+    split = timestamps[(timestamps < since).sum() + (timestamps >= since).sum() - 1_000]
+    delta = read_table(config['raw_feed_delta_path'])
+    assert rows == len(delta) == ((feed.timestamp > since) & (feed.timestamp < split)).sum()
+    assert pd.to_datetime(delta.date).max() < split
+
+    validation = read_table(config['validation_data_path'])
+    assert validation.user_id.tolist() == sorted(feed[feed.timestamp >= split].user_id.unique())
+
+
+def test_load_delta_keeps_a_configured_validation_window(workspace, database, monkeypatch):
+    database_url, feed = database
+    split = feed.timestamp.iloc[3_000]
+    config = write_config(str(workspace), feed_data_split_timestamp=str(split))
+    loader = _loader(database_url, limit=2_000, validation_limit=1_000, monkeypatch=monkeypatch)
+
+    rows = loader.load_delta(since=feed.timestamp.iloc[1_999], feed_delta_path=config['raw_feed_delta_path'])
+    assert rows == ((feed.timestamp > feed.timestamp.iloc[1_999]) & (feed.timestamp < split)).sum()
+    assert not os.path.exists(config['validation_data_path'])
+
+    # Nothing new before the window
+    assert loader.load_delta(since=split, feed_delta_path=config['raw_feed_delta_path']) == 0
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from src.metrics import hitrate_at_k, ranking_metrics
+
+
+def _random_rankings(seed: int, n_users: int = 200, n_posts: int = 30):
+    rng = np.random.default_rng(seed)
+
+    viewed, liked, scores = [], [], []
+    for user in range(n_users):
+        user_viewed = np.sort(rng.choice(n_posts, size=rng.integers(1, 15), replace=False)) + 1
+        # Every fifth user liked nothing
+        user_liked = [] if user % 5 == 0 else rng.choice(user_viewed, size=rng.integers(1, len(user_viewed) + 1),
+                                                         replace=False)
+        viewed.append(user_viewed)
+        liked.append(np.asarray(user_liked, dtype=np.int64))
+        # Coarse scores, so most users have ties
+        scores.append(rng.integers(0, 4, size=len(user_viewed)) / 4)
+
+    return viewed, liked, scores
+
+
+def _csr(lists):
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(values) for values in lists])
+    return indptr, np.concatenate(lists).astype(np.int64)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_ranking_metrics_match_per_user_hitrate(seed):
+    viewed, liked, scores = _random_rankings(seed)
+    k_values = [1, 3, 5]
+
+    indptr, items = _csr(viewed)
+    liked_indptr, liked_items = _csr(liked)
+    metrics = ranking_metrics(indptr=indptr, items=items, scores=np.concatenate(scores).astype(float),
+                              liked_indptr=liked_indptr, liked_items=liked_items, k_values=k_values)
+
+    for k in k_values:
+        # Recommendations as the models built them: viewed posts by descending score, ties in viewed order
+        recs = [user_viewed[np.argsort(-user_scores, kind='stable')] for user_viewed, user_scores in zip(viewed, scores)]
+
+        hitrate = np.mean([hitrate_at_k(liked_posts=user_liked, recommended_posts=user_recs, k=k)
+                           for user_liked, user_recs in zip(liked, recs)])
+        precision = np.mean([np.isin(user_recs[:k], user_liked).sum() / k for user_liked, user_recs in zip(liked, recs)])
+        recall = np.mean([np.isin(user_recs[:k], user_liked).sum() / len(user_liked)
+                          for user_liked, user_recs in zip(liked, recs) if len(user_liked)])
+
+        assert metrics[f"hitrate@{k}"] == pytest.approx(hitrate)
+        assert metrics[f"precision@{k}"] == pytest.approx(precision)
+        assert metrics[f"recall@{k}"] == pytest.approx(recall)
+
+
+def test_unranked_items_are_never_recommended():
+    indptr, items = _csr([np.array([1, 2, 3])])
+    liked_indptr, liked_items = _csr([np.array([1])])
+
+    metrics = ranking_metrics(indptr=indptr, items=items, scores=np.array([np.nan, 0.5, 0.1]),
+                              liked_indptr=liked_indptr, liked_items=liked_items, k_values=[2], catalog_size=10)
+
+    assert metrics['hitrate@2'] == 0.0
+    assert metrics['coverage@2'] == pytest.approx(0.2)
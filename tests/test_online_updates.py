@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from catboost import CatBoostClassifier
+from src.data.storage import read_table
+from src.features.build_features import FeatureEngineering
+from src.models.catboost_recommender_v2 import Recommender
+from tests.conftest import write_config, write_raw_data, synthetic_feed
+
+
+def _recommender(config: dict, model: CatBoostClassifier = None) -> Recommender:
+    recommender = Recommender()
+    if model is not None:
+        return recommender.set_model(model)
+
+    # A few trees are enough for the score matrix layout
+    train = read_table(config['train_data_v2_path'])
+    recommender.model = CatBoostClassifier(n_estimators=3, random_state=1)
+    return recommender.fit(train.drop(['user_id', 'post_id', 'target'], axis=1), train.target)
+
+
+@pytest.fixture
+def replayed(workspace, synthetic):
+    config = write_config(str(workspace))
+    feed = synthetic_feed(synthetic)
+    split = feed.date.iloc[3_000]
+
+    write_raw_data(config, synthetic, feed=feed[feed.date < split])
+    FeatureEngineering().process_data()
+    online = _recommender(config)
+
+    # Every event after the split, likes included, as the service receives them
+    for event in feed[feed.date >= split].itertuples():
+        online.record_event(user_id=event.user_id, post_id=event.post_id, action=event.action, target=event.target)
+
+    write_raw_data(config, synthetic, feed=feed)
+    FeatureEngineering().process_data()
+    rebuilt = _recommender(config, model=online.model)
+
+    return online, rebuilt, feed[feed.date >= split]
+
+
+def test_like_events_are_not_counted_twice(replayed):
+    online, rebuilt, _ = replayed
+
+    np.testing.assert_array_equal(online.post_features.likes, rebuilt.post_features.likes)
+    np.testing.assert_array_equal(online.post_features.views, rebuilt.post_features.views)
+    np.testing.assert_array_equal(online.post_features.post_columns['post_likes_to_views_ratio'],
+                                  rebuilt.post_features.post_columns['post_likes_to_views_ratio'])
+
+
+def test_replayed_user_features_match_a_rebuild(replayed):
+    online, rebuilt, events = replayed
+
+    for user_id in events[events.action == 'view'].user_id.unique():
+        online_features, rebuilt_features = online.user_features.get(user_id), rebuilt.user_features.get(user_id)
+
+        assert online_features['user_likes_to_views_ratio'] == rebuilt_features['user_likes_to_views_ratio']
+        np.testing.assert_array_equal(online_features['user_proportion_of_likes_by_topic'],
+                                      rebuilt_features['user_proportion_of_likes_by_topic'])
@@ -0,0 +1,55 @@
+import os
+import sys
+import subprocess
+import pandas as pd
+from src.app.cache import model_version
+from src.app.precomputed import PrecomputedRecommendations
+from src.models.precompute import precompute_recommendations
+from tests.fakes import save_fake_model, fake_post
+
+
+def _build_table(workspace, top_n: int = 4) -> dict:
+    paths = {'model_path': str(workspace / 'model.pkl'),
+             'user_data_path': str(workspace / 'user_data.csv'),
+             'post_data_path': str(workspace / 'post_data.csv'),
+             'path': str(workspace / 'precomputed' / 'recommendations.sqlite')}
+    save_fake_model(paths['model_path'])
+    pd.DataFrame({'user_id': range(100, 130)}).to_csv(paths['user_data_path'], sep=';', index=False)
+    pd.DataFrame({'post_id': range(1, 21), 'text': [f"post {i}" for i in range(1, 21)],
+                  'topic': ['sport', 'tech'] * 10}).to_csv(paths['post_data_path'], sep=';', index=False)
+
+    precompute_recommendations(model_name='fake', top_n=top_n, n_workers=2, batch_size=7, **paths)
+
+    return paths
+
+
+def test_precomputed_lookup_serves_the_table_of_the_served_model(workspace):
+    paths = _build_table(workspace)
+    version = model_version(paths['model_path'])
+    table = PrecomputedRecommendations(path=paths['path'])
+
+    assert table.get(user_id=105, limit=3, model_name='fake', model_version=version) == \
+        [fake_post(post_id) for post_id in [6, 7, 8]]
+    assert table.hits == 1
+    assert not os.path.exists(paths['path'] + '.partial')
+
+    # Another model, another version, more posts than kept or an unknown user are scored live
+    assert table.get(user_id=105, limit=3, model_name='other', model_version=version) is None
+    assert table.get(user_id=105, limit=3, model_name='fake', model_version='retrained') is None
+    assert table.get(user_id=105, limit=5, model_name='fake', model_version=version) is None
+    assert table.get(user_id=999, limit=3, model_name='fake', model_version=version) is None
+    assert table.misses == 4
+
+
+def test_precomputed_lookup_skips_stale_rows(workspace):
+    paths = _build_table(workspace)
+    table = PrecomputedRecommendations(path=paths['path'], max_age_seconds=-1)
+
+    assert table.get(user_id=105, limit=3, model_name='fake', model_version=model_version(paths['model_path'])) is None
+    assert table.stale == 1
+
+
+def test_precompute_job_does_not_build_the_service():
+    # The job must run where the served models are missing
+    code = "import sys, src.models.precompute; assert 'src.app.app' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
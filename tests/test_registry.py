@@ -0,0 +1,49 @@
+import time
+import pytest
+from src.app.registry import served_models
+from tests.fakes import save_fake_model, fake_post
+
+
+CONFIG = {'production_model': 'recommender_v2', 'recommender_v1_path': 'v1.pkl', 'recommender_v2_path': 'v2.pkl'}
+
+
+def test_only_the_production_model_is_served_by_default():
+    assert served_models(CONFIG) == ({'recommender_v2': 'v2.pkl'}, 'recommender_v2')
+    assert served_models({**CONFIG, 'served_models': ['recommender_v1']})[0] == {'recommender_v1': 'v1.pkl',
+                                                                                'recommender_v2': 'v2.pkl'}
+
+
+def test_the_models_of_an_experiment_are_served():
+    config = {**CONFIG, 'served_models': ['recommender_v2'], 'experiment_enabled': True,
+              'experiment_groups': {'control': 'recommender_v1', 'test': 'recommender_v2'}}
+
+    assert set(served_models(config)[0]) == {'recommender_v1', 'recommender_v2'}
+
+
+def _recommend(client) -> list:
+    response = client.get('/post/recommendations/', params={'id': 3, 'time': '2021-12-30T00:00:00', 'limit': 1})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.parametrize('headers', [{}, {'X-Admin-Token': 'anything'}])
+def test_reloads_are_disabled_without_an_admin_token(service, headers):
+    client, _ = service(admin_token=None)
+
+    assert client.post('/admin/reload', headers=headers).status_code == 403
+
+
+def test_reloads_swap_in_the_retrained_model(service, workspace):
+    client, _ = service(admin_token='secret')
+    assert _recommend(client) == [fake_post(4)]
+
+    time.sleep(0.01)
+    save_fake_model(str(workspace / 'fake.pkl'), offset=10)
+    assert client.post('/admin/reload').status_code == 403
+    assert client.post('/admin/reload', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert _recommend(client) == [fake_post(4)]
+
+    response = client.post('/admin/reload', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert response.json()['default_model'] == 'fake'
+    assert _recommend(client) == [fake_post(14)]